@@ -0,0 +1,540 @@
+"""Catalog response cache shared by the workers on a host.
+
+Listing responses (documents, tags, users, categories) are stored as
+rendered JSON in a local SQLite file, CATALOG_CACHE_PATH, that every worker
+process opens, so a listing built by one worker serves all of them without
+an external cache service.
+
+Each entry is stamped with the versions of the catalog scopes it was built
+from. The versions are rows of the catalog_versions table, and every write
+to a catalog table bumps its scope in the same transaction, through the
+session hooks below, so a write committed by any worker on any host makes
+the entries built from older data unreachable. The stamp also includes a
+random ``epoch`` row, so a recreated database never matches entries built
+from the old one.
+
+Only ORM writes are seen: flushes, and insert/update/delete statements run
+through db.session. Raw SQL that modifies a catalog table must call
+bump_versions() itself.
+
+In front of the file, each worker keeps its most used responses in memory
+(LocalCache) and the catalog versions too (VersionWatcher), so a warm
+listing needs no query at all. A background thread per worker keeps those
+versions current:
+
+- On PostgreSQL every bump also sends ``NOTIFY catalog_changes`` with
+  ``scope:version`` when the transaction commits, and the thread LISTENs on
+  a connection of its own, evicting only the entries that depend on a
+  changed scope. After a reconnect it reloads every version, since
+  notifications sent while it was away are lost.
+- On SQLite, and behind PgBouncer in transaction pooling mode, where LISTEN
+  does not work, it polls catalog_versions every CATALOG_POLL_SECONDS.
+
+A worker applies its own commits at once; other workers see them when the
+notification or the next poll arrives. While the thread is disconnected or
+behind, and for requests that read from the replica, the versions are read
+from the database on every request instead.
+"""
+import os
+import random
+import select
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, g
+from sqlalchemy import event, func
+from models import db, CatalogVersion
+from metrics import CATALOG_CACHE_EVENTS
+from db_pool import DB_PGBOUNCER
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+CATALOG_CACHE_ENABLED = os.getenv('CATALOG_CACHE_ENABLED', 'true').lower() == 'true'
+# Holds rendered per-user listings: keep it out of shared directories such as /tmp
+CATALOG_CACHE_PATH = os.getenv('CATALOG_CACHE_PATH', os.path.join(BASE_DIR, 'instance', 'catalog-cache.db'))
+CATALOG_CACHE_MAX_ENTRIES = int(os.getenv('CATALOG_CACHE_MAX_ENTRIES', '10000'))
+CATALOG_LOCAL_MAX_MB = int(os.getenv('CATALOG_LOCAL_MAX_MB', '32'))
+CATALOG_POLL_SECONDS = float(os.getenv('CATALOG_POLL_SECONDS', '1'))
+CATALOG_LISTEN_RETRY_SECONDS = float(os.getenv('CATALOG_LISTEN_RETRY_SECONDS', '5'))
+
+# The scope whose version a write to each table bumps
+SCOPES_BY_TABLE = {
+    'documents': 'documents',
+    'document_visibility': 'documents',
+    'tags': 'tags',
+    'user_tags': 'tags',
+    'users': 'users',
+    'categories': 'categories',
+}
+CATALOG_SCOPES = sorted(set(SCOPES_BY_TABLE.values()))
+EPOCH = 'epoch'
+NOTIFY_CHANNEL = 'catalog_changes'
+# pg_advisory_xact_lock key that serializes catalog writers
+WRITE_LOCK_KEY = 0x5E0CA7A1
+
+# A silent LISTEN connection is checked this often, to notice it has died
+LISTEN_IDLE_CHECK_SECONDS = 30
+
+# Checked for entries over the limit every this many stores
+PRUNE_EVERY = 100
+
+
+class SharedCache:
+    """Key/value store in a SQLite file that the worker processes on a host share.
+
+    One entry per key: storing a key replaces its entry, and a lookup only
+    hits if the stamp matches. The file is in WAL mode so readers never wait
+    for a writer. Errors count as misses; the cache never fails a request.
+    """
+
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self._connection = None
+        self._connection_pid = None
+        self._lock = threading.Lock()
+        self._stores = 0
+        self._stats = {'hits': 0, 'misses': 0, 'stores': 0, 'errors': 0, 'pruned': 0}
+
+    def _connect(self):
+        # One connection per process; a forked child must not reuse its parent's
+        if self._connection is None or self._connection_pid != os.getpid():
+            self._secure_file()
+            connection = sqlite3.connect(self.path, timeout=1, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, stamp TEXT NOT NULL, body BLOB NOT NULL, stored_at REAL NOT NULL)"
+            )
+            self._connection = connection
+            self._connection_pid = os.getpid()
+        return self._connection
+
+    def _secure_file(self):
+        """Create the cache file readable by this user only, and refuse one another user owns.
+
+        SQLite gives the -wal and -shm files the database file's permissions.
+        Problems are raised as sqlite3 errors, so they count as cache errors.
+        """
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, mode=0o700, exist_ok=True)
+            for path, create in ((self.path, True), (self.path + '-wal', False), (self.path + '-shm', False)):
+                try:
+                    fd = os.open(path, os.O_RDWR | os.O_NOFOLLOW | (os.O_CREAT if create else 0), 0o600)
+                except FileNotFoundError:
+                    continue
+                try:
+                    status = os.fstat(fd)
+                    if status.st_uid != os.getuid():
+                        raise sqlite3.OperationalError(f"{path} is owned by another user")
+                    if status.st_mode & 0o077:
+                        os.fchmod(fd, 0o600)
+                finally:
+                    os.close(fd)
+        except OSError as e:
+            raise sqlite3.OperationalError(f"cannot secure {self.path}: {e}") from e
+
+    def get(self, key, stamp):
+        """Body stored for ``key`` under ``stamp``, or None"""
+        try:
+            with self._lock:
+                row = self._connect().execute(
+                    "SELECT body FROM entries WHERE key = ? AND stamp = ?", (key, stamp)
+                ).fetchone()
+        except sqlite3.Error as e:
+            print(f"⚠️ Catalog cache read failed: {e}")
+            self._count('errors')
+            return None
+        self._count('hits' if row else 'misses')
+        return bytes(row[0]) if row else None
+
+    def set(self, key, stamp, body):
+        try:
+            with self._lock:
+                connection = self._connect()
+                connection.execute(
+                    "INSERT OR REPLACE INTO entries (key, stamp, body, stored_at) VALUES (?, ?, ?, ?)",
+                    (key, stamp, body, time.time())
+                )
+                self._stores += 1
+                pruned = self._prune(connection) if self._stores % PRUNE_EVERY == 0 else 0
+        except sqlite3.Error as e:
+            print(f"⚠️ Catalog cache write failed: {e}")
+            self._count('errors')
+            return
+        self._count('stores')
+        if pruned:
+            self._count('pruned', pruned)
+
+    def _prune(self, connection):
+        """Drop the oldest entries over max_entries; returns how many"""
+        count = connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        if count <= self.max_entries:
+            return 0
+        connection.execute(
+            "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY stored_at LIMIT ?)",
+            (count - self.max_entries,)
+        )
+        return count - self.max_entries
+
+    def clear(self):
+        with self._lock:
+            self._connect().execute("DELETE FROM entries")
+
+    def stats(self):
+        """This process's counters plus the shared file's entry count"""
+        try:
+            with self._lock:
+                entries = self._connect().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        except sqlite3.Error:
+            entries = None
+        with self._lock:
+            counters = dict(self._stats)
+        return {
+            'enabled': CATALOG_CACHE_ENABLED,
+            'path': self.path,
+            'entries': entries,
+            'max_entries': self.max_entries,
+            **counters
+        }
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+        CATALOG_CACHE_EVENTS.labels(name).inc(amount)
+
+
+class LocalCache:
+    """Per-process LRU of rendered responses, capped in bytes"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (stamp, scopes, body)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'invalidations': 0}
+
+    def get(self, key, stamp):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != stamp:
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+        CATALOG_CACHE_EVENTS.labels('local_hits').inc()
+        return entry[2]
+
+    def set(self, key, stamp, scopes, body):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (stamp, frozenset(scopes), body)
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, scopes):
+        """Drop the entries built from any of ``scopes``"""
+        with self._lock:
+            keys = [key for key, (_, entry_scopes, _) in self._entries.items() if entry_scopes & scopes]
+            for key in keys:
+                self._remove(key)
+            self._stats['invalidations'] += len(keys)
+        if keys:
+            CATALOG_CACHE_EVENTS.labels('invalidations').inc(len(keys))
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry:
+            self._bytes -= len(entry[2])
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes, 'max_bytes': self.max_bytes,
+                    **self._stats}
+
+
+class VersionWatcher:
+    """This process's copy of catalog_versions, kept current by a background thread"""
+
+    def __init__(self, poll_seconds, retry_seconds, on_change):
+        self.poll_seconds = poll_seconds
+        self.retry_seconds = retry_seconds
+        self.listeners = [on_change]
+        self.versions = {}
+        self.mode = None  # listen, poll or off
+        self.live = False
+        self.updated_at = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stats = {'notifications': 0, 'polls': 0, 'reconnects': 0}
+
+    def ensure_started(self, engine):
+        """Start this process's watcher thread unless it is running"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # A forked worker inherits its parent's versions but not its thread
+            self._pid = os.getpid()
+            self.versions = {}
+            self.live = False
+            if engine.url.get_backend_name() == 'sqlite' and engine.url.database in (None, '', ':memory:'):
+                # One shared connection; a second thread on it is not safe
+                self.mode = 'off'
+                return
+            if engine.dialect.name == 'postgresql' and not DB_PGBOUNCER:
+                self.mode, target = 'listen', self._listen
+            else:
+                self.mode, target = 'poll', self._poll
+            threading.Thread(target=target, args=(engine,), name='catalog-versions', daemon=True).start()
+
+    def stamp(self, scopes):
+        """Stamp of ``scopes`` from memory, or None when that may be out of date"""
+        if not self.live:
+            return None
+        if self.mode == 'poll' and time.monotonic() - self.updated_at > 3 * self.poll_seconds:
+            return None
+        versions = self.versions
+        names = [EPOCH, *sorted(scopes)]
+        if any(name not in versions for name in names):
+            return None
+        return format_stamp(names, versions)
+
+    def merge(self, versions, complete=False):
+        """Apply versions read or announced elsewhere; ``complete`` is a full reload"""
+        with self._lock:
+            current = self.versions
+            if complete and versions.get(EPOCH) != current.get(EPOCH):
+                # Another database: nothing in memory applies
+                changed = set(current) | set(versions)
+                self.versions = dict(versions)
+            else:
+                # Versions only go up; a read that raced a newer notification must not win
+                changed = {name for name, version in versions.items() if version > current.get(name, -1)}
+                self.versions = {**current, **{name: versions[name] for name in changed}}
+        if changed:
+            for listener in self.listeners:
+                listener(changed)
+
+    def subscribe(self, listener):
+        """Call ``listener(scopes)`` whenever versions change"""
+        self.listeners.append(listener)
+
+    def _load(self, execute):
+        return dict(execute("SELECT name, version FROM catalog_versions"))
+
+    def _listen(self, engine):
+        connect_args, connect_kwargs = engine.dialect.create_connect_args(engine.url)
+        while True:
+            connection = None
+            try:
+                # Outside the pool: this connection stays checked out for good
+                connection = engine.dialect.connect(*connect_args, **connect_kwargs)
+                connection.autocommit = True
+                cursor = connection.cursor()
+
+                def execute(sql):
+                    cursor.execute(sql)
+                    return cursor.fetchall()
+
+                # LISTEN first, so no change falls between the load and the first notification
+                cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                self.merge(self._load(execute), complete=True)
+                self.live = True
+                print(f"✅ Catalog cache listening for {NOTIFY_CHANNEL} notifications")
+                while True:
+                    readable, _, _ = select.select([connection], [], [], LISTEN_IDLE_CHECK_SECONDS)
+                    if not readable:
+                        cursor.execute("SELECT 1")
+                        continue
+                    connection.poll()
+                    changes = {}
+                    while connection.notifies:
+                        scope, _, version = connection.notifies.pop(0).payload.partition(':')
+                        changes[scope] = max(int(version), changes.get(scope, 0))
+                    if changes:
+                        self._count('notifications', len(changes))
+                        self.merge(changes)
+            except Exception as e:
+                self.live = False
+                self._count('reconnects')
+                print(f"⚠️ Catalog cache listener disconnected, retrying in {self.retry_seconds:.0f}s: {e}")
+                if connection is not None:
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
+                time.sleep(self.retry_seconds)
+
+    def _poll(self, engine):
+        table = CatalogVersion.__table__
+        while True:
+            try:
+                with engine.connect() as connection:
+                    versions = dict(connection.execute(db.select(table.c.name, table.c.version)).all())
+                self.merge(versions, complete=True)
+                self.updated_at = time.monotonic()
+                if not self.live:
+                    print(f"✅ Catalog cache polling catalog_versions every {self.poll_seconds:g}s")
+                self.live = True
+                self._count('polls')
+            except Exception as e:
+                if self.live:
+                    print(f"⚠️ Catalog cache could not poll catalog_versions: {e}")
+                self.live = False
+            time.sleep(self.poll_seconds)
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+        if name != 'polls':
+            CATALOG_CACHE_EVENTS.labels(name).inc(amount)
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._stats)
+        return {'mode': self.mode, 'live': self.live, 'versions': dict(self.versions), **counters}
+
+
+shared_cache = SharedCache(CATALOG_CACHE_PATH, CATALOG_CACHE_MAX_ENTRIES)
+local_cache = LocalCache(CATALOG_LOCAL_MAX_MB * 1024 * 1024)
+watcher = VersionWatcher(CATALOG_POLL_SECONDS, CATALOG_LISTEN_RETRY_SECONDS, on_change=local_cache.invalidate)
+
+
+def format_stamp(names, versions):
+    return ','.join(f"{name}:{versions.get(name, 0)}" for name in names)
+
+
+def lock_catalog_writes(session):
+    """Hold the catalog write lock until ``session``'s transaction ends.
+
+    Taken before the first version row, so writers touching several scopes
+    cannot deadlock, and so the change events of catalog_events.py commit in
+    id order. SQLite serializes writers by itself.
+    """
+    if session.info.get('catalog_write_locked'):
+        return
+    connection = session.connection()
+    if connection.dialect.name == 'postgresql':
+        connection.execute(db.select(func.pg_advisory_xact_lock(WRITE_LOCK_KEY)))
+    session.info['catalog_write_locked'] = True
+
+
+def bump_versions(session, scopes):
+    """Increment the versions of ``scopes`` within ``session``'s transaction"""
+    table = CatalogVersion.__table__
+    lock_catalog_writes(session)
+    connection = session.connection()
+    notify = connection.dialect.name == 'postgresql'
+    bumped = session.info.setdefault('catalog_versions', {})
+    # Always in the same order, so concurrent writers cannot deadlock on the rows
+    for scope in sorted(scopes):
+        result = connection.execute(
+            table.update().where(table.c.name == scope).values(version=table.c.version + 1)
+        )
+        if result.rowcount == 0:
+            # Database bootstrapped before catalog_versions existed
+            connection.execute(table.insert().values(name=scope, version=1))
+        version = connection.execute(db.select(table.c.version).where(table.c.name == scope)).scalar()
+        bumped[scope] = version
+        if notify:
+            # Delivered to the listeners when, and only if, the transaction commits
+            connection.execute(db.select(func.pg_notify(NOTIFY_CHANNEL, f"{scope}:{version}")))
+
+
+@event.listens_for(db.session, 'before_flush')
+def _bump_for_flush(session, flush_context, instances):
+    tables = {obj.__table__.name for obj in (*session.new, *session.dirty, *session.deleted)}
+    scopes = {SCOPES_BY_TABLE[name] for name in tables if name in SCOPES_BY_TABLE}
+    if scopes:
+        bump_versions(session, scopes)
+
+
+@event.listens_for(db.session, 'do_orm_execute')
+def _bump_for_statement(orm_execute_state):
+    # Bulk inserts and Query.update()/delete() skip the flush
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    table = getattr(orm_execute_state.statement, 'table', None)
+    scope = SCOPES_BY_TABLE.get(getattr(table, 'name', None))
+    if scope:
+        bump_versions(orm_execute_state.session, [scope])
+
+
+@event.listens_for(db.session, 'after_commit')
+def _apply_own_commit(session):
+    # Without waiting for the notification, so this worker reads its own writes
+    session.info.pop('catalog_write_locked', None)
+    versions = session.info.pop('catalog_versions', None)
+    if versions:
+        watcher.merge(versions)
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _forget_rolled_back(session, previous_transaction):
+    session.info.pop('catalog_write_locked', None)
+    session.info.pop('catalog_versions', None)
+
+
+def ensure_catalog_versions():
+    """Create the version rows, and the epoch, that are missing; run by init_db.py"""
+    existing = {name for (name,) in db.session.query(CatalogVersion.name)}
+    for scope in CATALOG_SCOPES:
+        if scope not in existing:
+            db.session.add(CatalogVersion(name=scope, version=0))
+    if EPOCH not in existing:
+        db.session.add(CatalogVersion(name=EPOCH, version=random.getrandbits(62)))
+    db.session.commit()
+
+
+def version_stamp(scopes, fresh=False):
+    """Current versions of ``scopes`` as a string, e.g. ``epoch:123,documents:7``"""
+    # Replica reads must be stamped with the replica's versions, not the primary's
+    use_watcher = not fresh and not g.get('db_read_replica')
+    if use_watcher:
+        watcher.ensure_started(db.engine)
+        stamp = watcher.stamp(scopes)
+        if stamp is not None:
+            return stamp
+    names = [EPOCH, *sorted(scopes)]
+    versions = dict(db.session.query(CatalogVersion.name, CatalogVersion.version)
+                    .filter(CatalogVersion.name.in_(names)))
+    if use_watcher:
+        watcher.merge(versions)
+    return format_stamp(names, versions)
+
+
+def cached_json(key, scopes, build, fresh=False):
+    """JSON response for ``key``; ``build()`` makes the data when no entry
+    matches the current versions of ``scopes``, the tables it reads from.
+
+    ``fresh`` reads the versions from the database even when this worker
+    has them in memory, so the response is at least as new as anything the
+    request read before it.
+    """
+    if not CATALOG_CACHE_ENABLED:
+        return current_app.json.response(build())
+    stamp = version_stamp(scopes, fresh)
+    body = local_cache.get(key, stamp)
+    if body is None:
+        body = shared_cache.get(key, stamp)
+        if body is not None:
+            local_cache.set(key, stamp, scopes, body)
+    if body is not None:
+        return current_app.response_class(body, mimetype=current_app.json.mimetype)
+    response = current_app.json.response(build())
+    body = response.get_data()
+    shared_cache.set(key, stamp, body)
+    local_cache.set(key, stamp, scopes, body)
+    return response
+
+
+def stats():
+    return {**shared_cache.stats(), 'local': local_cache.stats(), 'watcher': watcher.stats()}
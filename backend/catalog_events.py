@@ -0,0 +1,182 @@
+"""Change log of the document catalog, behind the /documents/events feed.
+
+Every ORM write to a catalog table records catalog_events rows in the same
+transaction, through the session hooks below:
+
+- created, updated, deleted: a document row was inserted, changed or removed
+- visibility_changed: a document's visibility rules changed
+- access_changed: a user's tags changed, so their visible documents may have
+
+Events carry ids only; the feed looks at the current document and its
+visibility when it sends them. As with the version bumps in catalog_cache.py,
+bulk inserts are not seen (seeding and perf datasets record no events).
+
+Event ids must become visible in order, or a reader that has moved past id
+12 would never see an 11 committed after it. Every transaction that records
+events holds the catalog write lock (catalog_cache.lock_catalog_writes)
+from before its first event until it ends, so they commit one at a time.
+
+Streams sleep on change_signal, which the catalog version watcher wakes
+whenever a version changes in this worker or another one.
+"""
+import os
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import event
+from models import db, CatalogEvent, Document, DocumentVisibility, UserTag
+from catalog_cache import watcher, lock_catalog_writes
+
+CATALOG_EVENTS_RETENTION_DAYS = int(os.getenv('CATALOG_EVENTS_RETENTION_DAYS', '7'))
+# Streams (gevent workers): a comment this often keeps proxies from closing an
+# idle stream, and a stream ends after CATALOG_FEED_MAX_STREAM_SECONDS so the
+# client reconnects with a fresh token check
+CATALOG_FEED_HEARTBEAT_SECONDS = float(os.getenv('CATALOG_FEED_HEARTBEAT_SECONDS', '15'))
+CATALOG_FEED_MAX_STREAM_SECONDS = float(os.getenv('CATALOG_FEED_MAX_STREAM_SECONDS', '300'))
+# Sync workers answer with the pending events and ask the client to come back after this long
+CATALOG_FEED_RETRY_SECONDS = float(os.getenv('CATALOG_FEED_RETRY_SECONDS', '10'))
+# Lifetime of the ?token= a client gets from /documents/events/token; it ends up
+# in access logs, so it is short-lived and opens nothing but the feed
+CATALOG_FEED_TOKEN_SECONDS = int(os.getenv('CATALOG_FEED_TOKEN_SECONDS', '600'))
+
+# Events read per query
+FEED_BATCH_SIZE = 100
+# A delta spanning more events than this is answered with the full list instead
+DELTA_MAX_EVENTS = 5000
+
+EVENT_KINDS = ('created', 'updated', 'deleted', 'visibility_changed', 'access_changed')
+
+
+class ChangeSignal:
+    """Lets streaming requests sleep until the catalog changes"""
+
+    def __init__(self):
+        self.generation = 0
+        self._condition = threading.Condition()
+
+    def notify(self, scopes=None):
+        with self._condition:
+            self.generation += 1
+            self._condition.notify_all()
+
+    def wait(self, generation, timeout):
+        """Wait up to ``timeout`` seconds for a change after ``generation``; True if one came"""
+        with self._condition:
+            if self.generation == generation:
+                self._condition.wait(timeout)
+            return self.generation != generation
+
+
+change_signal = ChangeSignal()
+watcher.subscribe(change_signal.notify)
+
+
+def record_events(session, events):
+    """Insert ``events``, (kind, document_id, user_id) tuples, in ``session``'s transaction"""
+    events = list(dict.fromkeys(events))
+    if not events:
+        return
+    lock_catalog_writes(session)
+    session.connection().execute(db.insert(CatalogEvent.__table__), [
+        {'kind': kind, 'document_id': document_id, 'user_id': user_id, 'created_at': datetime.utcnow()}
+        for kind, document_id, user_id in events
+    ])
+
+
+@event.listens_for(db.session, 'after_flush')
+def _record_flushed(session, flush_context):
+    # Still the pre-flush new/dirty/deleted sets, now with primary keys
+    events = []
+    for obj in session.new:
+        if isinstance(obj, Document):
+            events.append(('created', obj.id, None))
+        elif isinstance(obj, DocumentVisibility):
+            events.append(('visibility_changed', obj.document_id, None))
+        elif isinstance(obj, UserTag):
+            events.append(('access_changed', None, obj.user_id))
+    for obj in session.dirty:
+        if isinstance(obj, Document) and session.is_modified(obj, include_collections=False):
+            events.append(('updated', obj.id, None))
+        elif isinstance(obj, DocumentVisibility) and session.is_modified(obj, include_collections=False):
+            events.append(('visibility_changed', obj.document_id, None))
+    for obj in session.deleted:
+        if isinstance(obj, Document):
+            events.append(('deleted', obj.id, None))
+        elif isinstance(obj, DocumentVisibility):
+            events.append(('visibility_changed', obj.document_id, None))
+        elif isinstance(obj, UserTag):
+            events.append(('access_changed', None, obj.user_id))
+    record_events(session, events)
+
+
+# Query.update()/delete() on these tables: (column holding the document or
+# user id, whether it is a user id, event kind for update and for delete)
+_STATEMENT_EVENTS = {
+    'documents': ('id', False, 'updated', 'deleted'),
+    'document_visibility': ('document_id', False, 'visibility_changed', 'visibility_changed'),
+    'user_tags': ('user_id', True, 'access_changed', 'access_changed'),
+}
+
+
+@event.listens_for(db.session, 'do_orm_execute')
+def _record_statement(orm_execute_state):
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    statement = orm_execute_state.statement
+    table = getattr(statement, 'table', None)
+    if getattr(table, 'name', None) not in _STATEMENT_EVENTS:
+        return
+    column, is_user, update_kind, delete_kind = _STATEMENT_EVENTS[table.name]
+    kind = update_kind if orm_execute_state.is_update else delete_kind
+    session = orm_execute_state.session
+    if isinstance(orm_execute_state.parameters, list):
+        # Bulk update by primary key: the ids are in the parameter sets
+        ids = [params.get(column) for params in orm_execute_state.parameters]
+    else:
+        # Runs before the statement, so the rows it will change can still be selected
+        query = db.select(table.c[column]).distinct()
+        if statement.whereclause is not None:
+            query = query.where(statement.whereclause)
+        ids = [row[0] for row in session.connection().execute(query)]
+    record_events(session, [(kind, None, id) if is_user else (kind, id, None) for id in ids if id is not None])
+
+
+def latest_event_id():
+    return db.session.query(db.func.max(CatalogEvent.id)).scalar() or 0
+
+
+def cursor_expired(cursor):
+    """Whether events after ``cursor`` may have been pruned, or ``cursor`` is
+    ahead of every event (ids reused, or a recreated database)"""
+    oldest, latest = db.session.query(db.func.min(CatalogEvent.id), db.func.max(CatalogEvent.id)).one()
+    return oldest is None or cursor < oldest - 1 or cursor > latest
+
+
+def events_after(cursor, limit):
+    """Up to ``limit`` events with ids above ``cursor``, oldest first"""
+    return (db.session.query(CatalogEvent.id, CatalogEvent.kind, CatalogEvent.document_id, CatalogEvent.user_id)
+            .filter(CatalogEvent.id > cursor)
+            .order_by(CatalogEvent.id)
+            .limit(limit)
+            .all())
+
+
+def prune_events():
+    """Delete events older than CATALOG_EVENTS_RETENTION_DAYS; run periodically by worker.py"""
+    cutoff = datetime.utcnow() - timedelta(days=CATALOG_EVENTS_RETENTION_DAYS)
+    deleted = CatalogEvent.query.filter(CatalogEvent.created_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    if deleted:
+        print(f"🧹 Pruned {deleted} catalog event(s) older than {CATALOG_EVENTS_RETENTION_DAYS} days")
+    return deleted
+
+
+def sse_message(event_id=None, kind=None, data=None):
+    """One Server-Sent Events message; an id alone moves the client's Last-Event-ID without an event"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if kind:
+        lines.append(f"event: {kind}")
+    if data is not None:
+        lines.append(f"data: {data}")
+    return '\n'.join(lines) + '\n\n'
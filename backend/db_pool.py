@@ -0,0 +1,108 @@
+"""Database connection pool settings and metrics.
+
+Every engine (the primary and the optional replica bind) gets its options
+from engine_options():
+
+- DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT and DB_POOL_RECYCLE size
+  the per-process QueuePool. Each worker has its own pool, so the database
+  sees up to workers * (size + overflow) connections.
+- DB_POOL_PRE_PING tests each connection on checkout. That costs a round
+  trip per checkout; with it off, pool_recycle and SQLAlchemy's
+  invalidation of disconnected connections still apply.
+- DB_PGBOUNCER=true is for a PgBouncer in transaction pooling mode: the
+  app keeps no connections of its own (NullPool) and PgBouncer pools them.
+
+Pools are InstrumentedQueuePool subclasses that export checkout wait time,
+connections in use, overflow connections, checkout timeouts and new
+connections, labelled by bind, so the pool can be sized against real
+contention.
+"""
+import os
+import time
+from sqlalchemy import exc, make_url
+from sqlalchemy.pool import NullPool, QueuePool
+from metrics import (DB_POOL_CHECKOUT_WAIT, DB_POOL_IN_USE, DB_POOL_OVERFLOWS, DB_POOL_TIMEOUTS,
+                     DB_POOL_CONNECTIONS_OPENED)
+
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10'))
+# Whole seconds: Flask-SQLAlchemy's engine_from_config() coerces it to int
+DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', '30'))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '300'))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+DB_PGBOUNCER = os.getenv('DB_PGBOUNCER', 'false').lower() == 'true'
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records checkout waits and saturation for its bind"""
+
+    label = 'primary'
+
+    def _do_get(self):
+        overflow = self.overflow()
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            DB_POOL_TIMEOUTS.labels(self.label).inc()
+            raise
+        finally:
+            DB_POOL_CHECKOUT_WAIT.labels(self.label).observe(time.perf_counter() - started)
+        if self.overflow() > max(overflow, 0):
+            DB_POOL_OVERFLOWS.labels(self.label).inc()
+        DB_POOL_IN_USE.labels(self.label).set(self.checkedout())
+        return connection
+
+    def _do_return_conn(self, record):
+        super()._do_return_conn(record)
+        DB_POOL_IN_USE.labels(self.label).set(self.checkedout())
+
+    def _create_connection(self):
+        # Includes reconnects after a failed pre-ping or a dropped connection
+        DB_POOL_CONNECTIONS_OPENED.labels(self.label).inc()
+        return super()._create_connection()
+
+
+_pool_classes = {}
+
+
+def instrumented_pool(label):
+    """InstrumentedQueuePool subclass for ``label``; a class so that
+    engine.dispose(), which rebuilds the pool from its class, keeps it"""
+    if label not in _pool_classes:
+        _pool_classes[label] = type(f"InstrumentedQueuePool[{label}]", (InstrumentedQueuePool,), {'label': label})
+    return _pool_classes[label]
+
+
+def engine_options(url, label='primary'):
+    """create_engine() options for the bind ``label`` at ``url``"""
+    url = make_url(url)
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        # Flask-SQLAlchemy shares one connection for in-memory databases
+        return {}
+    if DB_PGBOUNCER:
+        return {'poolclass': NullPool}
+    return {
+        'poolclass': instrumented_pool(label),
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING,
+    }
+
+
+def pool_stats(engine):
+    pool = engine.pool
+    if not isinstance(pool, QueuePool):
+        return {'class': type(pool).__name__}
+    return {
+        'class': type(pool).__name__,
+        'size': pool.size(),
+        'checked_in': pool.checkedin(),
+        'checked_out': pool.checkedout(),
+        'overflow': max(pool.overflow(), 0),
+        'max_overflow': pool._max_overflow,
+        'timeout': pool.timeout(),
+        'pre_ping': pool._pre_ping,
+    }
@@ -0,0 +1,204 @@
+"""Read-replica routing.
+
+With REPLICA_DATABASE_URL set, the replica is configured as the ``replica``
+bind and GET requests to views marked with @replica_reads run their SELECTs
+on it. Everything else uses the primary:
+
+- writes, flushes, SELECT ... FOR UPDATE and raw SQL other than SELECT
+- every statement after the request's first write (read-after-write)
+- requests from a client that wrote within REPLICA_STICKY_SECONDS, tracked
+  with a cookie, so a listing right after an upload shows the new document
+- all replica-eligible requests while the replica lags more than
+  REPLICA_MAX_LAG_SECONDS or cannot be reached
+
+Lag is measured every REPLICA_LAG_CHECK_SECONDS by a background thread in
+each process, so a replica that hangs never holds up a request; requests
+only read the last measurement. Until the first one, and once it is older
+than STALE_CHECKS checks, reads go to the primary.
+"""
+import os
+import threading
+import time
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import make_url, text
+from sqlalchemy.sql import Select, TextClause
+from metrics import DB_REPLICA_LAG, DB_REPLICA_ROUTING
+from db_pool import engine_options
+
+REPLICA_DATABASE_URL = os.getenv('REPLICA_DATABASE_URL')
+if REPLICA_DATABASE_URL and REPLICA_DATABASE_URL.startswith('postgres://'):
+    REPLICA_DATABASE_URL = REPLICA_DATABASE_URL.replace('postgres://', 'postgresql://', 1)
+REPLICA_MAX_LAG_SECONDS = float(os.getenv('REPLICA_MAX_LAG_SECONDS', '5'))
+REPLICA_LAG_CHECK_SECONDS = float(os.getenv('REPLICA_LAG_CHECK_SECONDS', '5'))
+REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', '10'))
+# Bounds the lag probe, and every connection to the replica, on PostgreSQL
+REPLICA_CONNECT_TIMEOUT = int(os.getenv('REPLICA_CONNECT_TIMEOUT', '3'))
+REPLICA_PROBE_TIMEOUT_MS = int(os.getenv('REPLICA_PROBE_TIMEOUT_MS', '2000'))
+
+REPLICA_BIND = 'replica'
+STICKY_COOKIE = 'db_primary_until'
+# A measurement older than this many check intervals means the probe is stuck
+STALE_CHECKS = 3
+
+# Zero when the replica has replayed everything it received; a replica with no
+# recent writes would otherwise look as old as its last replayed transaction
+POSTGRES_LAG_QUERY = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+class LagMonitor:
+    """Per-process view of the replica's replication lag"""
+
+    def __init__(self, max_lag, check_seconds):
+        self.max_lag = max_lag
+        self.check_seconds = check_seconds
+        self.lag = None  # seconds, or None when the replica could not be reached
+        self.checked_at = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self, engine):
+        """Start this process's measuring thread unless it is running"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # A forked worker inherits its parent's measurement but not its thread
+            self._pid = os.getpid()
+            self.lag = None
+            self.checked_at = None
+            threading.Thread(target=self._run, args=(engine,), name='replica-lag', daemon=True).start()
+
+    def _run(self, engine):
+        while True:
+            self.lag = self.measure(engine)
+            self.checked_at = time.monotonic()
+            time.sleep(self.check_seconds)
+
+    def fresh(self):
+        return (self.checked_at is not None
+                and time.monotonic() - self.checked_at <= self.check_seconds * STALE_CHECKS)
+
+    def healthy(self, engine):
+        """Whether reads may go to ``engine``, from the last background measurement"""
+        self.ensure_started(engine)
+        return self.fresh() and self.lag is not None and self.lag <= self.max_lag
+
+    def measure(self, engine):
+        try:
+            with engine.connect() as connection:
+                if engine.dialect.name == 'postgresql':
+                    connection.execute(text(f"SET LOCAL statement_timeout = {REPLICA_PROBE_TIMEOUT_MS}"))
+                    lag = float(connection.execute(text(POSTGRES_LAG_QUERY)).scalar() or 0)
+                else:
+                    # No replication to measure; still proves the replica answers
+                    connection.execute(text("SELECT 1"))
+                    lag = 0.0
+        except Exception as e:
+            print(f"⚠️ Read replica unreachable, reading from the primary: {e}")
+            DB_REPLICA_LAG.set(-1)
+            return None
+        if lag > self.max_lag:
+            print(f"⚠️ Read replica lags {lag:.1f}s, reading from the primary")
+        DB_REPLICA_LAG.set(lag)
+        return lag
+
+    def stats(self):
+        return {
+            'lag_seconds': self.lag,
+            'max_lag_seconds': self.max_lag,
+            'healthy': self.fresh() and self.lag is not None and self.lag <= self.max_lag,
+            'checked_seconds_ago': round(time.monotonic() - self.checked_at, 1) if self.checked_at else None
+        }
+
+
+lag_monitor = LagMonitor(REPLICA_MAX_LAG_SECONDS, REPLICA_LAG_CHECK_SECONDS)
+
+
+def replica_reads(view):
+    """Let GET requests to ``view`` read from the replica"""
+    view.replica_reads = True
+    return view
+
+
+def is_read(clause):
+    if isinstance(clause, Select):
+        return clause._for_update_arg is None
+    if isinstance(clause, TextClause):
+        return clause.text.lstrip()[:6].upper() == 'SELECT'
+    return False
+
+
+class RoutingSession(Session):
+    """Session that sends a replica-routed request's reads to the replica bind"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_request_context() and REPLICA_BIND in self._db.engines:
+            if self._flushing or (clause is not None and not is_read(clause)):
+                g.db_wrote = True
+            elif (clause is not None and g.get('db_read_replica') and not g.get('db_wrote')
+                  and not (self.new or self.deleted or self.dirty)):
+                return self._db.engines[REPLICA_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def sticky_until():
+    try:
+        return float(request.cookies.get(STICKY_COOKIE, 0))
+    except ValueError:
+        return 0
+
+
+def _before_request():
+    if request.method not in ('GET', 'HEAD'):
+        return
+    view = current_app.view_functions.get(request.endpoint)
+    if not getattr(view, 'replica_reads', False):
+        return
+    replica = current_app.extensions['sqlalchemy'].engines.get(REPLICA_BIND)
+    if replica is None:
+        return
+    if sticky_until() > time.time():
+        decision = 'sticky'
+    elif not lag_monitor.healthy(replica):
+        if not lag_monitor.fresh():
+            decision = 'unmeasured'
+        else:
+            decision = 'lagging' if lag_monitor.lag is not None else 'unreachable'
+    else:
+        decision = 'replica'
+        g.db_read_replica = True
+    DB_REPLICA_ROUTING.labels(decision).inc()
+
+
+def _after_request(response):
+    if g.get('db_wrote'):
+        # Send this client's reads to the primary until the replica has caught up
+        response.set_cookie(STICKY_COOKIE, str(int(time.time()) + REPLICA_STICKY_SECONDS),
+                            max_age=REPLICA_STICKY_SECONDS, httponly=True, samesite='Lax')
+    return response
+
+
+def init_app(app):
+    """Configure the replica bind and routing for ``app``; a no-op without a replica URL"""
+    if not REPLICA_DATABASE_URL:
+        return
+    # Binds do not inherit SQLALCHEMY_ENGINE_OPTIONS
+    options = engine_options(REPLICA_DATABASE_URL, REPLICA_BIND)
+    if make_url(REPLICA_DATABASE_URL).get_backend_name() == 'postgresql':
+        # A replica that stops answering must fail fast, not hang the lag probe or a request
+        options['connect_args'] = {'connect_timeout': REPLICA_CONNECT_TIMEOUT}
+    app.config.setdefault('SQLALCHEMY_BINDS', {})[REPLICA_BIND] = {
+        'url': REPLICA_DATABASE_URL,
+        **options
+    }
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    print(f"✅ Read replica configured: {make_url(REPLICA_DATABASE_URL).render_as_string(hide_password=True)}")
@@ -0,0 +1,29 @@
+"""Support for gevent ("green") gunicorn workers.
+
+With GUNICORN_WORKER_CLASS=gevent each worker is an event loop serving up to
+GUNICORN_WORKER_CONNECTIONS requests at once. gunicorn.conf.py monkey-patches
+the standard library before the app is imported, so socket I/O (boto3, S3
+presigning and transfers), locks and sleeps yield to other requests instead of
+holding the process, and psycogreen does the same for psycopg2 queries.
+Flask-SQLAlchemy scopes its session to the app context, which is per
+greenlet, so concurrent requests never share a session or connection.
+
+Patching cannot make CPU-bound C code (bcrypt, PDF parsing and rendering,
+hashing) cooperative; run_blocking() moves such calls to gevent's thread
+pool. Under sync workers, and in worker.py, it simply calls the function.
+"""
+import sys
+
+
+def is_green():
+    """True in a process whose standard library gevent has patched"""
+    monkey = sys.modules.get('gevent.monkey')
+    return bool(monkey and monkey.is_module_patched('socket'))
+
+
+def run_blocking(func, *args, **kwargs):
+    """Call ``func`` without stalling the other requests of a green worker"""
+    if not is_green():
+        return func(*args, **kwargs)
+    import gevent
+    return gevent.get_hub().threadpool.apply(func, args, kwargs)
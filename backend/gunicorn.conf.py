@@ -0,0 +1,75 @@
+"""Gunicorn settings picked up from the backend directory.
+
+Command-line flags would take precedence, so start.sh, the Dockerfile and
+sequoalpha.service leave the worker count and class to this file. It
+prepares multi-process Prometheus metrics so /metrics reports totals for
+all workers rather than whichever one answered, and preloads the app
+(GUNICORN_PRELOAD, default true): the master imports main.py once and
+workers fork with it already in memory, so booting or replacing a worker
+skips the imports. Code changes then need a restart rather than a HUP,
+which is what update.sh and manage.sh do. It also sets the number of
+workers (GUNICORN_WORKERS) and selects the worker class:
+GUNICORN_WORKER_CLASS=gevent for I/O-bound traffic, see green.py.
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+workers = int(os.getenv('GUNICORN_WORKERS', '2'))
+
+# sync (one request per worker) or gevent (up to worker_connections each; see green.py)
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'sync')
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '1000'))
+
+if worker_class == 'gevent':
+    # Patch before anything, a preloaded app included, imports socket or threading.
+    # Select gevent here rather than with -k, which patches only after preloading.
+    from gevent import monkey
+    monkey.patch_all()
+    try:
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+    except ImportError:
+        print("⚠️ psycogreen not installed, PostgreSQL queries will block gevent workers")
+    # Concurrent S3 calls per worker, instead of the sync worker's 10
+    os.environ.setdefault('S3_MAX_POOL_CONNECTIONS', '100')
+
+# Must be set before the app imports prometheus_client, which with
+# preload_app happens in the master right after this file is read
+os.environ.setdefault(
+    'PROMETHEUS_MULTIPROC_DIR',
+    os.path.join(tempfile.gettempdir(), 'sequoalpha-metrics')
+)
+os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+
+def on_starting(server):
+    # Counters from a previous run would be added to this one. This runs after
+    # a preloaded import; workers notice the new pid and write fresh files.
+    metrics_dir = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+
+def child_exit(server, worker):
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def post_fork(server, worker):
+    # A preloaded app is inherited from the master along with anything it
+    # opened. Forget inherited pooled DB connections without closing them,
+    # since the sockets are shared with the parent; the worker opens its own.
+    # (The S3 client is rebuilt per process by S3Manager itself.)
+    main = sys.modules.get('main')
+    if main is None:
+        return
+    with main.app.app_context():
+        for engine in main.db.engines.values():
+            engine.dispose(close=False)
@@ -1,7 +1,12 @@
-from main import app, db
-from models import User, Document, Tag, UserTag, DocumentVisibility, Category
+from main import app, db, check_startup
+from search import ensure_search_index
+from catalog_cache import ensure_catalog_versions
+from missing_files import build_pdf
+from models import User, Document, Tag, UserTag, DocumentVisibility, Category, BootstrapVersion
 from datetime import datetime
+import argparse
 import bcrypt
+import hashlib
 import os
 import uuid
 
@@ -11,63 +16,12 @@ def create_sample_pdf(filename, content):
         upload_dir = app.config['UPLOAD_FOLDER']
         file_path = os.path.join(upload_dir, filename)
         
-        # Create a simple PDF content (minimal valid PDF)
-        pdf_content = f"""%PDF-1.4
-1 0 obj
-<<
-/Type /Catalog
-/Pages 2 0 R
->>
-endobj
-
-2 0 obj
-<<
-/Type /Pages
-/Kids [3 0 R]
-/Count 1
->>
-endobj
-
-3 0 obj
-<<
-/Type /Page
-/Parent 2 0 R
-/MediaBox [0 0 612 792]
-/Contents 4 0 R
->>
-endobj
-
-4 0 obj
-<<
-/Length 44
->>
-stream
-BT
-/F1 12 Tf
-72 720 Td
-({content}) Tj
-ET
-endstream
-endobj
-
-xref
-0 5
-0000000000 65535 f 
-0000000009 00000 n 
-0000000058 00000 n 
-0000000115 00000 n 
-0000000204 00000 n 
-trailer
-<<
-/Size 5
-/Root 1 0 R
->>
-startxref
-297
-%%EOF"""
+        if os.path.exists(file_path):
+            print(f"ℹ️ Sample PDF already exists, keeping it: {filename}")
+            return False
         
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(pdf_content)
+        with open(file_path, 'wb') as f:
+            f.write(build_pdf([content]))
         
         print(f"✅ Created sample PDF: {filename}")
         return True
@@ -76,127 +30,205 @@ startxref
         print(f"❌ Error creating {filename}: {e}")
         return False
 
-def init_database():
+# Columns added after the first release. db.create_all() only creates missing
+# tables, so existing databases get these through ALTER TABLE.
+SCHEMA_UPGRADES = [
+    ('documents', 'checksum', 'VARCHAR(64)'),
+    ('documents', 'thumbnail_key', 'VARCHAR(255)'),
+    ('documents', 'page_count', 'INTEGER'),
+    ('jobs', 'result', 'TEXT'),
+]
+
+INDEX_UPGRADES = [
+    'CREATE INDEX IF NOT EXISTS ix_documents_checksum ON documents (checksum)',
+]
+
+def upgrade_schema():
+    """Add columns and indexes missing from tables created by older versions"""
+    inspector = db.inspect(db.engine)
+    for table, column, ddl in SCHEMA_UPGRADES:
+        existing_columns = {col['name'] for col in inspector.get_columns(table)}
+        if column not in existing_columns:
+            db.session.execute(db.text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+            print(f"✅ Added column {table}.{column}")
+    for statement in INDEX_UPGRADES:
+        db.session.execute(db.text(statement))
+    db.session.commit()
+
+# Bump when the default users, sample documents or categories below change
+SEED_VERSION = '1'
+
+# Bump when DDL outside the models changes, e.g. in search.ensure_search_index()
+SCHEMA_REVISION = '1'
+
+def schema_fingerprint():
+    """Digest of the model tables plus the upgrades, recorded once they are applied"""
+    parts = [SCHEMA_REVISION]
+    for table in sorted(db.metadata.tables.values(), key=lambda table: table.name):
+        parts.append(table.name)
+        parts.extend(f"{column.name} {column.type}" for column in table.columns)
+        parts.extend(sorted(str(index.name) for index in table.indexes))
+    parts.extend(f"{table}.{column} {ddl}" for table, column, ddl in SCHEMA_UPGRADES)
+    parts.extend(INDEX_UPGRADES)
+    return hashlib.sha256('\n'.join(parts).encode('utf-8')).hexdigest()
+
+def applied_versions():
+    """{name: version} from bootstrap_versions; empty before the first bootstrap"""
+    if not db.inspect(db.engine).has_table(BootstrapVersion.__tablename__):
+        return {}
+    return dict(db.session.execute(db.select(BootstrapVersion.name, BootstrapVersion.version)).all())
+
+def record_version(name, version):
+    row = db.session.get(BootstrapVersion, name)
+    if row:
+        row.version = version
+    else:
+        db.session.add(BootstrapVersion(name=name, version=version))
+    db.session.commit()
+
+def seed_data():
+    """Insert whichever default users, sample documents and categories are missing"""
+    if not db.session.query(User.query.filter_by(username='admin').exists()).scalar():
+        now = datetime.utcnow()
+        db.session.execute(db.insert(User), [
+            {
+                'username': 'admin',
+                'email': 'admin@sequoalpha.com',
+                'full_name': 'SequoAlpha Administrator',
+                'hashed_password': bcrypt.hashpw("admin123".encode('utf-8'), bcrypt.gensalt()).decode('utf-8'),
+                'is_active': True,
+                'is_admin': True,
+                'created_at': now,
+                'updated_at': now
+            },
+            {
+                'username': 'user',
+                'email': 'user@sequoalpha.com',
+                'full_name': 'Regular User',
+                'hashed_password': bcrypt.hashpw("user123".encode('utf-8'), bcrypt.gensalt()).decode('utf-8'),
+                'is_active': True,
+                'is_admin': False,
+                'created_at': now,
+                'updated_at': now
+            }
+        ])
+        db.session.commit()
+        print("✅ Default users created successfully!")
+    else:
+        print("ℹ️ Admin user already exists")
+
+    if not db.session.query(Document.query.exists()).scalar():
+        admin_id = db.session.query(User.id).filter_by(username='admin').scalar()
+        now = datetime.utcnow()
+        sample_docs = [
+            {
+                'title': "Q2 2025 Performance Report",
+                'description': "Quarterly performance review and market analysis",
+                'category': "Reports",
+                'type': "PDF",
+                'filename': "sample_report.pdf",
+                'file_size': "2.4 MB",
+                'is_external': False,
+                'external_url': None,
+                'is_new': True
+            },
+            {
+                'title': "Meridian Growth Fund Factsheet",
+                'description': "Fund overview, strategy, and key metrics",
+                'category': "Factsheets",
+                'type': "PDF",
+                'filename': "factsheet.pdf",
+                'file_size': "1.2 MB",
+                'is_external': False,
+                'external_url': None,
+                'is_new': True
+            },
+            {
+                'title': "Limited Partnership Agreement",
+                'description': "Terms and conditions of partnership",
+                'category': "Legal",
+                'type': "PDF",
+                'filename': "agreement.pdf",
+                'file_size': "3.8 MB",
+                'is_external': False,
+                'external_url': None,
+                'is_new': False
+            },
+            {
+                'title': "Monthly Market Commentary",
+                'description': "August market insights and outlook",
+                'category': "Reports",
+                'type': "LINK",
+                'filename': None,
+                'file_size': "N/A",
+                'is_external': True,
+                'external_url': "https://example.com/market-commentary.pdf",
+                'is_new': True
+            }
+        ]
+        for doc in sample_docs:
+            doc.update(created_by=admin_id, created_at=now, updated_at=now)
+        db.session.execute(db.insert(Document), sample_docs)
+        db.session.commit()
+        print("✅ Sample documents created successfully!")
+
+        # Create physical PDF files for sample documents
+        print("📄 Creating sample PDF files...")
+        pdf_files_created = 0
+
+        for doc in sample_docs:
+            if doc['type'] == "PDF" and doc['filename']:
+                if create_sample_pdf(doc['filename'], f"Sample content for {doc['title']}"):
+                    pdf_files_created += 1
+
+        print(f"✅ Created {pdf_files_created} sample PDF files!")
+    else:
+        print("ℹ️ Sample documents already exist")
+
+    # Seed default categories if table is empty
+    if not db.session.query(Category.query.exists()).scalar():
+        default_categories = ['Factsheets', 'Reports', 'Legal', 'Other']
+        db.session.execute(db.insert(Category), [{'name': name} for name in default_categories])
+        db.session.commit()
+        print("✅ Default categories created successfully!")
+    else:
+        print("ℹ️ Categories already exist")
+
+def init_database(force=False):
+    """Bring the schema and seed data up to date; returns False if they already were.
+
+    The recorded versions make a repeat run cost two queries, so this can run
+    on every deploy without slowing it down. force=True redoes every step,
+    each of which is itself safe to repeat.
+    """
     with app.app_context():
-        # Create all tables
-        db.create_all()
-        
-        # Check if admin user already exists
-        admin_user = User.query.filter_by(username='admin').first()
-        if not admin_user:
-            # Create admin user
-            admin_password = bcrypt.hashpw("admin123".encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-            admin_user = User(
-                username='admin',
-                email='admin@sequoalpha.com',
-                full_name='SequoAlpha Administrator',
-                hashed_password=admin_password,
-                is_active=True,
-                is_admin=True
-            )
-            db.session.add(admin_user)
-            
-            # Create regular user
-            user_password = bcrypt.hashpw("user123".encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-            regular_user = User(
-                username='user',
-                email='user@sequoalpha.com',
-                full_name='Regular User',
-                hashed_password=user_password,
-                is_active=True,
-                is_admin=False
-            )
-            db.session.add(regular_user)
-            
-            db.session.commit()
-            print("✅ Default users created successfully!")
-        else:
-            print("ℹ️ Admin user already exists")
-        
-        # Check if sample documents already exist
-        if Document.query.count() == 0:
-            # Create sample documents
-            sample_docs = [
-                Document(
-                    title="Q2 2025 Performance Report",
-                    description="Quarterly performance review and market analysis",
-                    category="Reports",
-                    type="PDF",
-                    filename="sample_report.pdf",
-                    file_size="2.4 MB",
-                    is_external=False,
-                    external_url=None,
-                    is_new=True,
-                    created_by=admin_user.id
-                ),
-                Document(
-                    title="Meridian Growth Fund Factsheet",
-                    description="Fund overview, strategy, and key metrics",
-                    category="Factsheets",
-                    type="PDF",
-                    filename="factsheet.pdf",
-                    file_size="1.2 MB",
-                    is_external=False,
-                    external_url=None,
-                    is_new=True,
-                    created_by=admin_user.id
-                ),
-                Document(
-                    title="Limited Partnership Agreement",
-                    description="Terms and conditions of partnership",
-                    category="Legal",
-                    type="PDF",
-                    filename="agreement.pdf",
-                    file_size="3.8 MB",
-                    is_external=False,
-                    external_url=None,
-                    is_new=False,
-                    created_by=admin_user.id
-                ),
-                Document(
-                    title="Monthly Market Commentary",
-                    description="August market insights and outlook",
-                    category="Reports",
-                    type="LINK",
-                    filename=None,
-                    file_size="N/A",
-                    is_external=True,
-                    external_url="https://example.com/market-commentary.pdf",
-                    is_new=True,
-                    created_by=admin_user.id
-                )
-            ]
-            
-            for doc in sample_docs:
-                db.session.add(doc)
-            
-            db.session.commit()
-            print("✅ Sample documents created successfully!")
-            
-            # Create physical PDF files for sample documents
-            print("📄 Creating sample PDF files...")
-            pdf_files_created = 0
-            
-            for doc in sample_docs:
-                if doc.type == "PDF" and doc.filename:
-                    if create_sample_pdf(doc.filename, f"Sample content for {doc.title}"):
-                        pdf_files_created += 1
-            
-            print(f"✅ Created {pdf_files_created} sample PDF files!")
-        else:
-            print("ℹ️ Sample documents already exist")
-        
-        # Seed default categories if table is empty
-        if Category.query.count() == 0:
-            default_categories = ['Factsheets', 'Reports', 'Legal', 'Other']
-            for name in default_categories:
-                db.session.add(Category(name=name))
-            db.session.commit()
-            print("✅ Default categories created successfully!")
-        else:
-            print("ℹ️ Categories already exist")
+        check_startup(app)
+        schema_version = schema_fingerprint()
+        applied = applied_versions()
+        schema_current = applied.get('schema') == schema_version
+        seed_current = applied.get('seed') == SEED_VERSION
+        if schema_current and seed_current and not force:
+            print("✅ Schema and seed data are current, nothing to do")
+            return False
+
+        if force or not schema_current:
+            # Create all tables
+            db.create_all()
+            upgrade_schema()
+            ensure_search_index()
+            ensure_catalog_versions()
+            record_version('schema', schema_version)
+            print("✅ Schema is up to date")
+
+        if force or not seed_current:
+            seed_data()
+            record_version('seed', SEED_VERSION)
 
         print("🎉 Database initialization completed!")
+        return True
 
 if __name__ == '__main__':
-    init_database()
+    parser = argparse.ArgumentParser(description='Create or upgrade the schema and seed default data')
+    parser.add_argument('--force', action='store_true', help='rerun every step even if the recorded versions are current')
+    args = parser.parse_args()
+    init_database(force=args.force)
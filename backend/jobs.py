@@ -0,0 +1,129 @@
+"""Durable job queue stored in the application database.
+
+Requests enqueue work with ``enqueue()``; a separate ``worker.py`` process
+claims and runs it. Claiming uses ``SELECT ... FOR UPDATE SKIP LOCKED`` on
+PostgreSQL plus a compare-and-set UPDATE, which also makes it safe on SQLite.
+Failed jobs are retried with exponential backoff until ``max_attempts``.
+"""
+import json
+import os
+import random
+import traceback
+from datetime import datetime, timedelta
+from models import db, Job
+
+JOB_QUEUE_ENABLED = os.getenv('JOB_QUEUE_ENABLED', 'false').lower() == 'true'
+JOB_RETRY_BASE_SECONDS = int(os.getenv('JOB_RETRY_BASE_SECONDS', '10'))
+JOB_RETRY_MAX_SECONDS = int(os.getenv('JOB_RETRY_MAX_SECONDS', '3600'))
+# Running jobs whose worker has been silent this long are handed to another worker
+JOB_LOCK_TIMEOUT_SECONDS = int(os.getenv('JOB_LOCK_TIMEOUT_SECONDS', '900'))
+
+JOB_HANDLERS = {}
+
+
+def job_handler(kind):
+    """Register a function as the handler for jobs of ``kind``"""
+    def decorator(func):
+        JOB_HANDLERS[kind] = func
+        return func
+    return decorator
+
+
+def enqueue(kind, payload=None, delay_seconds=0, max_attempts=5, commit=True):
+    """Add a job to the queue.
+
+    Pass ``commit=False`` to enqueue inside the caller's transaction, so the
+    job only becomes visible if the rest of the request commits.
+    """
+    job = Job(
+        kind=kind,
+        payload=json.dumps(payload or {}),
+        status='queued',
+        attempts=0,
+        max_attempts=max_attempts,
+        run_at=datetime.utcnow() + timedelta(seconds=delay_seconds)
+    )
+    db.session.add(job)
+    if commit:
+        db.session.commit()
+    else:
+        db.session.flush()
+    return job
+
+
+def claim_next_job(worker_id):
+    """Atomically take the next due job, or return None if there is none"""
+    now = datetime.utcnow()
+    candidate = (
+        db.session.query(Job.id)
+        .filter(Job.status == 'queued', Job.run_at <= now)
+        .order_by(Job.run_at, Job.id)
+        .with_for_update(skip_locked=True)
+        .first()
+    )
+    if candidate is None:
+        db.session.rollback()
+        return None
+
+    claimed = Job.query.filter_by(id=candidate.id, status='queued').update({
+        'status': 'running',
+        'locked_by': worker_id,
+        'locked_at': now,
+        'attempts': Job.attempts + 1
+    }, synchronize_session=False)
+    db.session.commit()
+    if not claimed:
+        # Another worker won the race
+        return None
+    return db.session.get(Job, candidate.id)
+
+
+def run_job(job):
+    """Run a claimed job and record the outcome"""
+    handler = JOB_HANDLERS.get(job.kind)
+    try:
+        if handler is None:
+            raise LookupError(f"No handler registered for job kind '{job.kind}'")
+        result = handler(**(json.loads(job.payload) if job.payload else {}))
+    except Exception as e:
+        db.session.rollback()
+        job = db.session.get(Job, job.id)
+        job.last_error = ''.join(traceback.format_exception_only(type(e), e)).strip()
+        job.locked_by = None
+        job.locked_at = None
+        if job.attempts >= job.max_attempts:
+            job.status = 'failed'
+            job.finished_at = datetime.utcnow()
+            print(f"❌ Job {job.id} ({job.kind}) failed permanently: {job.last_error}")
+        else:
+            delay = min(JOB_RETRY_MAX_SECONDS, JOB_RETRY_BASE_SECONDS * 2 ** (job.attempts - 1))
+            job.status = 'queued'
+            job.run_at = datetime.utcnow() + timedelta(seconds=delay * random.uniform(0.5, 1.0))
+            print(f"⚠️ Job {job.id} ({job.kind}) attempt {job.attempts} failed, retrying: {job.last_error}")
+        db.session.commit()
+        return False
+
+    job.status = 'succeeded'
+    job.result = json.dumps(result) if result is not None else None
+    job.finished_at = datetime.utcnow()
+    job.locked_by = None
+    job.locked_at = None
+    job.last_error = None
+    db.session.commit()
+    print(f"✅ Job {job.id} ({job.kind}) succeeded")
+    return True
+
+
+def requeue_stale_jobs():
+    """Return jobs left 'running' by a crashed worker to the queue"""
+    cutoff = datetime.utcnow() - timedelta(seconds=JOB_LOCK_TIMEOUT_SECONDS)
+    requeued = Job.query.filter(Job.status == 'running', Job.locked_at < cutoff).update({
+        'status': 'queued',
+        'locked_by': None,
+        'locked_at': None,
+        'run_at': datetime.utcnow()
+    }, synchronize_session=False)
+    db.session.commit()
+    if requeued:
+        print(f"🔄 Requeued {requeued} stale job(s)")
+    return requeued
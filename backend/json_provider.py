@@ -0,0 +1,51 @@
+"""Pluggable JSON encoding for API responses.
+
+JSON_PROVIDER selects the encoder: ``orjson`` (the default, used when the
+package is installed) or ``flask`` for Flask's built-in provider. Both emit
+the same types: datetimes go through Flask's own fallback (HTTP dates), so
+switching providers does not change response contents, only key order and
+speed.
+"""
+import os
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_PROVIDER = os.getenv('JSON_PROVIDER', 'orjson').lower()
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson"""
+
+    if orjson:
+        options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            # indent, sort_keys and friends: leave formatting options to the stdlib
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self.options).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        # Bytes straight into the response, without a str round trip
+        body = orjson.dumps(obj, default=self.default, option=self.options | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def init_app(app):
+    """Install the configured JSON provider on ``app``"""
+    if JSON_PROVIDER == 'orjson' and orjson is None:
+        print("⚠️ orjson not installed, using Flask's JSON provider")
+    elif JSON_PROVIDER == 'orjson':
+        app.json = OrjsonProvider(app)
@@ -1,52 +1,46 @@
-from flask import Flask, request, jsonify, send_from_directory, make_response
+from flask import (Flask, Blueprint, current_app, request, jsonify, send_from_directory, make_response, abort,
+                   stream_with_context)
 from flask_cors import CORS
 import jwt
 from datetime import datetime, timedelta
 import bcrypt
 import os
+import re
 import uuid
-from werkzeug.utils import secure_filename
+import hashlib
+import hmac
+import time
+import mimetypes
+import unicodedata
+from urllib.parse import quote
+from werkzeug.utils import secure_filename, safe_join
 from dotenv import load_dotenv
-from models import db, User, Document, Tag, UserTag, DocumentVisibility, Category
+from models import db, User, Document, Tag, UserTag, DocumentVisibility, Category, Job
 import json
-from s3_config import s3_manager
+from s3_config import s3_manager, S3Unavailable
+from s3_cache import s3_cache
+from jobs import JOB_QUEUE_ENABLED, enqueue
+from search import extract_pdf_text, index_document, remove_document, search_documents, get_indexed_text
+from thumbnails import thumbnail_key, render_first_page
+from tombstones import record_deletion, flush_tombstones, referenced_keys
+from reconcile import reconcile_storage
+from missing_files import PLACEHOLDER_PDF, missing_files
+import metrics
+import query_inspector
+import json_provider
+import db_pool
+import db_routing
+from db_routing import replica_reads
+from green import run_blocking, is_green
+import catalog_cache
+from catalog_cache import cached_json
+import catalog_events
+from catalog_events import sse_message
 
 load_dotenv()
 
-app = Flask(__name__)
-
-# Dynamic CORS configuration
-cors_origins = os.getenv('CORS_ORIGINS', '').split(',') if os.getenv('CORS_ORIGINS') else []
-default_origins = [
-    "http://localhost:8080",
-    "http://localhost:3000",
-    "https://sequopreview.netlify.app",
-    "https://*.netlify.app"
-]
-allowed_origins = cors_origins + default_origins if cors_origins else default_origins
-
-# For production EC2 deployment, allow all origins when CORS_ORIGINS is set to '*'
-if os.getenv('CORS_ORIGINS') == '*':
-    CORS(app, resources={
-        r"/*": {
-            "origins": "*",
-            "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-            "allow_headers": ["Content-Type", "Authorization"],
-            "supports_credentials": False
-        }
-    })
-else:
-    CORS(app, resources={
-        r"/*": {
-            "origins": allowed_origins,
-            "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-            "allow_headers": ["Content-Type", "Authorization"],
-            "supports_credentials": True
-        }
-    })
-
-# Database configuration
-import os
+# Routes are registered on the blueprint; create_app() attaches it to an app
+api = Blueprint('api', __name__)
 
 # Get database URL from environment variable
 DATABASE_URL = os.getenv('DATABASE_URL')
@@ -63,60 +57,426 @@ if DATABASE_URL.startswith('postgres://'):
     DATABASE_URL = DATABASE_URL.replace('postgres://', 'postgresql://', 1)
     print(f"🔄 Fixed PostgreSQL URL: {DATABASE_URL}")
 
-# Configure Flask-SQLAlchemy
-app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
-    'pool_pre_ping': True,
-    'pool_recycle': 300,
-}
-
-print(f"✅ Final database configuration: {app.config['SQLALCHEMY_DATABASE_URI']}")
-
-# Initialize database
-try:
-    print("🔧 Initializing database...")
-    print(f"🔧 Database type: {'PostgreSQL' if 'postgresql' in DATABASE_URL else 'SQLite'}")
-    
-    db.init_app(app)
-    
-    # Test database connection
-    with app.app_context():
-        db.session.execute(db.text("SELECT 1"))
-        print("✅ Database connection test successful!")
-    
-    print("✅ Database initialized successfully!")
-    
-except Exception as e:
-    print(f"❌ Error initializing database: {e}")
-    print(f"❌ DATABASE_URL: {DATABASE_URL}")
-    print(f"❌ Error type: {type(e).__name__}")
-    
-    # If it's a connection error, provide helpful information
-    if "connection" in str(e).lower():
-        print("💡 Connection error detected!")
-        print("💡 Make sure DATABASE_URL is set correctly in Render")
-        print("💡 Check if PostgreSQL service is running")
-    
-    raise e
-
 # Security
 SECRET_KEY = os.getenv("SECRET_KEY", "sequoalpha-secret-key-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# Scope of tokens that only open the /documents/events feed
+FEED_TOKEN_SCOPE = "catalog_feed"
+# Above this many documents, visibility rules are read for all of them at once
+VISIBILITY_IN_LIMIT = 500
 
 # File upload configuration - Use absolute path
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 UPLOAD_FOLDER = os.path.join(BASE_DIR, 'uploads')
 ALLOWED_EXTENSIONS = {'pdf'}
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
-# Ensure upload folder exists
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# Cross-origin settings shared by both CORS modes
+CORS_METHODS = ["GET", "POST", "PUT", "DELETE", "OPTIONS"]
+CORS_ALLOW_HEADERS = ["Content-Type", "Authorization", "Range", "If-None-Match", "If-Modified-Since", "If-Range"]
+CORS_EXPOSE_HEADERS = ["Content-Disposition", "Content-Range", "Accept-Ranges", "ETag", "Last-Modified"]
+
+
+def configure_cors(app):
+    """Dynamic CORS configuration"""
+    cors_origins = os.getenv('CORS_ORIGINS', '').split(',') if os.getenv('CORS_ORIGINS') else []
+    default_origins = [
+        "http://localhost:8080",
+        "http://localhost:3000",
+        "https://sequopreview.netlify.app",
+        "https://*.netlify.app"
+    ]
+    allowed_origins = cors_origins + default_origins if cors_origins else default_origins
+
+    # For production EC2 deployment, allow all origins when CORS_ORIGINS is set to '*'
+    allow_all = os.getenv('CORS_ORIGINS') == '*'
+    CORS(app, resources={
+        r"/*": {
+            "origins": "*" if allow_all else allowed_origins,
+            "methods": CORS_METHODS,
+            "allow_headers": CORS_ALLOW_HEADERS,
+            "expose_headers": CORS_EXPOSE_HEADERS,
+            "supports_credentials": not allow_all
+        }
+    })
+
+
+def create_app(config=None):
+    """Build the Flask app.
+
+    Nothing here touches the network or the filesystem: the database probe
+    and the upload folder wait for the first request (check_startup) and the
+    S3 client for its first use. That keeps imports cheap for scripts and
+    lets gunicorn --preload build the app once in the master; gunicorn.conf.py
+    drops inherited DB connections after fork.
+    """
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Pool size, overflow, timeout, pre-ping and PgBouncer mode (DB_POOL_* settings)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = db_pool.engine_options(DATABASE_URL)
+    app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+    if config:
+        app.config.update(config)
+    print(f"✅ Final database configuration: {app.config['SQLALCHEMY_DATABASE_URI']}")
+
+    configure_cors(app)
+
+    # orjson-backed jsonify (JSON_PROVIDER)
+    json_provider.init_app(app)
+
+    # Optional read replica, as the `replica` bind
+    db_routing.init_app(app)
+
+    # Engines are created here but connect lazily
+    db.init_app(app)
+
+    @app.before_request
+    def startup_checks():
+        check_startup(app)
+
+    # Per-route request counts, latency and DB query counts, served at /metrics
+    query_inspector.init_app(app)
+    metrics.init_app(app)
+
+    app.register_blueprint(api)
+    return app
+
+
+def check_startup(app):
+    """Create the upload folder and test the database connection, once per process"""
+    if app.extensions.get('startup_checked'):
+        return
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    try:
+        db.session.execute(db.text("SELECT 1"))
+        print("✅ Database connection test successful!")
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Database connection test failed: {e}")
+        print(f"❌ DATABASE_URL: {app.config['SQLALCHEMY_DATABASE_URI']}")
+        print(f"❌ Error type: {type(e).__name__}")
+
+        # If it's a connection error, provide helpful information
+        if "connection" in str(e).lower():
+            print("💡 Connection error detected!")
+            print("💡 Make sure DATABASE_URL is set correctly in Render")
+            print("💡 Check if PostgreSQL service is running")
+        # Not marked as checked: the next request tries again. The request
+        # itself goes ahead, so /metrics and / still answer during an outage.
+        return
+    app.extensions['startup_checked'] = True
+
+# Offload local file delivery to nginx via X-Accel-Redirect
+# Each directory maps to an `internal` location in nginx.conf
+X_ACCEL_REDIRECT = os.getenv('X_ACCEL_REDIRECT', 'false').lower() == 'true'
+X_ACCEL_LOCATIONS = {
+    UPLOAD_FOLDER: os.getenv('X_ACCEL_UPLOADS_LOCATION', '/protected/uploads/'),
+    s3_cache.cache_dir: os.getenv('X_ACCEL_S3_CACHE_LOCATION', '/protected/s3-cache/'),
+}
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def file_checksum(file_path):
+    """SHA-256 hex digest of a file, read in 1 MB chunks"""
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+# Content-addressed blobs never change, so clients may cache them indefinitely
+IMMUTABLE_CACHE_CONTROL = 'private, max-age=31536000, immutable'
+
+def content_addressed_filename(checksum):
+    return f"{checksum}.pdf"
+
+def is_content_addressed(filename):
+    return bool(filename) and re.fullmatch(r'[0-9a-f]{64}\.pdf', filename) is not None
+
+def find_blob_by_checksum(checksum):
+    """Filename of an already stored blob with this content, if any"""
+    row = db.session.query(Document.filename).filter(
+        Document.checksum == checksum,
+        Document.filename.isnot(None)
+    ).first()
+    return row.filename if row else None
+
+def count_blob_references(filename, exclude_document_id=None):
+    """Number of documents that store their contents in ``filename``"""
+    query = Document.query.filter(Document.filename == filename)
+    if exclude_document_id is not None:
+        query = query.filter(Document.id != exclude_document_id)
+    return query.count()
+
+def delete_blob(filename):
+    """Delete a stored blob and its thumbnail.
+
+    S3 objects are recorded as tombstones in the current transaction and
+    deleted in batches by flush_tombstones() once the caller commits. Local
+    copies are left for remove_local_blob(), which the caller runs after the
+    commit, so a concurrent upload that reuses the blob never loses its file.
+    """
+    deletion_results = {
+        's3_pending': False,
+        'local_deleted': False,
+        'local_error': None
+    }
+    s3_key = f"documents/{filename}"
+    thumbnail = thumbnail_key(filename)
+
+    if s3_manager.s3_client:
+        record_deletion(s3_key)
+        record_deletion(thumbnail)
+        deletion_results['s3_pending'] = True
+        print(f"🪦 Recorded S3 deletion: {s3_key}")
+    s3_cache.invalidate(s3_key)
+    s3_cache.invalidate(thumbnail)
+    return deletion_results
+
+def remove_local_blob(filename):
+    """Delete the local copies of a blob and its thumbnail once nothing references them.
+
+    Run after the deleting transaction commits; uses the same reference
+    check as the tombstone flush.
+    """
+    results = {'local_deleted': False, 'local_error': None}
+    keys = {f"documents/{filename}": filename, thumbnail_key(filename): thumbnail_key(filename)}
+    referenced = referenced_keys(set(keys))
+    for key, relative_path in keys.items():
+        if key in referenced:
+            print(f"ℹ️ {key} is referenced again, keeping the local copy")
+            continue
+        local_file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], relative_path)
+        try:
+            os.remove(local_file_path)
+            results['local_deleted'] = True
+            print(f"✅ Successfully deleted local file: {local_file_path}")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            results['local_error'] = str(e)
+            print(f"❌ Failed to delete local file: {e}")
+    return results
+
+def schedule_tombstone_flush():
+    """Flush pending S3 deletions, in the background worker when the job queue is enabled"""
+    if not s3_manager.s3_client:
+        return None
+    if not JOB_QUEUE_ENABLED:
+        return flush_tombstones()
+    # A short delay lets deletions made in quick succession share one batch
+    if not Job.query.filter_by(kind='flush_tombstones', status='queued').first():
+        enqueue('flush_tombstones', delay_seconds=5)
+    return None
+
+def store_blob(filename):
+    """Move a locally saved blob to S3. The local copy is kept if the upload fails.
+
+    Two uploads of the same new content may both get here; the one that
+    finds the local copy already gone checks that the other stored it.
+    """
+    local_file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
+    s3_key = f"documents/{filename}"
+    try:
+        uploaded = s3_manager.upload_file(local_file_path, s3_key, cache_control=IMMUTABLE_CACHE_CONTROL)
+    except FileNotFoundError:
+        uploaded = False
+    if uploaded:
+        try:
+            os.remove(local_file_path)
+        except FileNotFoundError:
+            pass
+        print(f"✅ File uploaded to S3: {s3_key}")
+        return True
+    if not os.path.exists(local_file_path):
+        try:
+            stored = s3_manager.file_exists(s3_key)
+        except S3Unavailable:
+            stored = False
+        if stored:
+            print(f"ℹ️ {s3_key} was already moved to S3 by a concurrent upload")
+            return True
+    # If S3 upload fails, keep local file as fallback
+    print(f"❌ S3 upload failed, keeping local file: {local_file_path}")
+    return False
+
+def local_blob_path(filename):
+    """Local path of a blob, fetching it from S3 through the disk cache if needed"""
+    local_file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
+    if os.path.exists(local_file_path):
+        return local_file_path
+    return s3_cache.get(f"documents/{filename}")
+
+def reindex_document(document_id):
+    """Extract a document's text and (re)index it for search"""
+    document = db.session.get(Document, document_id)
+    if not document:
+        return
+    body = ''
+    if document.filename:
+        file_path = local_blob_path(document.filename)
+        if not file_path:
+            raise FileNotFoundError(f"No stored file for document {document_id}")
+        body = run_blocking(extract_pdf_text, file_path)
+    index_document(document, body)
+
+def render_document_thumbnail(document_id):
+    """Render and store the first-page thumbnail shared by all copies of a blob"""
+    document = db.session.get(Document, document_id)
+    if not document or not document.filename or document.thumbnail_key:
+        return
+
+    key = thumbnail_key(document.filename)
+    rendered = Document.query.filter(
+        Document.filename == document.filename,
+        Document.thumbnail_key.isnot(None)
+    ).first()
+    if rendered:
+        page_count = rendered.page_count
+    else:
+        file_path = local_blob_path(document.filename)
+        if not file_path:
+            raise FileNotFoundError(f"No stored file for document {document_id}")
+        local_thumbnail_path = os.path.join(current_app.config['UPLOAD_FOLDER'], key)
+        page_count = run_blocking(render_first_page, file_path, local_thumbnail_path)
+        # Stored like the blob itself: in S3, with the local copy as fallback
+        if s3_manager.upload_file(local_thumbnail_path, key, cache_control=IMMUTABLE_CACHE_CONTROL):
+            os.remove(local_thumbnail_path)
+        print(f"🖼️ Rendered thumbnail for {document.filename} ({page_count} pages)")
+
+    Document.query.filter_by(filename=document.filename).update(
+        {'thumbnail_key': key, 'page_count': page_count}, synchronize_session=False
+    )
+    db.session.commit()
+
+def queue_document_enrichment(document_id):
+    """Index a new document for search and render its thumbnail.
+
+    Runs in the background worker when the job queue is enabled.
+    """
+    steps = [('index_document', reindex_document), ('render_thumbnail', render_document_thumbnail)]
+    for kind, step in steps:
+        if JOB_QUEUE_ENABLED:
+            enqueue(kind, {'document_id': document_id})
+            continue
+        try:
+            step(document_id)
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ {kind} failed for document {document_id}: {e}")
+
+def is_not_modified(document):
+    """True if the client already holds the current contents of the document"""
+    return bool(document.checksum) and request.if_none_match.contains(document.checksum)
+
+def not_modified_response(document):
+    response = make_response('', 304)
+    response.set_etag(document.checksum)
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    return response
+
+def content_disposition_names(download_name):
+    """Content-Disposition filename parameters, with an RFC 5987 form for non-ASCII names"""
+    try:
+        download_name.encode('ascii')
+        return {'filename': download_name}
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', download_name).encode('ascii', 'ignore').decode('ascii')
+        return {
+            'filename': simple,
+            'filename*': "UTF-8''" + quote(download_name, safe="!#$&+-.^_`|~"),
+        }
+
+def report_missing_file(document):
+    """Remember that a document's file is missing and queue a repair check.
+
+    Storage is never touched on the request path; the worker's
+    repair_missing_file job re-checks S3 and local storage and fails
+    visibly in /admin/jobs if the file is really gone.
+    """
+    if not missing_files.mark_missing(document.filename):
+        return
+    print(f"🚨 Stored file missing for document {document.id}: {document.filename}")
+    if not JOB_QUEUE_ENABLED:
+        return
+    payload = {'document_id': document.id}
+    if not Job.query.filter_by(kind='repair_missing_file', status='queued', payload=json.dumps(payload)).first():
+        enqueue('repair_missing_file', payload, max_attempts=3)
+
+def placeholder_response(document, as_attachment):
+    """Serve the in-memory placeholder PDF in place of a missing file"""
+    response = make_response(PLACEHOLDER_PDF)
+    response.headers['Content-Type'] = 'application/pdf'
+    response.headers.set('Content-Disposition', 'attachment' if as_attachment else 'inline',
+                         **content_disposition_names(document.title.replace(' ', '_') + '.pdf'))
+    # The real file may come back, so the placeholder must not be cached
+    response.headers['Cache-Control'] = 'no-store'
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers['Access-Control-Allow-Methods'] = 'GET, OPTIONS'
+    response.headers['Access-Control-Allow-Headers'] = 'Authorization, Content-Type'
+    return response
+
+def storage_unavailable_response():
+    """503 for a file whose only copy is in S3 while S3 is unavailable"""
+    response = jsonify({"detail": "File storage is temporarily unavailable"})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(s3_manager.breaker.retry_after())
+    response.headers['Cache-Control'] = 'no-store'
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    return response
+
+def send_local_file(directory, filename, as_attachment=False, download_name=None, mimetype=None,
+                    etag=None, last_modified=None):
+    """Send a locally stored file.
+
+    Range (206) and conditional (304) requests are honoured. ``etag`` should be
+    the stored checksum when there is one; otherwise Werkzeug derives one from
+    the file's mtime and size.
+
+    When X_ACCEL_REDIRECT is enabled Flask only sets the response headers and
+    nginx streams the bytes from an internal location, so the worker is freed
+    immediately instead of being held for the whole transfer. nginx then
+    serves the Range requests itself.
+    """
+    location = X_ACCEL_LOCATIONS.get(directory) if X_ACCEL_REDIRECT else None
+    if not location:
+        response = send_from_directory(
+            directory,
+            filename,
+            as_attachment=as_attachment,
+            download_name=download_name,
+            mimetype=mimetype,
+            etag=etag or True,
+            last_modified=last_modified,
+            conditional=True
+        )
+        response.headers['Accept-Ranges'] = 'bytes'
+        if is_content_addressed(filename):
+            response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        return response
+
+    file_path = safe_join(directory, filename)
+    if file_path is None or not os.path.isfile(file_path):
+        abort(404)
+
+    response = make_response('')
+    response.headers['X-Accel-Redirect'] = location + quote(filename)
+    response.headers['Content-Type'] = mimetype or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    response.headers.set('Content-Disposition', 'attachment' if as_attachment else 'inline',
+                         **content_disposition_names(download_name or filename))
+    response.headers['Accept-Ranges'] = 'bytes'
+    if is_content_addressed(filename):
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    if etag:
+        response.set_etag(etag)
+    response.last_modified = last_modified or os.path.getmtime(file_path)
+    response.make_conditional(request.environ)
+    if response.status_code == 304:
+        del response.headers['X-Accel-Redirect']
+    return response
+
 def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
     if expires_delta:
@@ -128,12 +488,13 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     return encoded_jwt
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+    # bcrypt is slow on purpose; in a green worker it would stall every other request
+    return run_blocking(bcrypt.checkpw, plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
 
 def get_password_hash(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    return run_blocking(bcrypt.hashpw, password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
 
-def get_current_user(token):
+def get_current_user(token, scope=None):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
@@ -141,6 +502,10 @@ def get_current_user(token):
         print(f"👤 Username from token: {username}")
         if username is None:
             return None
+        # A scoped token (e.g. the feed token) is only good where that scope is asked for
+        if payload.get("scope") != scope:
+            print("❌ Token scope not accepted here")
+            return None
     except jwt.InvalidTokenError:
         print("❌ Invalid token")
         return None
@@ -159,6 +524,52 @@ def get_current_admin(token):
         return None
     return user
 
+def visible_documents(user):
+    """Rows (see Document.list_query) of the documents a non-admin user may see"""
+    all_documents = Document.list_query().all()
+    visible = visible_document_ids(user.id, [doc.id for doc in all_documents])
+    return [doc for doc in all_documents if doc.id in visible]
+
+def rules_allow(rules, user_id, user_tag_ids):
+    """Whether one document's visibility rules let the user see it"""
+    # No visibility rules = visible to all (backward compat)
+    if not rules:
+        return True
+
+    # Check each rule
+    for rule in rules:
+        if rule.visibility_type == 'all':
+            return True
+        elif rule.visibility_type == 'tag' and rule.target_id in user_tag_ids:
+            return True
+        elif rule.visibility_type == 'user' and rule.target_id == user_id:
+            return True
+    return False
+
+def visible_document_ids(user_id, document_ids):
+    """The ids among ``document_ids`` that a non-admin user may see.
+
+    Two queries however many ids there are: the user's tags and the
+    visibility rules.
+    """
+    user_tag_ids = [ut.tag_id for ut in UserTag.query.filter_by(user_id=user_id).all()]
+    rules_by_document = {document_id: [] for document_id in document_ids}
+    rules = db.session.query(
+        DocumentVisibility.document_id, DocumentVisibility.visibility_type, DocumentVisibility.target_id
+    )
+    if len(rules_by_document) <= VISIBILITY_IN_LIMIT:
+        rules = rules.filter(DocumentVisibility.document_id.in_(document_ids))
+    # Otherwise read every rule once, rather than bind a parameter per id
+    for rule in rules:
+        if rule.document_id in rules_by_document:
+            rules_by_document[rule.document_id].append(rule)
+    return {document_id for document_id, rules in rules_by_document.items()
+            if rules_allow(rules, user_id, user_tag_ids)}
+
+def can_view_document(user, document_id):
+    """Whether ``user`` may see the document: admins see everything"""
+    return user.is_admin or document_id in visible_document_ids(user.id, [document_id])
+
 def save_document_visibility(document_id, visibility_data):
     """Parse and save visibility rules for a document."""
     if not visibility_data:
@@ -177,13 +588,13 @@ def save_document_visibility(document_id, visibility_data):
         db.session.add(vis)
     db.session.commit()
 
-@app.route('/test-cors', methods=['GET', 'OPTIONS'])
+@api.route('/test-cors', methods=['GET', 'OPTIONS'])
 def test_cors():
     if request.method == 'OPTIONS':
         return '', 200
     return jsonify({"message": "CORS is working!", "origin": request.headers.get('Origin')})
 
-@app.route('/login', methods=['POST'])
+@api.route('/login', methods=['POST'])
 def login():
     data = request.get_json()
     username = data.get('username')
@@ -209,7 +620,7 @@ def login():
     
     return jsonify({"access_token": access_token, "token_type": "bearer"})
 
-@app.route('/admin/create-user', methods=['POST'])
+@api.route('/admin/create-user', methods=['POST'])
 def create_user():
     auth_header = request.headers.get('Authorization')
     if not auth_header or not auth_header.startswith('Bearer '):
@@ -253,7 +664,7 @@ def create_user():
     
     return jsonify(new_user.to_dict())
 
-@app.route('/admin/change-password', methods=['POST'])
+@api.route('/admin/change-password', methods=['POST'])
 def change_password():
     auth_header = request.headers.get('Authorization')
     if not auth_header or not auth_header.startswith('Bearer '):
@@ -280,7 +691,8 @@ def change_password():
     
     return jsonify({"message": f"Password updated successfully for user {username}"})
 
-@app.route('/admin/users', methods=['GET'])
+@api.route('/admin/users', methods=['GET'])
+@replica_reads
 def get_users():
     auth_header = request.headers.get('Authorization')
     if not auth_header or not auth_header.startswith('Bearer '):
@@ -291,12 +703,9 @@ def get_users():
     if not current_admin:
         return jsonify({"detail": "Admin privileges required"}), 403
     
-    users = User.query.all()
-    users_list = [user.to_dict() for user in users]
-    
-    return jsonify({"users": users_list})
+    return cached_json('admin_users', ['users'], lambda: {"users": User.rows_to_dicts(User.list_query())})
 
-@app.route('/admin/users/<int:user_id>', methods=['DELETE'])
+@api.route('/admin/users/<int:user_id>', methods=['DELETE'])
 def delete_user(user_id):
     auth_header = request.headers.get('Authorization')
     if not auth_header or not auth_header.startswith('Bearer '):
@@ -327,7 +736,8 @@ def delete_user(user_id):
 
     return jsonify({"message": f"User '{user.username}' deleted successfully"})
 
-@app.route('/admin/categories', methods=['GET'])
+@api.route('/admin/categories', methods=['GET'])
+@replica_reads
 def get_categories():
     auth_header = request.headers.get('Authorization')
     if not auth_header or not auth_header.startswith('Bearer '):
@@ -338,17 +748,21 @@ def get_categories():
     if not current_user:
         return jsonify({"detail": "Invalid token"}), 401
 
+    return cached_json('categories', ['categories', 'documents'], category_listing)
+
+def category_listing():
     categories = Category.query.order_by(Category.name).all()
+    doc_counts = dict(
+        db.session.query(Document.category, db.func.count(Document.id)).group_by(Document.category).all()
+    )
     result = []
     for cat in categories:
-        doc_count = Document.query.filter_by(category=cat.name).count()
         cat_dict = cat.to_dict()
-        cat_dict['document_count'] = doc_count
+        cat_dict['document_count'] = doc_counts.get(cat.name, 0)
         result.append(cat_dict)
+    return {"categories": result}
 
-    return jsonify({"categories": result})
-
-@app.route('/admin/categories', methods=['POST'])
+@api.route('/admin/categories', methods=['POST'])
 def create_category():
     auth_header = request.headers.get('Authorization')
     if not auth_header or not auth_header.startswith('Bearer '):
@@ -371,7 +785,7 @@ def create_category():
     db.session.commit()
     return jsonify(category.to_dict()), 201
 
-@app.route('/admin/categories/<int:category_id>', methods=['DELETE'])
+@api.route('/admin/categories/<int:category_id>', methods=['DELETE'])
 def delete_category(category_id):
     auth_header = request.headers.get('Authorization')
     if not auth_header or not auth_header.startswith('Bearer '):
@@ -394,7 +808,7 @@ def delete_category(category_id):
     db.session.commit()
     return jsonify({"message": f"Category '{category.name}' deleted successfully"})
 
-@app.route('/users/me', methods=['GET'])
+@api.route('/users/me', methods=['GET'])
 def read_users_me():
     auth_header = request.headers.get('Authorization')
     if not auth_header or not auth_header.startswith('Bearer '):
@@ -410,7 +824,8 @@ def read_users_me():
 
 
 # Tag management endpoints
-@app.route('/admin/tags', methods=['GET'])
+@api.route('/admin/tags', methods=['GET'])
+@replica_reads
 def get_tags():
     auth_header = request.headers.get('Authorization')
     if not auth_header or not auth_header.startswith('Bearer '):
@@ -420,22 +835,24 @@ def get_tags():
     if not current_admin:
         return jsonify({"detail": "Admin privileges required"}), 403
 
+    return cached_json('admin_tags', ['tags', 'users'], tag_listing)
+
+def tag_listing():
     tags = Tag.query.all()
+    members_by_tag = {}
+    member_rows = User.list_query().add_columns(UserTag.tag_id).join(UserTag, UserTag.user_id == User.id)
+    for row in member_rows:
+        members_by_tag.setdefault(row.tag_id, []).append(User.row_to_dict(*row[:-1]))
     result = []
     for tag in tags:
-        members = UserTag.query.filter_by(tag_id=tag.id).all()
-        member_list = []
-        for ut in members:
-            user = User.query.get(ut.user_id)
-            if user:
-                member_list.append(user.to_dict())
+        member_list = members_by_tag.get(tag.id, [])
         tag_dict = tag.to_dict()
         tag_dict['members'] = member_list
         tag_dict['member_count'] = len(member_list)
         result.append(tag_dict)
-    return jsonify({"tags": result})
+    return {"tags": result}
 
-@app.route('/admin/tags', methods=['POST'])
+@api.route('/admin/tags', methods=['POST'])
 def create_tag():
     auth_header = request.headers.get('Authorization')
     if not auth_header or not auth_header.startswith('Bearer '):
@@ -457,7 +874,7 @@ def create_tag():
     db.session.commit()
     return jsonify(tag.to_dict()), 201
 
-@app.route('/admin/tags/<int:tag_id>', methods=['DELETE'])
+@api.route('/admin/tags/<int:tag_id>', methods=['DELETE'])
 def delete_tag(tag_id):
     auth_header = request.headers.get('Authorization')
     if not auth_header or not auth_header.startswith('Bearer '):
@@ -477,7 +894,7 @@ def delete_tag(tag_id):
     db.session.commit()
     return jsonify({"message": "Tag deleted successfully"})
 
-@app.route('/admin/tags/<int:tag_id>/users', methods=['POST'])
+@api.route('/admin/tags/<int:tag_id>/users', methods=['POST'])
 def add_user_to_tag(tag_id):
     auth_header = request.headers.get('Authorization')
     if not auth_header or not auth_header.startswith('Bearer '):
@@ -509,7 +926,7 @@ def add_user_to_tag(tag_id):
     db.session.commit()
     return jsonify({"message": "User added to tag"}), 201
 
-@app.route('/admin/tags/<int:tag_id>/users/<int:user_id>', methods=['DELETE'])
+@api.route('/admin/tags/<int:tag_id>/users/<int:user_id>', methods=['DELETE'])
 def remove_user_from_tag(tag_id, user_id):
     auth_header = request.headers.get('Authorization')
     if not auth_header or not auth_header.startswith('Bearer '):
@@ -527,7 +944,7 @@ def remove_user_from_tag(tag_id, user_id):
     db.session.commit()
     return jsonify({"message": "User removed from tag"})
 
-@app.route('/admin/documents/<int:document_id>/visibility', methods=['PUT'])
+@api.route('/admin/documents/<int:document_id>/visibility', methods=['PUT'])
 def update_document_visibility(document_id):
     auth_header = request.headers.get('Authorization')
     if not auth_header or not auth_header.startswith('Bearer '):
@@ -546,7 +963,8 @@ def update_document_visibility(document_id):
     return jsonify({"message": "Visibility updated"})
 
 # Document management endpoints
-@app.route('/admin/documents', methods=['GET'])
+@api.route('/admin/documents', methods=['GET'])
+@replica_reads
 def get_documents():
     auth_header = request.headers.get('Authorization')
     if not auth_header or not auth_header.startswith('Bearer '):
@@ -559,12 +977,15 @@ def get_documents():
     
     # Get filter parameters
     category = request.args.get('category', 'All')
-    
-    # Query documents
+    # new_this_month also changes when the month does
+    month = datetime.utcnow().strftime('%Y-%m')
+    return cached_json(f"admin_documents:{month}:{category}", ['documents'], lambda: document_listing(category))
+
+def document_listing(category):
+    # Query documents as plain rows: nothing here is modified
+    documents = Document.list_query()
     if category != 'All':
-        documents = Document.query.filter_by(category=category).all()
-    else:
-        documents = Document.query.all()
+        documents = documents.filter(Document.category == category)
     
     # Calculate statistics
     total_documents = Document.query.count()
@@ -575,17 +996,17 @@ def get_documents():
     last_doc = Document.query.order_by(Document.created_at.desc()).first()
     last_updated = last_doc.created_at.strftime('%b %d') if last_doc else 'Never'
     
-    return jsonify({
-        "documents": [doc.to_dict() for doc in documents],
+    return {
+        "documents": Document.rows_to_dicts(documents),
         "statistics": {
             "total_documents": total_documents,
             "new_this_month": new_this_month,
             "categories": categories,
             "last_updated": last_updated
         }
-    })
+    }
 
-@app.route('/admin/documents/upload', methods=['POST'])
+@api.route('/admin/documents/upload', methods=['POST'])
 def upload_document():
     auth_header = request.headers.get('Authorization')
     if not auth_header or not auth_header.startswith('Bearer '):
@@ -616,28 +1037,32 @@ def upload_document():
     if not title:
         return jsonify({"detail": "Title is required"}), 400
     
-    # Generate unique filename
-    filename = secure_filename(file.filename)
-    unique_filename = f"{uuid.uuid4()}_{filename}"
-    
-    # Save file temporarily
-    temp_file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
+    # Save the upload to a temporary file
+    temp_file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], f".upload-{uuid.uuid4()}")
     file.save(temp_file_path)
     
-    # Get file size
+    # Get file size and checksum
     file_size = os.path.getsize(temp_file_path)
     file_size_mb = round(file_size / (1024 * 1024), 1)
-    
-    # Upload to S3
-    s3_key = f"documents/{unique_filename}"
-    if s3_manager.upload_file(temp_file_path, s3_key):
-        # Delete temporary file
+    checksum = run_blocking(file_checksum, temp_file_path)
+
+    # Blobs are content-addressed: identical uploads share one stored file
+    existing = find_blob_by_checksum(checksum)
+    if existing:
         os.remove(temp_file_path)
-        print(f"✅ File uploaded to S3: {s3_key}")
+        blob_filename = existing
+        print(f"♻️ Duplicate upload, reusing stored blob: {blob_filename}")
     else:
-        # If S3 upload fails, keep local file as fallback
-        print(f"❌ S3 upload failed, keeping local file: {temp_file_path}")
-        s3_key = None
+        blob_filename = content_addressed_filename(checksum)
+        os.replace(temp_file_path, os.path.join(current_app.config['UPLOAD_FOLDER'], blob_filename))
+
+    missing_files.clear(blob_filename)
+
+    # Upload to S3, in the background worker when the job queue is enabled.
+    # Until then the document is served from the local copy.
+    storage_job = None
+    if not existing and JOB_QUEUE_ENABLED:
+        storage_job = enqueue('store_blob', {'filename': blob_filename}, commit=False)
     
     # Create document record
     document = Document(
@@ -645,8 +1070,9 @@ def upload_document():
         description=description,
         category=category,
         type="PDF",
-        filename=unique_filename,
+        filename=blob_filename,
         file_size=f"{file_size_mb} MB",
+        checksum=checksum,
         is_external=False,
         external_url=None,
         is_new=True,
@@ -656,14 +1082,23 @@ def upload_document():
     db.session.add(document)
     db.session.commit()
 
+    # Only once the row is committed, so a concurrent deletion sees the blob is referenced
+    if not existing and not JOB_QUEUE_ENABLED:
+        store_blob(blob_filename)
+
     # Save visibility rules if provided
     visibility = request.form.get('visibility')
     if visibility:
         save_document_visibility(document.id, visibility)
 
-    return jsonify(document.to_dict())
+    queue_document_enrichment(document.id)
+
+    result = document.to_dict()
+    if storage_job:
+        result['job_id'] = storage_job.id
+    return jsonify(result)
 
-@app.route('/admin/documents/link', methods=['POST'])
+@api.route('/admin/documents/link', methods=['POST'])
 def add_document_link():
     auth_header = request.headers.get('Authorization')
     if not auth_header or not auth_header.startswith('Bearer '):
@@ -705,9 +1140,11 @@ def add_document_link():
     if visibility:
         save_document_visibility(document.id, visibility)
 
+    queue_document_enrichment(document.id)
+
     return jsonify(document.to_dict())
 
-@app.route('/admin/documents/<int:document_id>', methods=['DELETE'])
+@api.route('/admin/documents/<int:document_id>', methods=['DELETE'])
 def delete_document(document_id):
     auth_header = request.headers.get('Authorization')
     if not auth_header or not auth_header.startswith('Bearer '):
@@ -725,54 +1162,42 @@ def delete_document(document_id):
     # Delete visibility rules
     DocumentVisibility.query.filter_by(document_id=document_id).delete()
 
-    # Delete file from S3 if it exists
+    # Delete the stored file; S3 objects are removed in batches after commit
     deletion_results = {
+        's3_pending': False,
         's3_deleted': False,
         'local_deleted': False,
-        's3_error': None,
-        'local_error': None
+        'local_error': None,
+        'shared_references': 0
     }
-    
+
+    # Blobs are shared between documents with identical contents
     if document.filename:
-        s3_key = f"documents/{document.filename}"
+        deletion_results['shared_references'] = count_blob_references(
+            document.filename, exclude_document_id=document.id
+        )
+    shared_references = deletion_results['shared_references']
+
+    if document.filename and shared_references:
+        print(f"ℹ️ Blob {document.filename} still referenced by {shared_references} document(s), keeping it")
+    elif document.filename:
         print(f"🗑️ Attempting to delete document: {document.title}")
-        print(f"📁 S3 key: {s3_key}")
-        
-        # Try to delete from S3
-        if s3_manager.s3_client:
-            try:
-                if s3_manager.file_exists(s3_key):
-                    if s3_manager.delete_file(s3_key):
-                        deletion_results['s3_deleted'] = True
-                        print(f"✅ Successfully deleted file from S3: {s3_key}")
-                    else:
-                        deletion_results['s3_error'] = "S3 delete operation failed"
-                        print(f"❌ Failed to delete file from S3: {s3_key}")
-                else:
-                    print(f"ℹ️ File not found in S3: {s3_key}")
-            except Exception as e:
-                deletion_results['s3_error'] = str(e)
-                print(f"❌ S3 deletion error: {e}")
-        else:
-            deletion_results['s3_error'] = "S3 client not available"
-            print(f"⚠️ S3 client not available, skipping S3 deletion")
-        
-        # Also delete local file if it exists (fallback)
-        local_file_path = os.path.join(app.config['UPLOAD_FOLDER'], document.filename)
-        if os.path.exists(local_file_path):
-            try:
-                os.remove(local_file_path)
-                deletion_results['local_deleted'] = True
-                print(f"✅ Successfully deleted local file: {local_file_path}")
-            except Exception as e:
-                deletion_results['local_error'] = str(e)
-                print(f"❌ Failed to delete local file: {e}")
-        else:
-            print(f"ℹ️ Local file not found: {local_file_path}")
+        deletion_results.update(delete_blob(document.filename))
     
-    # Remove from database
+    # Remove from database and search index. The flush records a `deleted`
+    # catalog event, the tombstone that /documents?since= clients see.
+    remove_document(document.id)
     db.session.delete(document)
     db.session.commit()
+
+    if document.filename and not shared_references:
+        deletion_results.update(remove_local_blob(document.filename))
+
+    if deletion_results['s3_pending']:
+        flushed = schedule_tombstone_flush()
+        if flushed is not None:
+            deletion_results['s3_deleted'] = flushed['deleted'] > 0
+            deletion_results['s3_pending'] = flushed['failed'] > 0
     
     print(f"✅ Document '{document.title}' deleted successfully from database")
     print(f"📊 Deletion summary: {deletion_results}")
@@ -782,7 +1207,7 @@ def delete_document(document_id):
         "deletion_results": deletion_results
     })
 
-@app.route('/admin/documents/<int:document_id>/download', methods=['GET', 'OPTIONS'])
+@api.route('/admin/documents/<int:document_id>/download', methods=['GET', 'OPTIONS'])
 def download_document_by_id(document_id):
     try:
         # Handle CORS preflight
@@ -790,7 +1215,7 @@ def download_document_by_id(document_id):
             response = make_response('', 200)
             response.headers['Access-Control-Allow-Origin'] = '*'
             response.headers['Access-Control-Allow-Methods'] = 'GET, OPTIONS'
-            response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
+            response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, Range, If-None-Match, If-Range'
             return response
         
         auth_header = request.headers.get('Authorization')
@@ -809,10 +1234,24 @@ def download_document_by_id(document_id):
         
         if not document.filename:
             return jsonify({"detail": "No file associated with this document"}), 400
+
+        if is_not_modified(document):
+            return not_modified_response(document)
+
+        # ?disposition=inline lets browser PDF viewers fetch ranges for preview
+        as_attachment = request.args.get('disposition') != 'inline'
         
+        if missing_files.is_missing(document.filename):
+            return placeholder_response(document, as_attachment)
+
         # Try to get file from S3 first
         s3_key = f"documents/{document.filename}"
-        if s3_manager.file_exists(s3_key):
+        try:
+            in_s3 = s3_manager.file_exists(s3_key)
+        except S3Unavailable:
+            # Unknown: a local copy may still serve, but nothing is marked missing
+            in_s3 = None
+        if in_s3:
             print(f"✅ Admin: File found in S3: {s3_key}")
             # Generate presigned URL for direct download
             download_url = s3_manager.generate_presigned_url(s3_key, expiration=3600)
@@ -825,124 +1264,73 @@ def download_document_by_id(document_id):
                 })
         
         # Fallback to local file
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], document.filename)
+        file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], document.filename)
         print(f"📁 Admin: Checking local file path: {file_path}")
         
         if os.path.exists(file_path):
             print(f"✅ Admin: Local file exists, proceeding with download")
-            response = send_from_directory(
-                app.config['UPLOAD_FOLDER'], 
+            response = send_local_file(
+                current_app.config['UPLOAD_FOLDER'],
                 document.filename, 
-                as_attachment=True,
-                download_name=document.title.replace(' ', '_') + '.pdf'
+                as_attachment=as_attachment,
+                download_name=document.title.replace(' ', '_') + '.pdf',
+                etag=document.checksum,
+                last_modified=document.updated_at
             )
             response.headers['Access-Control-Allow-Origin'] = '*'
             response.headers['Access-Control-Allow-Methods'] = 'GET, OPTIONS'
             response.headers['Access-Control-Allow-Headers'] = 'Authorization, Content-Type'
             return response
         
-        # If neither S3 nor local file exists, create temporary PDF
-        print(f"❌ Admin: File not found in S3 or locally, creating temporary PDF")
-        try:
-            title_text = document.title.replace('(', '').replace(')', '').replace('\\', '')
-            current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            
-            pdf_content = f"""%PDF-1.4
-1 0 obj
-<<
-/Type /Catalog
-/Pages 2 0 R
->>
-endobj
-
-2 0 obj
-<<
-/Type /Pages
-/Kids [3 0 R]
-/Count 1
->>
-endobj
-
-3 0 obj
-<<
-/Type /Page
-/Parent 2 0 R
-/MediaBox [0 0 612 792]
-/Contents 4 0 R
-/Resources <<
-/Font <<
-/F1 <<
-/Type /Font
-/Subtype /Type1
-/BaseFont /Helvetica
->>
->>
->>
->>
-endobj
-
-4 0 obj
-<<
-/Length 200
->>
-stream
-BT
-/F1 16 Tf
-72 720 Td
-({title_text}) Tj
-0 -30 Td
-/F1 12 Tf
-(This is a temporary file) Tj
-0 -20 Td
-(Created on {current_time}) Tj
-0 -20 Td
-(File not found on server) Tj
-0 -20 Td
-(Please contact administrator) Tj
-ET
-endstream
-endobj
-
-xref
-0 5
-0000000000 65535 f 
-0000000009 00000 n 
-0000000058 00000 n 
-0000000115 00000 n 
-0000000204 00000 n 
-trailer
-<<
-/Size 5
-/Root 1 0 R
->>
-startxref
-500
-%%EOF"""
-            
-            with open(file_path, 'wb') as f:
-                f.write(pdf_content.encode('utf-8'))
-            print(f"✅ Admin: Created temporary PDF file: {document.filename}")
-            
-            response = send_from_directory(
-                app.config['UPLOAD_FOLDER'], 
-                document.filename, 
-                as_attachment=True,
-                download_name=document.title.replace(' ', '_') + '.pdf'
-            )
-            response.headers['Access-Control-Allow-Origin'] = '*'
-            response.headers['Access-Control-Allow-Methods'] = 'GET, OPTIONS'
-            response.headers['Access-Control-Allow-Headers'] = 'Authorization, Content-Type'
-            return response
-            
-        except Exception as e:
-            print(f"❌ Admin: Failed to create temporary file: {e}")
-            return jsonify({"detail": "File not found and could not create temporary file"}), 404
+        if in_s3 is None:
+            print(f"🔌 Admin: S3 unavailable and no local copy of {document.filename}")
+            return storage_unavailable_response()
+
+        # Neither in S3 nor local: serve the placeholder, never write into storage
+        print(f"❌ Admin: File not found in S3 or locally, serving placeholder PDF")
+        report_missing_file(document)
+        return placeholder_response(document, as_attachment)
         
     except Exception as e:
         print(f"Download error: {str(e)}")
         return jsonify({"detail": "Download failed"}), 500
 
-@app.route('/documents/<int:document_id>/download', methods=['GET', 'OPTIONS'])
+@api.route('/admin/jobs', methods=['GET'])
+def get_jobs():
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return jsonify({"detail": "Admin token required"}), 401
+    token = auth_header.split(' ')[1]
+    current_admin = get_current_admin(token)
+    if not current_admin:
+        return jsonify({"detail": "Admin privileges required"}), 403
+
+    query = Job.query
+    status = request.args.get('status')
+    if status:
+        query = query.filter_by(status=status)
+    limit = min(request.args.get('limit', 100, type=int), 1000)
+    jobs = query.order_by(Job.id.desc()).limit(limit).all()
+
+    counts = dict(db.session.query(Job.status, db.func.count(Job.id)).group_by(Job.status).all())
+    return jsonify({"jobs": [job.to_dict() for job in jobs], "counts": counts})
+
+@api.route('/admin/jobs/<int:job_id>', methods=['GET'])
+def get_job(job_id):
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return jsonify({"detail": "Admin token required"}), 401
+    token = auth_header.split(' ')[1]
+    current_admin = get_current_admin(token)
+    if not current_admin:
+        return jsonify({"detail": "Admin privileges required"}), 403
+
+    job = Job.query.get(job_id)
+    if not job:
+        return jsonify({"detail": "Job not found"}), 404
+    return jsonify(job.to_dict())
+
+@api.route('/documents/<int:document_id>/download', methods=['GET', 'OPTIONS'])
 def download_document_user(document_id):
     try:
         print(f"📥 User download request for document ID: {document_id}")
@@ -952,7 +1340,7 @@ def download_document_user(document_id):
             response = make_response('', 200)
             response.headers['Access-Control-Allow-Origin'] = '*'
             response.headers['Access-Control-Allow-Methods'] = 'GET, OPTIONS'
-            response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
+            response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, Range, If-None-Match, If-Range'
             return response
         
         auth_header = request.headers.get('Authorization')
@@ -972,8 +1360,8 @@ def download_document_user(document_id):
         
         # Get document from database
         document = Document.query.get(document_id)
-        if not document:
-            print(f"❌ Document with ID {document_id} not found in database")
+        if not document or not can_view_document(current_user, document.id):
+            print(f"❌ Document with ID {document_id} not found or not visible to {current_user.username}")
             return jsonify({"detail": "Document not found"}), 404
         
         print(f"📄 Document found: {document.title}, filename: {document.filename}")
@@ -981,10 +1369,25 @@ def download_document_user(document_id):
         if not document.filename:
             print("❌ Document has no filename")
             return jsonify({"detail": "No file associated with this document"}), 400
+
+        if is_not_modified(document):
+            return not_modified_response(document)
+
+        # ?disposition=inline lets browser PDF viewers fetch ranges for preview
+        as_attachment = request.args.get('disposition') != 'inline'
+        etag = document.checksum
         
+        if missing_files.is_missing(document.filename):
+            return placeholder_response(document, as_attachment)
+
         # Try to get file from S3 first
         s3_key = f"documents/{document.filename}"
-        if s3_manager.file_exists(s3_key):
+        try:
+            in_s3 = s3_manager.file_exists(s3_key)
+        except S3Unavailable:
+            # Unknown: a local copy may still serve, but nothing is marked missing
+            in_s3 = None
+        if in_s3:
             print(f"✅ File found in S3: {s3_key}")
             # Generate presigned URL for direct download
             download_url = s3_manager.generate_presigned_url(s3_key, expiration=3600)
@@ -997,109 +1400,28 @@ def download_document_user(document_id):
                 })
         
         # Fallback to local file
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], document.filename)
+        file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], document.filename)
         print(f"📁 Checking local file path: {file_path}")
+        if not os.path.exists(file_path) and in_s3 is None:
+            print(f"🔌 S3 unavailable and no local copy of {document.filename}")
+            return storage_unavailable_response()
         if not os.path.exists(file_path):
-            print(f"❌ File not found at: {file_path}")
-            print(f"🔄 Creating temporary PDF file for: {document.title}")
-            
-            # Create a temporary PDF file
-            try:
-                # Create a simple, valid PDF content
-                title_text = document.title.replace('(', '').replace(')', '').replace('\\', '')
-                current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                
-                # Simple PDF structure
-                pdf_content = f"""%PDF-1.4
-1 0 obj
-<<
-/Type /Catalog
-/Pages 2 0 R
->>
-endobj
-
-2 0 obj
-<<
-/Type /Pages
-/Kids [3 0 R]
-/Count 1
->>
-endobj
-
-3 0 obj
-<<
-/Type /Page
-/Parent 2 0 R
-/MediaBox [0 0 612 792]
-/Contents 4 0 R
-/Resources <<
-/Font <<
-/F1 <<
-/Type /Font
-/Subtype /Type1
-/BaseFont /Helvetica
->>
->>
->>
->>
-endobj
-
-4 0 obj
-<<
-/Length 200
->>
-stream
-BT
-/F1 16 Tf
-72 720 Td
-({title_text}) Tj
-0 -30 Td
-/F1 12 Tf
-(This is a temporary file) Tj
-0 -20 Td
-(Created on {current_time}) Tj
-0 -20 Td
-(File not found on server) Tj
-0 -20 Td
-(Please contact administrator) Tj
-ET
-endstream
-endobj
-
-xref
-0 5
-0000000000 65535 f 
-0000000009 00000 n 
-0000000058 00000 n 
-0000000115 00000 n 
-0000000204 00000 n 
-trailer
-<<
-/Size 5
-/Root 1 0 R
->>
-startxref
-500
-%%EOF"""
-                
-                # Write as binary to ensure proper PDF format
-                with open(file_path, 'wb') as f:
-                    f.write(pdf_content.encode('utf-8'))
-                print(f"✅ Created temporary PDF file: {document.filename}")
-            except Exception as e:
-                print(f"❌ Failed to create temporary file: {e}")
-                return jsonify({"detail": "File not found on server and could not create temporary file"}), 404
+            print(f"❌ File not found at: {file_path}, serving placeholder PDF")
+            report_missing_file(document)
+            return placeholder_response(document, as_attachment)
         
         print(f"✅ File exists, proceeding with download")
         
         print(f"📥 User {current_user.username} downloading document: {document.filename}")
         
         # Set proper headers for file download
-        response = send_from_directory(
-            app.config['UPLOAD_FOLDER'], 
+        response = send_local_file(
+            current_app.config['UPLOAD_FOLDER'],
             document.filename, 
-            as_attachment=True,
-            download_name=document.title.replace(' ', '_') + '.pdf'
+            as_attachment=as_attachment,
+            download_name=document.title.replace(' ', '_') + '.pdf',
+            etag=etag,
+            last_modified=document.updated_at
         )
 
         print(f"📥 Response created, content-type: {response.content_type}")
@@ -1115,7 +1437,7 @@ startxref
         print(f"Error downloading document: {e}")
         return jsonify({"detail": "Error downloading document"}), 500
 
-@app.route('/documents/<filename>', methods=['GET'])
+@api.route('/documents/<filename>', methods=['GET'])
 def download_document(filename):
     auth_header = request.headers.get('Authorization')
     if not auth_header or not auth_header.startswith('Bearer '):
@@ -1125,12 +1447,124 @@ def download_document(filename):
     current_user = get_current_user(token)
     if not current_user:
         return jsonify({"detail": "Invalid token"}), 401
-    
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
 
-@app.route('/documents', methods=['GET'])
+    # Only blobs of documents the user can see; several documents may share one
+    document_ids = [row.id for row in db.session.query(Document.id).filter(Document.filename == filename)]
+    if not document_ids or not (current_user.is_admin or visible_document_ids(current_user.id, document_ids)):
+        return jsonify({"detail": "Document not found"}), 404
+
+    local_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
+    if filename == secure_filename(filename) and not os.path.exists(local_path):
+        # Not stored locally: serve it through the S3 read-through cache
+        cached_path = s3_cache.get(f"documents/{filename}")
+        if cached_path:
+            return send_local_file(
+                s3_cache.cache_dir,
+                os.path.basename(cached_path),
+                mimetype='application/pdf'
+            )
+
+    return send_local_file(current_app.config['UPLOAD_FOLDER'], filename)
+
+@api.route('/documents/<int:document_id>/thumbnail', methods=['GET'])
+def get_document_thumbnail(document_id):
+    """First-page thumbnail, rendered once in the background and cached by clients"""
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return jsonify({"detail": "Token required"}), 401
+
+    token = auth_header.split(' ')[1]
+    current_user = get_current_user(token)
+    if not current_user:
+        return jsonify({"detail": "Invalid token"}), 401
+
+    document = Document.query.get(document_id)
+    # Hidden documents look the same as missing ones
+    if not document or not can_view_document(current_user, document.id):
+        return jsonify({"detail": "Document not found"}), 404
+    if not document.thumbnail_key:
+        return jsonify({"detail": "Thumbnail not available yet"}), 404
+
+    etag = f"thumb-{document.checksum}" if document.checksum else None
+    if etag and request.if_none_match.contains(etag):
+        response = make_response('', 304)
+        response.set_etag(etag)
+        return response
+
+    local_thumbnail_path = os.path.join(current_app.config['UPLOAD_FOLDER'], document.thumbnail_key)
+    if os.path.exists(local_thumbnail_path):
+        response = send_local_file(current_app.config['UPLOAD_FOLDER'], document.thumbnail_key, etag=etag)
+    else:
+        cached_path = s3_cache.get(document.thumbnail_key)
+        if not cached_path:
+            return jsonify({"detail": "Thumbnail not found in storage"}), 404
+        response = send_local_file(s3_cache.cache_dir, os.path.basename(cached_path), mimetype='image/png', etag=etag)
+
+    # The thumbnail of a blob never changes
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+@api.route('/documents/<int:document_id>/preview', methods=['GET'])
+def get_document_preview(document_id):
+    """Document metadata, thumbnail link and a text excerpt, without the file itself"""
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return jsonify({"detail": "Token required"}), 401
+
+    token = auth_header.split(' ')[1]
+    current_user = get_current_user(token)
+    if not current_user:
+        return jsonify({"detail": "Invalid token"}), 401
+
+    document = Document.query.get(document_id)
+    # Hidden documents look the same as missing ones
+    if not document or not can_view_document(current_user, document.id):
+        return jsonify({"detail": "Document not found"}), 404
+
+    preview = document.to_dict()
+    preview['excerpt'] = get_indexed_text(document.id, max_chars=1000)
+    return jsonify(preview)
+
+@api.route('/documents/search', methods=['GET'])
+@replica_reads
+def search_documents_user():
+    """Ranked full-text search over the documents visible to the user"""
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return jsonify({"detail": "Token required"}), 401
+
+    token = auth_header.split(' ')[1]
+    current_user = get_current_user(token)
+    if not current_user:
+        return jsonify({"detail": "Invalid token"}), 401
+
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"detail": "Search query (q) is required"}), 400
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+
+    hits = search_documents(
+        query,
+        user_id=None if current_user.is_admin else current_user.id,
+        limit=limit
+    )
+    documents = {row.id: row for row in Document.list_query().filter(Document.id.in_([hit[0] for hit in hits]))}
+
+    results = []
+    for document_id, rank, snippet in hits:
+        document = documents.get(document_id)
+        if document:
+            result = Document.row_to_dict(*document)
+            result['rank'] = rank
+            result['snippet'] = snippet
+            results.append(result)
+
+    return jsonify({"query": query, "results": results, "total": len(results)})
+
+@api.route('/documents', methods=['GET'])
+@replica_reads
 def get_documents_user():
-    """Get documents filtered by user visibility"""
+    """Get documents filtered by user visibility; with ?since=<cursor>, only what changed (see document_delta)"""
     try:
         auth_header = request.headers.get('Authorization')
         if not auth_header or not auth_header.startswith('Bearer '):
@@ -1143,53 +1577,213 @@ def get_documents_user():
 
         print(f"📄 User {current_user.username} requesting documents list")
 
-        # Admin sees all documents
-        if current_user.is_admin:
-            documents = Document.query.all()
-            documents_data = [doc.to_dict() for doc in documents]
-            print(f"📄 Admin sees all {len(documents_data)} documents")
-            return jsonify(documents_data)
-
-        # Regular user: filter by visibility
-        all_documents = Document.query.all()
-        visible_docs = []
-
-        # Get user's tag IDs
-        user_tag_ids = [ut.tag_id for ut in UserTag.query.filter_by(user_id=current_user.id).all()]
-
-        for doc in all_documents:
-            rules = DocumentVisibility.query.filter_by(document_id=doc.id).all()
-
-            # No visibility rules = visible to all (backward compat)
-            if not rules:
-                visible_docs.append(doc)
-                continue
-
-            # Check each rule
-            for rule in rules:
-                if rule.visibility_type == 'all':
-                    visible_docs.append(doc)
-                    break
-                elif rule.visibility_type == 'tag' and rule.target_id in user_tag_ids:
-                    visible_docs.append(doc)
-                    break
-                elif rule.visibility_type == 'user' and rule.target_id == current_user.id:
-                    visible_docs.append(doc)
-                    break
-
-        documents_data = [doc.to_dict() for doc in visible_docs]
-        print(f"📄 Found {len(documents_data)} visible documents for user {current_user.username}")
-        return jsonify(documents_data)
+        since = request.args.get('since')
+        if since is not None:
+            try:
+                since = int(since)
+            except ValueError:
+                return jsonify({"detail": "Invalid since cursor"}), 400
+            return jsonify(document_delta(current_user, since))
+
+        return user_document_listing(current_user)
 
     except Exception as e:
         print(f"Error getting documents for user: {e}")
         return jsonify({"detail": "Error retrieving documents"}), 500
 
-@app.route('/debug/files', methods=['GET'])
+def user_document_listing(user, fresh=False):
+    """GET /documents for ``user``, through the catalog cache"""
+    # Admin sees all documents
+    if user.is_admin:
+        return cached_json('documents:all', ['documents'],
+                           lambda: Document.rows_to_dicts(Document.list_query()), fresh)
+
+    # Regular user: filter by visibility, which also depends on the user's tags
+    return cached_json(f"documents:user:{user.id}", ['documents', 'tags'],
+                       lambda: Document.rows_to_dicts(visible_documents(user)), fresh)
+
+def document_delta(user, since):
+    """Changes to the documents ``user`` may see after the event id ``since``.
+
+    ``documents`` holds the documents created, changed or made visible since
+    then, as they are now, and ``removed`` the ids of those deleted or hidden
+    from the user, which may include ids the client never had. ``cursor`` is
+    the since value for the next call. With ``reset`` true, ``documents`` is
+    the full list instead and the client replaces what it has: for since=0,
+    when events after the cursor have been pruned, when there are more than
+    DELTA_MAX_EVENTS of them, or when the user's tags changed.
+    """
+    events = [] if since <= 0 else catalog_events.events_after(since, catalog_events.DELTA_MAX_EVENTS + 1)
+    reset = (since <= 0 or catalog_events.cursor_expired(since)
+             or len(events) > catalog_events.DELTA_MAX_EVENTS
+             or any(event.kind == 'access_changed' and event.user_id == user.id for event in events))
+    if reset:
+        # The cursor first: the list is at least as new, and the client replays whatever is newer
+        cursor = catalog_events.latest_event_id()
+        documents = user_document_listing(user, fresh=True).get_json()
+        return {"cursor": cursor, "documents": documents, "removed": [], "reset": True}
+
+    removed = {event.document_id for event in events if event.kind == 'deleted'}
+    changed = {event.document_id for event in events
+               if event.kind in ('created', 'updated', 'visibility_changed')} - removed
+    rows = Document.list_query().filter(Document.id.in_(changed)).all() if changed else []
+    visible = {row.id for row in rows} if user.is_admin else visible_document_ids(user.id, [row.id for row in rows])
+    documents = Document.rows_to_dicts(row for row in rows if row.id in visible)
+    # Changed and now hidden, or deleted since (and recorded in a later event)
+    removed |= changed - visible
+    return {
+        "cursor": max([since] + [event.id for event in events]),
+        "documents": documents,
+        "removed": sorted(removed),
+        "reset": False
+    }
+
+def feed_messages(user_id, is_admin, events):
+    """SSE messages for the ``events`` the user may see.
+
+    Documents are sent as they are now, so an event for a document deleted
+    since is skipped (its deleted event follows). A document the user can no
+    longer see is announced as visibility_changed with visible false and no
+    contents. Deletions go to everyone, as ids only: whether the user could
+    see a deleted document is no longer known.
+    """
+    document_ids = {event.document_id for event in events if event.document_id is not None}
+    rows = Document.list_query().filter(Document.id.in_(document_ids)) if document_ids else []
+    documents = {row.id: Document.row_to_dict(*row) for row in rows}
+    visible = set(documents) if is_admin else visible_document_ids(user_id, list(documents))
+    messages = []
+    for event in events:
+        if event.kind == 'access_changed':
+            if event.user_id == user_id:
+                messages.append(sse_message(event.id, event.kind, current_app.json.dumps({'user_id': user_id})))
+        elif event.kind == 'deleted':
+            messages.append(sse_message(event.id, event.kind, current_app.json.dumps({'document_id': event.document_id})))
+        elif event.document_id in visible:
+            data = {'document_id': event.document_id, 'visible': True, 'document': documents[event.document_id]}
+            messages.append(sse_message(event.id, event.kind, current_app.json.dumps(data)))
+        elif event.kind == 'visibility_changed' and event.document_id in documents:
+            data = {'document_id': event.document_id, 'visible': False}
+            messages.append(sse_message(event.id, event.kind, current_app.json.dumps(data)))
+    return messages
+
+@api.route('/documents/events/token', methods=['POST'])
+def document_events_token():
+    """Short-lived token for /documents/events?token=.
+
+    EventSource cannot send headers, and a query string ends up in access
+    logs, so the feed gets its own token that is good for nothing else.
+    """
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return jsonify({"detail": "Token required"}), 401
+
+    token = auth_header.split(' ')[1]
+    current_user = get_current_user(token)
+    if not current_user:
+        return jsonify({"detail": "Invalid token"}), 401
+
+    feed_token = create_access_token(
+        {"sub": current_user.username, "scope": FEED_TOKEN_SCOPE},
+        expires_delta=timedelta(seconds=catalog_events.CATALOG_FEED_TOKEN_SECONDS)
+    )
+    response = jsonify({"token": feed_token, "expires_in": catalog_events.CATALOG_FEED_TOKEN_SECONDS})
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@api.route('/documents/events', methods=['GET'])
+def document_events():
+    """Server-Sent Events feed of the catalog changes the user may see.
+
+    EventSource cannot send headers, so it passes a feed token from
+    /documents/events/token as ?token=; the login token is not accepted there.
+    The feed resumes after the Last-Event-ID header, which EventSource sends
+    when it reconnects, or ?last_event_id=; without either it starts now.
+    If events after it were pruned, or it is ahead of every event, the feed
+    sends a reset event (reload the list) and starts now.
+    Under gevent workers the response streams, with keepalive comments,
+    until CATALOG_FEED_MAX_STREAM_SECONDS. Sync workers answer with the
+    pending events and a retry delay and close, so no connection holds a
+    worker.
+    """
+    auth_header = request.headers.get('Authorization')
+    if auth_header and auth_header.startswith('Bearer '):
+        current_user = get_current_user(auth_header.split(' ')[1])
+    elif request.args.get('token'):
+        current_user = get_current_user(request.args.get('token'), scope=FEED_TOKEN_SCOPE)
+    else:
+        return jsonify({"detail": "Token required"}), 401
+
+    if not current_user:
+        return jsonify({"detail": "Invalid token"}), 401
+    user_id, is_admin = current_user.id, current_user.is_admin
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    reset = ''
+    if last_event_id:
+        try:
+            cursor = int(last_event_id)
+        except ValueError:
+            return jsonify({"detail": "Invalid Last-Event-ID"}), 400
+        # 0 is the cursor handed out while the table was empty
+        if cursor and catalog_events.cursor_expired(cursor):
+            cursor = catalog_events.latest_event_id()
+            reset = sse_message(cursor, 'reset', '{}')
+    else:
+        cursor = catalog_events.latest_event_id()
+
+    def read(cursor):
+        """Messages after ``cursor``, the new cursor, and whether more are waiting"""
+        events = catalog_events.events_after(cursor, catalog_events.FEED_BATCH_SIZE)
+        messages = feed_messages(user_id, is_admin, events)
+        new_cursor = events[-1].id if events else cursor
+        if new_cursor != cursor and len(messages) < len(events):
+            # Moves the client past events it was not shown
+            messages.append(sse_message(new_cursor))
+        # Give the connection back to the pool while the stream waits
+        db.session.close()
+        return messages, new_cursor, len(events) == catalog_events.FEED_BATCH_SIZE
+
+    if not is_green():
+        messages, cursor, _ = read(cursor)
+        body = f"retry: {int(catalog_events.CATALOG_FEED_RETRY_SECONDS * 1000)}\n\n" + reset + ''.join(messages)
+        if not messages:
+            body += sse_message(cursor)
+        return current_app.response_class(body, mimetype='text/event-stream',
+                                          headers={'Cache-Control': 'no-cache'})
+
+    catalog_cache.watcher.ensure_started(db.engine)
+
+    def stream(cursor):
+        metrics.CATALOG_FEED_STREAMS.inc()
+        try:
+            yield "retry: 1000\n\n" + (reset or sse_message(cursor))
+            deadline = time.monotonic() + catalog_events.CATALOG_FEED_MAX_STREAM_SECONDS
+            last_sent = time.monotonic()
+            while time.monotonic() < deadline:
+                generation = catalog_events.change_signal.generation
+                messages, cursor, more = read(cursor)
+                if messages:
+                    yield ''.join(messages)
+                    last_sent = time.monotonic()
+                if more:
+                    continue
+                if time.monotonic() - last_sent >= catalog_events.CATALOG_FEED_HEARTBEAT_SECONDS:
+                    yield ": keepalive\n\n"
+                    last_sent = time.monotonic()
+                # Without a live watcher nothing wakes the stream; look again at the next heartbeat
+                catalog_events.change_signal.wait(generation, catalog_events.CATALOG_FEED_HEARTBEAT_SECONDS)
+        finally:
+            metrics.CATALOG_FEED_STREAMS.dec()
+
+    # X-Accel-Buffering: nginx passes each message on as it is written
+    return current_app.response_class(stream_with_context(stream(cursor)), mimetype='text/event-stream',
+                                      headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@api.route('/debug/files', methods=['GET'])
 def debug_files():
     """Debug endpoint to list files in uploads directory"""
     try:
-        upload_dir = app.config['UPLOAD_FOLDER']
+        upload_dir = current_app.config['UPLOAD_FOLDER']
         print(f"📁 Upload directory: {upload_dir}")
         
         if not os.path.exists(upload_dir):
@@ -1217,7 +1811,7 @@ def debug_files():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@app.route('/debug/s3', methods=['GET'])
+@api.route('/debug/s3', methods=['GET'])
 def debug_s3():
     """Debug endpoint to check S3 configuration"""
     try:
@@ -1239,7 +1833,7 @@ def debug_s3():
         if s3_manager.s3_client:
             try:
                 # Try to list objects in bucket
-                response = s3_manager.s3_client.list_objects_v2(Bucket=aws_bucket, MaxKeys=1)
+                response = s3_manager.call('list_objects_v2', Bucket=aws_bucket, MaxKeys=1)
                 s3_status = 'CONNECTED'
                 bucket_objects = response.get('Contents', [])
                 s3_info = {
@@ -1264,14 +1858,89 @@ def debug_s3():
         
         return jsonify({
             'config': config_status,
-            's3': s3_info
+            's3': s3_info,
+            'circuit_breaker': s3_manager.breaker.stats()
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/debug/cleanup-orphaned', methods=['POST'])
+@api.route('/debug/s3-cache', methods=['GET'])
+def debug_s3_cache():
+    """Hit/miss/eviction metrics for the local S3 read-through cache"""
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return jsonify({"detail": "Token required"}), 401
+
+    token = auth_header.split(' ')[1]
+    current_user = get_current_user(token)
+    if not current_user or not current_user.is_admin:
+        return jsonify({"detail": "Admin privileges required"}), 403
+
+    return jsonify({**s3_cache.stats(), 'missing_files': missing_files.stats()})
+
+@api.route('/debug/catalog-cache', methods=['GET'])
+def debug_catalog_cache():
+    """Entries and this worker's hit/miss counts for the catalog response caches, and its catalog versions"""
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return jsonify({"detail": "Token required"}), 401
+
+    token = auth_header.split(' ')[1]
+    current_user = get_current_user(token)
+    if not current_user or not current_user.is_admin:
+        return jsonify({"detail": "Admin privileges required"}), 403
+
+    return jsonify(catalog_cache.stats())
+
+@api.route('/debug/db', methods=['GET'])
+def debug_db():
+    """Database binds, their connection pools and read replica health"""
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return jsonify({"detail": "Token required"}), 401
+
+    token = auth_header.split(' ')[1]
+    current_user = get_current_user(token)
+    if not current_user or not current_user.is_admin:
+        return jsonify({"detail": "Admin privileges required"}), 403
+
+    replica = db.engines.get(db_routing.REPLICA_BIND)
+    return jsonify({
+        'binds': sorted(key or 'primary' for key in db.engines),
+        'pools': {key or 'primary': db_pool.pool_stats(engine) for key, engine in db.engines.items()},
+        'replica': {
+            **db_routing.lag_monitor.stats(),
+            'sticky_seconds': db_routing.REPLICA_STICKY_SECONDS
+        } if replica is not None else None
+    })
+
+@api.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus scrape endpoint, aggregated across gunicorn workers.
+
+    Protected by METRICS_TOKEN when it is set; nginx keeps it off the public site.
+    """
+    if metrics.prometheus_client is None:
+        return jsonify({"detail": "prometheus_client is not installed"}), 503
+    if metrics.METRICS_TOKEN:
+        auth_header = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(auth_header, f"Bearer {metrics.METRICS_TOKEN}"):
+            return jsonify({"detail": "Metrics token required"}), 401
+
+    body, content_type = metrics.render_metrics()
+    response = make_response(body)
+    response.headers['Content-Type'] = content_type
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@api.route('/debug/cleanup-orphaned', methods=['POST'])
 def cleanup_orphaned_documents():
-    """Clean up documents that exist in DB but have no physical file"""
+    """Reconcile S3 and local storage against document rows.
+
+    Reports orphaned blobs and documents whose file is missing. Pass
+    purge=true to delete orphaned blobs and purge_rows=true to delete the
+    dangling documents. Runs as a background job when the job queue is enabled.
+    """
     try:
         auth_header = request.headers.get('Authorization')
         if not auth_header or not auth_header.startswith('Bearer '):
@@ -1281,41 +1950,34 @@ def cleanup_orphaned_documents():
         current_user = get_current_user(token)
         if not current_user or not current_user.is_admin:
             return jsonify({"detail": "Admin privileges required"}), 403
-        
-        upload_dir = app.config['UPLOAD_FOLDER']
-        orphaned_docs = []
-        cleaned_docs = []
-        
-        # Get all documents from DB
-        documents = Document.query.all()
-        
-        for doc in documents:
-            if doc.filename:  # Only check documents with filenames
-                file_path = os.path.join(upload_dir, doc.filename)
-                if not os.path.exists(file_path):
-                    orphaned_docs.append({
-                        "id": doc.id,
-                        "title": doc.title,
-                        "filename": doc.filename
-                    })
-                    # Optionally delete from DB
-                    # db.session.delete(doc)
-                    # cleaned_docs.append(doc.id)
-        
-        # db.session.commit()
-        
+
+        options = {
+            'purge': request.args.get('purge', 'false').lower() == 'true',
+            'purge_rows': request.args.get('purge_rows', 'false').lower() == 'true'
+        }
+
+        if JOB_QUEUE_ENABLED:
+            job = enqueue('reconcile_storage', options)
+            return jsonify({"message": "Reconciliation queued", "job_id": job.id}), 202
+
+        report = reconcile_storage(current_app.config['UPLOAD_FOLDER'], **options)
         return jsonify({
-            "orphaned_documents": orphaned_docs,
-            "cleaned_documents": cleaned_docs,
-            "total_orphaned": len(orphaned_docs)
+            "orphaned_documents": report['dangling_rows']['samples'],
+            "cleaned_documents": report['purged_rows'],
+            "total_orphaned": report['dangling_rows']['count'],
+            "report": report
         })
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@app.route('/debug/recreate-sample-files', methods=['POST'])
+@api.route('/debug/recreate-sample-files', methods=['POST'])
 def recreate_sample_files():
-    """Recreate sample PDF files for existing documents"""
+    """Report documents whose file is missing.
+
+    Nothing is written to storage: downloads of a missing file serve the
+    in-memory placeholder, and each one gets a repair_missing_file job.
+    """
     try:
         auth_header = request.headers.get('Authorization')
         if not auth_header or not auth_header.startswith('Bearer '):
@@ -1326,118 +1988,43 @@ def recreate_sample_files():
         if not current_user or not current_user.is_admin:
             return jsonify({"detail": "Admin privileges required"}), 403
         
-        print("🔄 Recreating sample PDF files...")
+        print("🔄 Checking PDF documents for missing files...")
         
         # Get all PDF documents from DB
         pdf_documents = Document.query.filter_by(type="PDF").all()
-        created_files = []
-        failed_files = []
+        missing = []
+        skipped_files = []
         
         for doc in pdf_documents:
             if doc.filename:
-                # Create the PDF file
-                upload_dir = app.config['UPLOAD_FOLDER']
-                file_path = os.path.join(upload_dir, doc.filename)
-                
-                # Create a simple, valid PDF content
-                title_text = doc.title.replace('(', '').replace(')', '').replace('\\', '')
-                current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                
-                pdf_content = f"""%PDF-1.4
-1 0 obj
-<<
-/Type /Catalog
-/Pages 2 0 R
->>
-endobj
-
-2 0 obj
-<<
-/Type /Pages
-/Kids [3 0 R]
-/Count 1
->>
-endobj
-
-3 0 obj
-<<
-/Type /Page
-/Parent 2 0 R
-/MediaBox [0 0 612 792]
-/Contents 4 0 R
-/Resources <<
-/Font <<
-/F1 <<
-/Type /Font
-/Subtype /Type1
-/BaseFont /Helvetica
->>
->>
->>
->>
-endobj
-
-4 0 obj
-<<
-/Length 200
->>
-stream
-BT
-/F1 16 Tf
-72 720 Td
-({title_text}) Tj
-0 -30 Td
-/F1 12 Tf
-(Sample document content) Tj
-0 -20 Td
-(Created on {current_time}) Tj
-0 -20 Td
-(SequoAlpha Management) Tj
-ET
-endstream
-endobj
-
-xref
-0 5
-0000000000 65535 f 
-0000000009 00000 n 
-0000000058 00000 n 
-0000000115 00000 n 
-0000000204 00000 n 
-trailer
-<<
-/Size 5
-/Root 1 0 R
->>
-startxref
-500
-%%EOF"""
-                
+                file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], doc.filename)
                 try:
-                    # Write as binary to ensure proper PDF format
-                    with open(file_path, 'wb') as f:
-                        f.write(pdf_content.encode('utf-8'))
-                    created_files.append(doc.filename)
-                    print(f"✅ Created: {doc.filename}")
-                except Exception as e:
-                    failed_files.append({"filename": doc.filename, "error": str(e)})
-                    print(f"❌ Failed to create {doc.filename}: {e}")
+                    stored = os.path.exists(file_path) or s3_manager.file_exists(f"documents/{doc.filename}")
+                except S3Unavailable:
+                    # S3 may hold it; leave it alone
+                    stored = True
+                if stored:
+                    skipped_files.append(doc.filename)
+                    continue
+                report_missing_file(doc)
+                missing.append(doc.filename)
         
         return jsonify({
-            "message": "Sample files recreation completed",
-            "created_files": created_files,
-            "failed_files": failed_files,
-            "total_created": len(created_files),
-            "total_failed": len(failed_files)
+            "message": "Missing files reported",
+            "missing_files": missing,
+            "skipped_files": skipped_files,
+            "total_missing": len(missing)
         })
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@app.route('/', methods=['GET'])
+@api.route('/', methods=['GET'])
 def root():
     return jsonify({"message": "SequoAlpha Management API - Secure Access Only"})
 
+app = create_app()
+
 if __name__ == '__main__':
     # Initialize database and create sample files
     with app.app_context():
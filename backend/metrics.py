@@ -0,0 +1,159 @@
+"""Prometheus metrics for the backend.
+
+Under gunicorn every worker is a separate process, so counters are written
+to per-process files in PROMETHEUS_MULTIPROC_DIR (set up by gunicorn.conf.py)
+and merged when /metrics is scraped. Without that variable, as with
+``python main.py``, the process's own registry is served.
+
+Hit ratios are derived at query time, e.g.
+``rate(s3_cache_events_total{event="hits"}[5m]) /
+(rate(s3_cache_events_total{event="hits"}[5m]) + rate(s3_cache_events_total{event="misses"}[5m]))``.
+
+prometheus_client is optional: without it every metric is a no-op and
+/metrics answers 503.
+"""
+import os
+import time
+from flask import g, request
+from query_inspector import current_stats
+
+try:
+    import prometheus_client
+    from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, multiprocess
+except ImportError:
+    prometheus_client = None
+
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+POOL_WAIT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Breaker states as gauge values; the highest across workers is reported
+BREAKER_STATE_VALUES = {'closed': 0, 'half_open': 1, 'open': 2}
+
+
+class _NoopMetric:
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value):
+        pass
+
+
+if prometheus_client:
+    HTTP_REQUESTS = Counter(
+        'http_requests_total', 'HTTP requests by route and status',
+        ['method', 'route', 'status'])
+    HTTP_LATENCY = Histogram(
+        'http_request_duration_seconds', 'HTTP request latency by route',
+        ['method', 'route'], buckets=LATENCY_BUCKETS)
+    HTTP_DB_QUERIES = Histogram(
+        'http_request_db_queries', 'Database queries issued per HTTP request',
+        ['route'], buckets=QUERY_COUNT_BUCKETS)
+    HTTP_DB_SECONDS = Histogram(
+        'http_request_db_seconds', 'Total database time per HTTP request',
+        ['route'], buckets=LATENCY_BUCKETS)
+    DB_POOL_CHECKOUT_WAIT = Histogram(
+        'db_pool_checkout_seconds', 'Time to get a connection from the pool, including connecting',
+        ['bind'], buckets=POOL_WAIT_BUCKETS)
+    DB_POOL_IN_USE = Gauge(
+        'db_pool_connections_in_use', 'Connections checked out of the pool, summed over workers',
+        ['bind'], multiprocess_mode='livesum')
+    DB_POOL_OVERFLOWS = Counter(
+        'db_pool_overflow_total', 'Checkouts that opened a connection beyond pool_size',
+        ['bind'])
+    DB_POOL_TIMEOUTS = Counter(
+        'db_pool_timeouts_total', 'Checkouts that gave up after pool_timeout',
+        ['bind'])
+    DB_POOL_CONNECTIONS_OPENED = Counter(
+        'db_pool_connections_opened_total', 'New database connections, including reconnects',
+        ['bind'])
+    DB_REPLICA_LAG = Gauge(
+        'db_replica_lag_seconds', 'Read replica replay lag when last measured (-1 unreachable)',
+        multiprocess_mode='livemax')
+    DB_REPLICA_ROUTING = Counter(
+        'db_replica_routing_total', 'Replica-eligible requests by where their reads went',
+        ['decision'])
+    S3_REQUESTS = Counter(
+        's3_requests_total', 'S3 client calls by operation and outcome',
+        ['operation', 'outcome'])
+    S3_LATENCY = Histogram(
+        's3_request_duration_seconds', 'S3 client call latency by operation',
+        ['operation'], buckets=LATENCY_BUCKETS)
+    S3_BREAKER_STATE = Gauge(
+        's3_circuit_breaker_state', 'S3 circuit breaker state (0 closed, 1 half-open, 2 open)',
+        multiprocess_mode='livemax')
+    S3_CACHE_EVENTS = Counter(
+        's3_cache_events_total', 'S3 disk cache hits, misses, fills and evictions',
+        ['event'])
+    MISSING_FILE_EVENTS = Counter(
+        'missing_file_cache_events_total', 'Negative cache lookups for missing files',
+        ['event'])
+    CATALOG_CACHE_EVENTS = Counter(
+        'catalog_cache_events_total', 'Shared catalog response cache hits, misses, stores and errors',
+        ['event'])
+    CATALOG_FEED_STREAMS = Gauge(
+        'catalog_feed_streams', 'Open /documents/events streams, summed over workers',
+        multiprocess_mode='livesum')
+else:
+    HTTP_REQUESTS = HTTP_LATENCY = HTTP_DB_QUERIES = HTTP_DB_SECONDS = _NoopMetric()
+    DB_POOL_CHECKOUT_WAIT = DB_POOL_IN_USE = DB_POOL_OVERFLOWS = _NoopMetric()
+    DB_POOL_TIMEOUTS = DB_POOL_CONNECTIONS_OPENED = _NoopMetric()
+    DB_REPLICA_LAG = DB_REPLICA_ROUTING = _NoopMetric()
+    S3_REQUESTS = S3_LATENCY = S3_BREAKER_STATE = _NoopMetric()
+    S3_CACHE_EVENTS = MISSING_FILE_EVENTS = CATALOG_CACHE_EVENTS = CATALOG_FEED_STREAMS = _NoopMetric()
+
+
+def _before_request():
+    g.metrics_started = time.perf_counter()
+
+
+def _after_request(response):
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return response
+    # The URL rule keeps label cardinality bounded (no ids or filenames)
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    HTTP_REQUESTS.labels(request.method, route, str(response.status_code)).inc()
+    HTTP_LATENCY.labels(request.method, route).observe(time.perf_counter() - started)
+    query_stats = current_stats()
+    if query_stats is not None:
+        HTTP_DB_QUERIES.labels(route).observe(query_stats.count)
+        HTTP_DB_SECONDS.labels(route).observe(query_stats.seconds)
+    return response
+
+
+def init_app(app):
+    """Record request metrics for every route of ``app``"""
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+
+
+def observe_s3_call(operation, outcome, seconds=None):
+    S3_REQUESTS.labels(operation, outcome).inc()
+    if seconds is not None:
+        S3_LATENCY.labels(operation).observe(seconds)
+
+
+def set_breaker_state(state):
+    S3_BREAKER_STATE.set(BREAKER_STATE_VALUES[state])
+
+
+def render_metrics():
+    """(body, content type) of the current metrics in Prometheus text format"""
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
@@ -0,0 +1,109 @@
+"""Placeholder PDFs and a negative cache for blobs missing from storage.
+
+When a document's file is neither in S3 nor local storage, downloads serve
+PLACEHOLDER_PDF from memory instead of writing a fake file under the real
+filename. The miss is remembered for MISSING_FILE_TTL_SECONDS so repeated
+downloads skip the S3 and disk probes.
+"""
+import os
+import threading
+import time
+from metrics import MISSING_FILE_EVENTS
+
+MISSING_FILE_TTL_SECONDS = int(os.getenv('MISSING_FILE_TTL_SECONDS', '60'))
+MISSING_FILE_CACHE_MAX_ENTRIES = 10000
+
+
+def _pdf_text(text):
+    return text.replace('\\', '').replace('(', '').replace(')', '')
+
+
+def build_pdf(lines):
+    """A minimal one-page PDF showing ``lines``, with a correct xref table"""
+    commands = ['BT', '/F1 16 Tf', '72 720 Td', f'({_pdf_text(lines[0])}) Tj', '/F1 12 Tf']
+    for line in lines[1:]:
+        commands += ['0 -24 Td', f'({_pdf_text(line)}) Tj']
+    commands.append('ET')
+    stream = '\n'.join(commands).encode('latin-1', 'replace')
+
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R '
+        b'/Resources << /Font << /F1 << /Type /Font /Subtype /Type1 /BaseFont /Helvetica >> >> >> >>',
+        b'<< /Length ' + str(len(stream)).encode() + b' >>\nstream\n' + stream + b'\nendstream',
+    ]
+    pdf = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += f'{number} 0 obj\n'.encode() + body + b'\nendobj\n'
+    xref = len(pdf)
+    pdf += f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode()
+    for offset in offsets:
+        pdf += f'{offset:010d} 00000 n \n'.encode()
+    pdf += f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n'.encode()
+    return bytes(pdf)
+
+
+# Served for every missing file; built once per process
+PLACEHOLDER_PDF = build_pdf([
+    'File not available',
+    'This document could not be found on the server.',
+    'Please contact the administrator.',
+])
+
+
+class MissingFileCache:
+    """Per-process TTL set of filenames known to be missing from storage"""
+
+    def __init__(self, ttl_seconds, max_entries=MISSING_FILE_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.expires = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses_recorded = 0
+
+    def is_missing(self, filename):
+        with self.lock:
+            expires_at = self.expires.get(filename)
+            if expires_at is None:
+                return False
+            if expires_at <= time.monotonic():
+                del self.expires[filename]
+                return False
+            self.hits += 1
+        MISSING_FILE_EVENTS.labels('hits').inc()
+        return True
+
+    def mark_missing(self, filename):
+        """Remember a miss. Returns True unless it was already remembered."""
+        now = time.monotonic()
+        with self.lock:
+            if self.expires.get(filename, 0) > now:
+                return False
+            if len(self.expires) >= self.max_entries:
+                self.expires = {name: t for name, t in self.expires.items() if t > now}
+                if len(self.expires) >= self.max_entries:
+                    self.expires.pop(next(iter(self.expires)))
+            self.expires[filename] = now + self.ttl_seconds
+            self.misses_recorded += 1
+        MISSING_FILE_EVENTS.labels('misses_recorded').inc()
+        return True
+
+    def clear(self, filename):
+        with self.lock:
+            self.expires.pop(filename, None)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.expires),
+                'hits': self.hits,
+                'misses_recorded': self.misses_recorded,
+                'ttl_seconds': self.ttl_seconds,
+            }
+
+
+missing_files = MissingFileCache(MISSING_FILE_TTL_SECONDS)
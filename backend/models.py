@@ -1,7 +1,14 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+import json
+from db_routing import RoutingSession
 
-db = SQLAlchemy()
+# The session sends replica-routed reads to the `replica` bind, see db_routing.py
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -16,17 +23,33 @@ class User(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
-    def to_dict(self):
+    # Columns read by list endpoints, as plain rows rather than User objects
+    LIST_COLUMNS = ('id', 'username', 'email', 'full_name', 'is_active', 'is_admin', 'created_at')
+
+    @classmethod
+    def list_query(cls):
+        return db.session.query(*[getattr(cls, name) for name in cls.LIST_COLUMNS])
+
+    @staticmethod
+    def row_to_dict(id, username, email, full_name, is_active, is_admin, created_at):
+        """Serialize one list_query() row; takes the columns positionally"""
         return {
-            'id': self.id,
-            'username': self.username,
-            'email': self.email,
-            'full_name': self.full_name,
-            'is_active': self.is_active,
-            'is_admin': self.is_admin,
-            'created_at': self.created_at.isoformat() if self.created_at else None
+            'id': id,
+            'username': username,
+            'email': email,
+            'full_name': full_name,
+            'is_active': is_active,
+            'is_admin': is_admin,
+            'created_at': _isoformat(created_at)
         }
 
+    @staticmethod
+    def rows_to_dicts(rows):
+        return [User.row_to_dict(*row) for row in rows]
+
+    def to_dict(self):
+        return User.row_to_dict(*[getattr(self, name) for name in User.LIST_COLUMNS])
+
 class Document(db.Model):
     __tablename__ = 'documents'
     
@@ -37,6 +60,9 @@ class Document(db.Model):
     type = db.Column(db.String(20), default='PDF')  # PDF, LINK
     filename = db.Column(db.String(255))  # For uploaded files
     file_size = db.Column(db.String(20))  # e.g., "2.4 MB"
+    checksum = db.Column(db.String(64), index=True)  # SHA-256 hex of the file contents
+    thumbnail_key = db.Column(db.String(255))  # e.g., "thumbnails/<checksum>.png"
+    page_count = db.Column(db.Integer)
     is_external = db.Column(db.Boolean, default=False)
     external_url = db.Column(db.String(500))  # For external links
     is_new = db.Column(db.Boolean, default=True)
@@ -47,22 +73,44 @@ class Document(db.Model):
     created_by = db.Column(db.Integer, db.ForeignKey('users.id'))
     user = db.relationship('User', backref='documents')
 
-    def to_dict(self):
+    # Columns read by list endpoints, as plain rows rather than Document objects
+    LIST_COLUMNS = ('id', 'title', 'description', 'category', 'type', 'filename', 'file_size', 'checksum',
+                    'page_count', 'thumbnail_key', 'is_external', 'external_url', 'is_new', 'created_at',
+                    'created_by')
+
+    @classmethod
+    def list_query(cls):
+        return db.session.query(*[getattr(cls, name) for name in cls.LIST_COLUMNS])
+
+    @staticmethod
+    def row_to_dict(id, title, description, category, type, filename, file_size, checksum, page_count,
+                    thumbnail_key, is_external, external_url, is_new, created_at, created_by):
+        """Serialize one list_query() row; takes the columns positionally"""
         return {
-            'id': self.id,
-            'title': self.title,
-            'description': self.description,
-            'category': self.category,
-            'type': self.type,
-            'filename': self.filename,
-            'file_size': self.file_size,
-            'is_external': self.is_external,
-            'external_url': self.external_url,
-            'is_new': self.is_new,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'created_by': self.created_by
+            'id': id,
+            'title': title,
+            'description': description,
+            'category': category,
+            'type': type,
+            'filename': filename,
+            'file_size': file_size,
+            'checksum': checksum,
+            'page_count': page_count,
+            'thumbnail_url': f"/documents/{id}/thumbnail" if thumbnail_key else None,
+            'is_external': is_external,
+            'external_url': external_url,
+            'is_new': is_new,
+            'created_at': _isoformat(created_at),
+            'created_by': created_by
         }
 
+    @staticmethod
+    def rows_to_dicts(rows):
+        return [Document.row_to_dict(*row) for row in rows]
+
+    def to_dict(self):
+        return Document.row_to_dict(*[getattr(self, name) for name in Document.LIST_COLUMNS])
+
 class Tag(db.Model):
     __tablename__ = 'tags'
 
@@ -116,3 +164,85 @@ class DocumentVisibility(db.Model):
     target_id = db.Column(db.Integer, nullable=True)  # tag_id or user_id depending on type
 
     document = db.relationship('Document', backref=db.backref('visibility_rules', cascade='all, delete-orphan'))
+
+class Job(db.Model):
+    __tablename__ = 'jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text)  # JSON-encoded arguments for the handler
+    status = db.Column(db.String(20), default='queued', nullable=False)  # queued, running, succeeded, failed
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    max_attempts = db.Column(db.Integer, default=5, nullable=False)
+    run_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)  # not picked up before this time
+    locked_by = db.Column(db.String(100))  # worker currently running the job
+    locked_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    result = db.Column(db.Text)  # JSON-encoded return value of the handler
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (db.Index('ix_jobs_status_run_at', 'status', 'run_at'),)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'payload': json.loads(self.payload) if self.payload else {},
+            'status': self.status,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'run_at': self.run_at.isoformat() if self.run_at else None,
+            'last_error': self.last_error,
+            'result': json.loads(self.result) if self.result else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+class StorageTombstone(db.Model):
+    """An S3 object waiting to be deleted in the next batch"""
+    __tablename__ = 'storage_tombstones'
+
+    id = db.Column(db.Integer, primary_key=True)
+    s3_key = db.Column(db.String(500), nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            's3_key': self.s3_key,
+            'attempts': self.attempts,
+            'next_attempt_at': self.next_attempt_at.isoformat() if self.next_attempt_at else None,
+            'last_error': self.last_error,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+class BootstrapVersion(db.Model):
+    """Schema and seed versions last applied by init_db.py"""
+    __tablename__ = 'bootstrap_versions'
+
+    name = db.Column(db.String(20), primary_key=True)  # schema, seed
+    version = db.Column(db.String(64), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class CatalogVersion(db.Model):
+    """Change counter per catalog scope, bumped by every write to its tables (see catalog_cache.py)"""
+    __tablename__ = 'catalog_versions'
+
+    name = db.Column(db.String(20), primary_key=True)  # documents, tags, users, categories, epoch
+    version = db.Column(db.BigInteger, default=0, nullable=False)
+
+class CatalogEvent(db.Model):
+    """A change to the document catalog, for the change feed (see catalog_events.py)"""
+    __tablename__ = 'catalog_events'
+    # Ids are cursors, so SQLite must not reuse them once prune_events empties the table
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(30), nullable=False)  # created, updated, deleted, visibility_changed, access_changed
+    document_id = db.Column(db.Integer)  # no foreign key: deletions are recorded too
+    user_id = db.Column(db.Integer)  # access_changed: the user whose tags changed
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
@@ -0,0 +1,174 @@
+"""Micro-benchmarks for the code that dominates document listing cost.
+
+Cases, each run at every size in --sizes (default 1k, 10k and 100k rows):
+
+- visibility: visible_documents() for a tagged user, as in GET /documents
+- document_to_dict / user_to_dict: ORM objects, to_dict() and stdlib json
+- document_rows / user_rows: list_query() rows, rows_to_dicts() and the app's
+  JSON provider, as the list endpoints serialize
+- jwt_encode: create_access_token() per user
+- jwt_decode: get_current_user() per token, including the user lookup
+
+Timings are the best of several runs and are compared with the stored
+baselines in perf/baselines.json, keyed by database dialect. A case slower
+than baseline * (1 + --threshold) is a regression and the exit status is 1.
+Baselines depend on the machine, so record them with --save-baseline on
+the machine that runs the comparison.
+
+Usage (from backend/):
+    python -m perf.benchmarks                       # in-memory SQLite
+    python -m perf.benchmarks --database-url postgresql://localhost/sequoalpha_bench
+    python -m perf.benchmarks --sizes 1000,10000 --save-baseline
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+
+BASELINES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+DEFAULT_SIZES = '1000,10000,100000'
+CASES = ['visibility', 'document_to_dict', 'user_to_dict', 'document_rows', 'user_rows', 'jwt_encode', 'jwt_decode']
+
+
+def measure(func, setup=None, min_time=1.0, max_runs=5):
+    """Best wall time of ``func`` over up to ``max_runs`` runs within ``min_time``"""
+    best = None
+    spent = 0.0
+    runs = 0
+    while runs < max_runs and (runs == 0 or spent < min_time):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+        spent += elapsed
+        runs += 1
+    return best
+
+
+def run_size(size, app, quiet, case_names=CASES):
+    from main import db, create_access_token, get_current_user, visible_documents
+    from models import Document, User
+    from perf.generate_dataset import generate_dataset, parse_weights, reset_dataset
+
+    with app.app_context():
+        reset_dataset()
+        generate_dataset(users=size, documents=size, tags=50,
+                         visibility=parse_weights('none=20,all=20,tag=40,user=20'), blobs=0)
+        user = User.query.filter(User.username.like('perf_user_%'), User.user_tags.any()).first()
+        usernames = [row.username for row in db.session.query(User.username).filter(User.username.like('perf_user_%'))]
+        tokens = [create_access_token({"sub": username}) for username in usernames]
+
+        def fresh_session():
+            # Every run starts with an empty identity map, like a new request
+            db.session.expunge_all()
+
+        def serialize(model):
+            def run():
+                json.dumps([row.to_dict() for row in model.query.filter(model.id.isnot(None)).all()])
+            return run
+
+        def serialize_rows(model):
+            def run():
+                app.json.dumps(model.rows_to_dicts(model.list_query()))
+            return run
+
+        cases = {
+            'visibility': lambda: visible_documents(db.session.get(User, user.id)),
+            'document_to_dict': serialize(Document),
+            'user_to_dict': serialize(User),
+            'document_rows': serialize_rows(Document),
+            'user_rows': serialize_rows(User),
+            'jwt_encode': lambda: [create_access_token({"sub": username}) for username in usernames],
+            'jwt_decode': lambda: [get_current_user(token) for token in tokens],
+        }
+        results = {}
+        for name in case_names:
+            with quiet():
+                results[name] = measure(cases[name], setup=fresh_session)
+            print(f"  {name:<18} {size:>7} rows  {results[name] * 1000:10.1f} ms", file=sys.stderr)
+        reset_dataset()
+    return results
+
+
+def load_baselines():
+    if not os.path.exists(BASELINES_PATH):
+        return {}
+    with open(BASELINES_PATH) as f:
+        return json.load(f)
+
+
+def compare(results, baselines, threshold):
+    """Table rows and the list of regressions"""
+    rows, regressions = [], []
+    for name, by_size in results.items():
+        for size, seconds in by_size.items():
+            baseline = baselines.get(name, {}).get(size)
+            change = (seconds / baseline - 1) if baseline else None
+            rows.append((name, size, seconds, baseline, change))
+            if change is not None and change > threshold:
+                regressions.append((name, size, change))
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmarks for listing hot paths')
+    parser.add_argument('--database-url', help='default: in-memory SQLite')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help='comma-separated row counts')
+    parser.add_argument('--cases', default=','.join(CASES), help='comma-separated case names')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed slowdown, 0.25 = 25%%')
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the baseline')
+    args = parser.parse_args()
+
+    # main.py reads DATABASE_URL at import time
+    os.environ['DATABASE_URL'] = args.database_url or 'sqlite://'
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    devnull = open(os.devnull, 'w')
+    with contextlib.redirect_stdout(devnull):
+        from main import app, db
+        from init_db import init_database
+        init_database()
+    with app.app_context():
+        dialect = db.engine.dialect.name
+
+    case_names = [name for name in args.cases.split(',') if name]
+    unknown = set(case_names) - set(CASES)
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(sorted(unknown))}")
+    results = {name: {} for name in case_names}
+    for size in [int(size) for size in args.sizes.split(',')]:
+        for name, seconds in run_size(size, app, lambda: contextlib.redirect_stdout(devnull), case_names).items():
+            results[name][str(size)] = round(seconds, 6)
+
+    all_baselines = load_baselines()
+    rows, regressions = compare(results, all_baselines.get(dialect, {}), args.threshold)
+    print(f"\n{dialect}: {'case':<18} {'rows':>7} {'ms':>10} {'baseline':>10} {'change':>8}")
+    for name, size, seconds, baseline, change in rows:
+        baseline_text = f"{baseline * 1000:.1f}" if baseline else '-'
+        change_text = f"{change:+.0%}" if change is not None else '-'
+        print(f"{'':<{len(dialect) + 2}}{name:<18} {size:>7} {seconds * 1000:>10.1f} {baseline_text:>10} {change_text:>8}")
+
+    if args.save_baseline:
+        stored = all_baselines.setdefault(dialect, {})
+        for name, by_size in results.items():
+            stored.setdefault(name, {}).update(by_size)
+        with open(BASELINES_PATH, 'w') as f:
+            json.dump(all_baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"\n💾 Saved baseline for {dialect} to {BASELINES_PATH}")
+        return 0
+
+    if regressions:
+        print(f"\n❌ {len(regressions)} regression(s) over {args.threshold:.0%}:")
+        for name, size, change in regressions:
+            print(f"   {name} at {size} rows: {change:+.0%}")
+        return 1
+    print("\n✅ No regressions")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,200 @@
+"""Fill the database with a synthetic dataset for load tests and benchmarks.
+
+Creates users, tags, tag assignments, documents and visibility rules with
+bulk inserts. Every generated row carries the ``perf_`` marker, so
+``--reset`` removes a previous dataset without touching real data.
+
+Usage (from backend/):
+    python -m perf.generate_dataset --users 1000 --documents 10000 --tags 50
+    python -m perf.generate_dataset --reset --users 0 --documents 0 --tags 0
+
+Visibility mix: each document gets no rules (visible to everyone), an
+``all`` rule, tag rules or user rules, chosen with the weights given by
+--visibility (default ``none=20,all=20,tag=40,user=20``).
+
+Generated users log in with --password (default ``loadtest123``). Documents
+share --blobs distinct PDF blobs, written to the uploads folder or, when
+S3_STANDIN_DIR is set, to the local S3 stand-in.
+"""
+import argparse
+import hashlib
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import bcrypt
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import db, User, Document, Tag, UserTag, DocumentVisibility  # noqa: E402
+from missing_files import build_pdf  # noqa: E402
+
+MARKER = 'perf_'
+BATCH_SIZE = 5000
+CATEGORIES = ['Quarterly Reports', 'Legal Documents', 'Marketing Materials', 'Investment Analysis', 'Other']
+
+
+def parse_weights(text):
+    weights = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        weights[name.strip()] = float(weight)
+    unknown = set(weights) - {'none', 'all', 'tag', 'user'}
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown visibility types: {', '.join(sorted(unknown))}")
+    return weights
+
+
+def bulk_insert(model, rows):
+    for start in range(0, len(rows), BATCH_SIZE):
+        db.session.execute(db.insert(model), rows[start:start + BATCH_SIZE])
+    db.session.commit()
+
+
+def ids_by(column, prefix):
+    return [row[0] for row in db.session.query(column.class_.id).filter(column.like(prefix + '%')).order_by(column.class_.id)]
+
+
+def write_blobs(count, upload_dir):
+    """Write ``count`` distinct content-addressed PDFs; returns (filename, checksum, size)"""
+    standin_dir = os.getenv('S3_STANDIN_DIR')
+    blobs = []
+    for n in range(count):
+        content = build_pdf([f"Load test blob {n}", 'x' * (n % 50)])
+        checksum = hashlib.sha256(content).hexdigest()
+        filename = f"{checksum}.pdf"
+        if standin_dir:
+            path = os.path.join(standin_dir, 'documents', filename)
+        else:
+            path = os.path.join(upload_dir, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+        blobs.append((filename, checksum, len(content)))
+    return blobs
+
+
+def reset_dataset():
+    """Delete every generated row"""
+    document_ids = db.session.query(Document.id).filter(Document.title.like(MARKER + '%'))
+    DocumentVisibility.query.filter(DocumentVisibility.document_id.in_(document_ids)).delete(synchronize_session=False)
+    Document.query.filter(Document.title.like(MARKER + '%')).delete(synchronize_session=False)
+    user_ids = db.session.query(User.id).filter(User.username.like(MARKER + '%'))
+    UserTag.query.filter(UserTag.user_id.in_(user_ids)).delete(synchronize_session=False)
+    tag_ids = db.session.query(Tag.id).filter(Tag.name.like(MARKER + '%'))
+    UserTag.query.filter(UserTag.tag_id.in_(tag_ids)).delete(synchronize_session=False)
+    Tag.query.filter(Tag.name.like(MARKER + '%')).delete(synchronize_session=False)
+    User.query.filter(User.username.like(MARKER + '%')).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def generate_dataset(users, documents, tags, visibility, tags_per_user=2, rules_per_document=3,
+                     blobs=20, password='loadtest123', upload_dir=None, seed=0):
+    """Insert a synthetic dataset; returns row counts and timings"""
+    rng = random.Random(seed)
+    started = time.monotonic()
+    now = datetime.utcnow()
+    # bcrypt is deliberately slow: hash once and share it
+    hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+
+    bulk_insert(User, [{
+        'username': f"{MARKER}user_{n}",
+        'email': f"{MARKER}user_{n}@example.com",
+        'full_name': f"Load Test User {n}",
+        'hashed_password': hashed_password,
+        'is_active': True,
+        'is_admin': False,
+        'created_at': now,
+        'updated_at': now,
+    } for n in range(users)])
+    user_ids = ids_by(User.username, MARKER)
+
+    bulk_insert(Tag, [{'name': f"{MARKER}tag_{n}", 'created_at': now} for n in range(tags)])
+    tag_ids = ids_by(Tag.name, MARKER)
+
+    user_tags = []
+    if tag_ids:
+        for user_id in user_ids:
+            for tag_id in rng.sample(tag_ids, min(len(tag_ids), rng.randint(0, tags_per_user))):
+                user_tags.append({'user_id': user_id, 'tag_id': tag_id})
+    bulk_insert(UserTag, user_tags)
+
+    blob_rows = write_blobs(blobs, upload_dir) if blobs else []
+    document_rows = []
+    for n in range(documents):
+        filename, checksum, size = blob_rows[n % len(blob_rows)] if blob_rows else (None, None, 0)
+        created = now - timedelta(minutes=n)
+        document_rows.append({
+            'title': f"{MARKER}document {n}",
+            'description': f"Synthetic document {n} for load testing",
+            'category': rng.choice(CATEGORIES),
+            'type': 'PDF',
+            'filename': filename,
+            'file_size': f"{round(size / (1024 * 1024), 1)} MB",
+            'checksum': checksum,
+            'is_external': False,
+            'is_new': rng.random() < 0.1,
+            'created_at': created,
+            'updated_at': created,
+        })
+    bulk_insert(Document, document_rows)
+    document_ids = ids_by(Document.title, MARKER)
+
+    kinds, weights = zip(*visibility.items())
+    rules = []
+    for document_id in document_ids:
+        kind = rng.choices(kinds, weights)[0]
+        if kind == 'all':
+            rules.append({'document_id': document_id, 'visibility_type': 'all', 'target_id': None})
+        elif kind == 'tag' and tag_ids:
+            for tag_id in rng.sample(tag_ids, min(len(tag_ids), rng.randint(1, rules_per_document))):
+                rules.append({'document_id': document_id, 'visibility_type': 'tag', 'target_id': tag_id})
+        elif kind == 'user' and user_ids:
+            for user_id in rng.sample(user_ids, min(len(user_ids), rng.randint(1, rules_per_document))):
+                rules.append({'document_id': document_id, 'visibility_type': 'user', 'target_id': user_id})
+    bulk_insert(DocumentVisibility, rules)
+
+    return {
+        'users': len(user_ids),
+        'tags': len(tag_ids),
+        'user_tags': len(user_tags),
+        'documents': len(document_ids),
+        'visibility_rules': len(rules),
+        'blobs': len(blob_rows),
+        'elapsed_seconds': round(time.monotonic() - started, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic dataset for load tests')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--documents', type=int, default=10000)
+    parser.add_argument('--tags', type=int, default=50)
+    parser.add_argument('--tags-per-user', type=int, default=2, help='maximum tags assigned to a user')
+    parser.add_argument('--rules-per-document', type=int, default=3, help='maximum tag/user rules per document')
+    parser.add_argument('--visibility', type=parse_weights, default=parse_weights('none=20,all=20,tag=40,user=20'))
+    parser.add_argument('--blobs', type=int, default=20, help='distinct PDF files shared by the documents')
+    parser.add_argument('--password', default='loadtest123')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--reset', action='store_true', help='remove a previously generated dataset first')
+    args = parser.parse_args()
+
+    from main import app
+    from init_db import init_database
+    init_database()
+    with app.app_context():
+        if args.reset:
+            reset_dataset()
+            print("🧹 Removed previous synthetic dataset")
+        summary = generate_dataset(
+            args.users, args.documents, args.tags, args.visibility,
+            tags_per_user=args.tags_per_user, rules_per_document=args.rules_per_document,
+            blobs=args.blobs, password=args.password, upload_dir=app.config['UPLOAD_FOLDER'], seed=args.seed
+        )
+    print(f"✅ Generated dataset: {summary}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+"""Closed-loop HTTP load test against a running backend.
+
+Each of --concurrency threads keeps one keep-alive connection and issues
+requests back to back for --duration seconds, picking endpoints with the
+weights in --mix. Reports throughput and p50/p95/p99 latency per endpoint.
+
+Usage (from backend/, after perf.generate_dataset):
+    S3_STANDIN_DIR=/tmp/s3-standin gunicorn main:app --bind 127.0.0.1:8000 --workers 2 &
+    python -m perf.loadtest --base-url http://127.0.0.1:8000 --duration 30 --concurrency 8
+
+Generated users (perf_user_<n>) log in with --password; the admin account
+uses --admin-username / --admin-password.
+"""
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+DEFAULT_MIX = 'documents=40,admin_documents=15,admin_tags=10,download=25,login=10'
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        mix[name.strip()] = float(weight)
+    unknown = set(mix) - set(OPERATIONS)
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown operations: {', '.join(sorted(unknown))}")
+    return mix
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+class Client:
+    """One keep-alive HTTP connection, reopened after errors"""
+
+    def __init__(self, base_url, timeout=60):
+        parts = urlsplit(base_url)
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.netloc = parts.netloc
+        self.prefix = parts.path.rstrip('/')
+        self.timeout = timeout
+        self.connection = None
+
+    def request(self, method, path, body=None, token=None):
+        headers = {'Accept': 'application/json'}
+        if token:
+            headers['Authorization'] = f"Bearer {token}"
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        if self.connection is None:
+            self.connection = self.connection_class(self.netloc, timeout=self.timeout)
+        try:
+            self.connection.request(method, self.prefix + path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            return response.status, response.read()
+        except Exception:
+            self.connection.close()
+            self.connection = None
+            raise
+
+
+def login(client, username, password):
+    status, body = client.request('POST', '/login', {'username': username, 'password': password})
+    if status != 200:
+        raise RuntimeError(f"Login failed for {username}: {status} {body[:200]!r}")
+    return json.loads(body)['access_token']
+
+
+# Each operation takes (client, state, rng) and returns the HTTP status
+def op_login(client, state, rng):
+    username = rng.choice(state['usernames'])
+    status, _ = client.request('POST', '/login', {'username': username, 'password': state['password']})
+    return status
+
+
+def op_documents(client, state, rng):
+    return client.request('GET', '/documents', token=rng.choice(state['user_tokens']))[0]
+
+
+def op_admin_documents(client, state, rng):
+    return client.request('GET', '/admin/documents', token=state['admin_token'])[0]
+
+
+def op_admin_tags(client, state, rng):
+    return client.request('GET', '/admin/tags', token=state['admin_token'])[0]
+
+
+def op_download(client, state, rng):
+    document_id = rng.choice(state['document_ids'])
+    return client.request('GET', f"/documents/{document_id}/download", token=rng.choice(state['user_tokens']))[0]
+
+
+OPERATIONS = {
+    'login': op_login,
+    'documents': op_documents,
+    'admin_documents': op_admin_documents,
+    'admin_tags': op_admin_tags,
+    'download': op_download,
+}
+
+
+def prepare(args):
+    client = Client(args.base_url)
+    state = {'password': args.password}
+    state['admin_token'] = login(client, args.admin_username, args.admin_password)
+    state['usernames'] = [f"perf_user_{n}" for n in range(args.login_users)]
+    state['user_tokens'] = [login(client, username, args.password) for username in state['usernames']]
+
+    status, body = client.request('GET', '/admin/documents', token=state['admin_token'])
+    if status != 200:
+        raise RuntimeError(f"Could not list documents: {status}")
+    documents = json.loads(body)
+    documents = documents.get('documents', documents) if isinstance(documents, dict) else documents
+    state['document_ids'] = [doc['id'] for doc in documents if doc.get('filename')]
+    if not state['document_ids']:
+        raise RuntimeError("No documents with files; run perf.generate_dataset first")
+    return state
+
+
+def run(args, state):
+    names, weights = zip(*args.mix.items())
+    samples = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.duration
+
+    def worker(seed):
+        rng = random.Random(seed)
+        client = Client(args.base_url)
+        local = []
+        while time.monotonic() < deadline:
+            name = rng.choices(names, weights)[0]
+            started = time.perf_counter()
+            try:
+                ok = OPERATIONS[name](client, state, rng) < 400
+            except Exception:
+                ok = False
+            local.append((name, time.perf_counter() - started, ok))
+        with lock:
+            for name, seconds, ok in local:
+                samples[name].append(seconds)
+                if not ok:
+                    errors[name] += 1
+
+    threads = [threading.Thread(target=worker, args=(args.seed + n,)) for n in range(args.concurrency)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    def summarize(latencies, error_count):
+        latencies = sorted(latencies)
+        return {
+            'requests': len(latencies),
+            'errors': error_count,
+            'throughput_rps': round(len(latencies) / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 1) if latencies else None,
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 1) if latencies else None,
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 1) if latencies else None,
+        }
+
+    report = {name: summarize(samples[name], errors[name]) for name in names}
+    report['total'] = summarize([s for values in samples.values() for s in values], sum(errors.values()))
+    return {'duration_seconds': round(elapsed, 1), 'concurrency': args.concurrency, 'endpoints': report}
+
+
+def print_report(result):
+    print(f"\nDuration {result['duration_seconds']}s, concurrency {result['concurrency']}")
+    print(f"{'endpoint':<16} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, row in result['endpoints'].items():
+        print(f"{name:<16} {row['requests']:>9} {row['errors']:>7} {row['throughput_rps']:>8} "
+              f"{row['p50_ms'] or '-':>8} {row['p95_ms'] or '-':>8} {row['p99_ms'] or '-':>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the SequoAlpha backend')
+    parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+    parser.add_argument('--duration', type=float, default=30, help='seconds')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX))
+    parser.add_argument('--login-users', type=int, default=20, help='generated users to log in as')
+    parser.add_argument('--password', default='loadtest123')
+    parser.add_argument('--admin-username', default='admin')
+    parser.add_argument('--admin-password', default='admin123')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='also write the report to this file')
+    args = parser.parse_args()
+
+    state = prepare(args)
+    result = run(args, state)
+    print_report(result)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""Offline stand-in for the boto3 S3 client.
+
+Objects are files under a local directory, one per key. Only the calls
+S3Manager and the reconciler make are implemented. Enable it with
+S3_STANDIN_DIR=/path (see s3_config.py); S3_STANDIN_LATENCY_MS adds a fixed
+delay per call to mimic a remote bucket.
+"""
+import os
+import shutil
+import time
+from datetime import datetime, timezone
+from botocore.exceptions import ClientError
+
+
+class LocalS3Client:
+    def __init__(self, root, latency_ms=0):
+        self.root = os.path.abspath(root)
+        self.latency = latency_ms / 1000
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key):
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise ClientError({'Error': {'Code': 'InvalidKey', 'Message': key}}, 'Key')
+        return path
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _not_found(self, operation, key):
+        return ClientError({'Error': {'Code': '404', 'Message': f'Not Found: {key}'},
+                            'ResponseMetadata': {'HTTPStatusCode': 404}}, operation)
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None):
+        self._wait()
+        path = self._path(Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(Filename, path)
+
+    def download_file(self, Bucket, Key, Filename):
+        self._wait()
+        path = self._path(Key)
+        if not os.path.isfile(path):
+            raise self._not_found('GetObject', Key)
+        shutil.copyfile(path, Filename)
+
+    def head_object(self, Bucket, Key):
+        self._wait()
+        path = self._path(Key)
+        if not os.path.isfile(path):
+            raise self._not_found('HeadObject', Key)
+        stat = os.stat(path)
+        return {'ContentLength': stat.st_size,
+                'LastModified': datetime.fromtimestamp(stat.st_mtime, timezone.utc)}
+
+    def delete_object(self, Bucket, Key):
+        self._wait()
+        try:
+            os.remove(self._path(Key))
+        except FileNotFoundError:
+            pass
+        return {}
+
+    def delete_objects(self, Bucket, Delete):
+        self._wait()
+        deleted = []
+        for obj in Delete['Objects']:
+            try:
+                os.remove(self._path(obj['Key']))
+            except FileNotFoundError:
+                pass
+            deleted.append({'Key': obj['Key']})
+        return {'Deleted': deleted}
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn=3600):
+        return 'file://' + self._path(Params['Key'])
+
+    def _keys(self, prefix):
+        keys = []
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                key = os.path.relpath(os.path.join(directory, name), self.root).replace(os.sep, '/')
+                if key.startswith(prefix):
+                    keys.append(key)
+        # S3 lists keys in UTF-8 byte order
+        return sorted(keys, key=lambda key: key.encode('utf-8'))
+
+    def list_objects_v2(self, Bucket, Prefix='', MaxKeys=1000, ContinuationToken=None, **kwargs):
+        self._wait()
+        keys = self._keys(Prefix)
+        if ContinuationToken:
+            keys = [key for key in keys if key.encode('utf-8') > ContinuationToken.encode('utf-8')]
+        page, rest = keys[:MaxKeys], keys[MaxKeys:]
+        contents = []
+        for key in page:
+            stat = os.stat(self._path(key))
+            contents.append({'Key': key, 'Size': stat.st_size,
+                             'LastModified': datetime.fromtimestamp(stat.st_mtime, timezone.utc)})
+        response = {'Contents': contents, 'KeyCount': len(contents), 'IsTruncated': bool(rest)}
+        if rest:
+            response['NextContinuationToken'] = page[-1]
+        return response
+
+    def get_paginator(self, operation):
+        if operation != 'list_objects_v2':
+            raise NotImplementedError(operation)
+        return _ListPaginator(self)
+
+
+class _ListPaginator:
+    def __init__(self, client):
+        self.client = client
+
+    def paginate(self, Bucket, Prefix='', PaginationConfig=None):
+        page_size = (PaginationConfig or {}).get('PageSize', 1000)
+        token = None
+        while True:
+            response = self.client.list_objects_v2(Bucket=Bucket, Prefix=Prefix, MaxKeys=page_size,
+                                                   ContinuationToken=token)
+            yield response
+            if not response['IsTruncated']:
+                return
+            token = response['NextContinuationToken']
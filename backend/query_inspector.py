@@ -0,0 +1,98 @@
+"""Per-request SQL instrumentation.
+
+Counts the queries and database time of every request, logs statements
+slower than SLOW_QUERY_MS, and flags statements that run N_PLUS_ONE_THRESHOLD
+or more times with the same shape in one request as a suspected N+1. With
+QUERY_DEBUG_HEADERS=true the counts are returned as X-DB-* and Server-Timing
+response headers.
+"""
+import os
+import re
+import time
+from collections import Counter
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+QUERY_DEBUG_HEADERS = os.getenv('QUERY_DEBUG_HEADERS', 'false').lower() == 'true'
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '250'))
+N_PLUS_ONE_THRESHOLD = int(os.getenv('N_PLUS_ONE_THRESHOLD', '5'))
+
+# Placeholder lists of any length (IN clauses, bulk VALUES) and literal numbers
+_PLACEHOLDER_LIST = re.compile(r"\(\s*(?:\?|%s|%\(\w+\)s|:\w+)(?:\s*,\s*(?:\?|%s|%\(\w+\)s|:\w+))*\s*\)")
+_NUMBER = re.compile(r"\b\d+\b")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def statement_shape(statement):
+    """Statement with parameters and literals folded, for grouping repeats"""
+    shape = _WHITESPACE.sub(' ', statement).strip()
+    shape = _PLACEHOLDER_LIST.sub('(?)', shape)
+    return _NUMBER.sub('N', shape)
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes = Counter()
+
+    def suspected_n_plus_one(self):
+        return [(shape, n) for shape, n in self.shapes.most_common() if n >= N_PLUS_ONE_THRESHOLD]
+
+
+def current_stats():
+    """QueryStats of the current request, or None outside a request"""
+    if has_request_context():
+        return g.get('query_stats')
+    return None
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_started'].pop()
+    elapsed = time.perf_counter() - started
+
+    if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+        where = f" in {request.method} {request.path}" if has_request_context() else ''
+        print(f"🐢 Slow query ({elapsed * 1000:.0f} ms){where}: {_WHITESPACE.sub(' ', statement)[:500]}")
+
+    stats = current_stats()
+    if stats is not None:
+        stats.count += 1
+        stats.seconds += elapsed
+        stats.shapes[statement_shape(statement)] += 1
+
+
+def _before_request():
+    g.query_stats = QueryStats()
+
+
+def _after_request(response):
+    stats = current_stats()
+    if stats is None:
+        return response
+
+    suspects = stats.suspected_n_plus_one()
+    for shape, repeats in suspects:
+        print(f"⚠️ Suspected N+1 in {request.method} {request.path}: "
+              f"{repeats} × {shape[:200]}")
+
+    if QUERY_DEBUG_HEADERS:
+        db_ms = stats.seconds * 1000
+        response.headers['X-DB-Queries'] = str(stats.count)
+        response.headers['X-DB-Time-Ms'] = f"{db_ms:.1f}"
+        response.headers['X-DB-N-Plus-One'] = str(len(suspects))
+        response.headers.add('Server-Timing', f"db;desc=\"{stats.count} queries\";dur={db_ms:.1f}")
+    return response
+
+
+def init_app(app):
+    """Inspect the queries of every request handled by ``app``"""
+    app.before_request(_before_request)
+    app.after_request(_after_request)
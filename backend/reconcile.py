@@ -0,0 +1,272 @@
+"""Storage-wide orphan reconciliation.
+
+Compares S3 (``documents/`` prefix), the local uploads folder and
+``Document.filename`` and reports:
+
+- orphaned blobs: stored objects no document references
+- dangling rows: documents whose blob is in neither S3 nor local storage
+- orphaned thumbnails: images under ``thumbnails/`` (S3 or local) that no
+  ``Document.thumbnail_key`` references
+
+Memory stays bounded regardless of bucket size. S3 keys arrive from
+``list_objects_v2`` in binary key order and are merge-joined against
+filenames read from the database in the same order with keyset pagination.
+Local files are read with ``os.scandir`` and checked against the database
+in chunks.
+
+Usage:
+    python reconcile.py [--purge] [--purge-rows]
+"""
+import argparse
+import json
+import os
+import time
+from models import db, Document, DocumentVisibility
+from s3_config import s3_manager
+from search import remove_document
+from tombstones import record_deletion, flush_all_tombstones
+
+RECONCILE_CHUNK_SIZE = 1000
+# Objects younger than this may belong to an upload that has not committed yet
+RECONCILE_GRACE_SECONDS = int(os.getenv('RECONCILE_GRACE_SECONDS', '3600'))
+# Example entries kept per category; totals always cover everything
+REPORT_SAMPLE_LIMIT = 100
+
+S3_PREFIX = 'documents/'
+# Document.thumbnail_key holds the full key, prefix included
+THUMBNAIL_PREFIX = 'thumbnails/'
+
+
+def iter_s3_blobs(prefix=S3_PREFIX):
+    """(name under ``prefix``, size, last_modified epoch) for every object, in key order"""
+    paginator = s3_manager.s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=s3_manager.bucket_name, Prefix=prefix,
+                                   PaginationConfig={'PageSize': RECONCILE_CHUNK_SIZE}):
+        for obj in page.get('Contents', []):
+            name = obj['Key'][len(prefix):]
+            if name:
+                yield name, obj['Size'], obj['LastModified'].timestamp()
+
+
+def iter_db_filenames(column=None, prefix=''):
+    """Distinct values of ``column`` (default Document.filename) in binary
+    order, one chunk per query, with ``prefix`` cut off the front"""
+    column = Document.filename if column is None else column
+    ordered = column
+    if db.engine.dialect.name == 'postgresql':
+        # Match the UTF-8 byte order S3 lists keys in
+        ordered = column.collate('C')
+    # SELECT DISTINCT can only be ordered by a selected expression
+    key = ordered.label('key')
+    last = None
+    while True:
+        query = db.session.query(key).filter(column.isnot(None))
+        if prefix:
+            query = query.filter(column.startswith(prefix, autoescape=True))
+        if last is not None:
+            query = query.filter(ordered > last)
+        rows = query.distinct().order_by(key).limit(RECONCILE_CHUNK_SIZE).all()
+        if not rows:
+            return
+        for row in rows:
+            yield row.key[len(prefix):]
+        last = rows[-1].key
+
+
+def merge_join(s3_blobs, db_filenames):
+    """Yield (filename, s3_entry or None, in_db) over two sorted streams"""
+    s3_entry = next(s3_blobs, None)
+    filename = next(db_filenames, None)
+    while s3_entry is not None or filename is not None:
+        if filename is None or (s3_entry is not None and s3_entry[0] < filename):
+            yield s3_entry[0], s3_entry, False
+            s3_entry = next(s3_blobs, None)
+        elif s3_entry is None or filename < s3_entry[0]:
+            yield filename, None, True
+            filename = next(db_filenames, None)
+        else:
+            yield filename, s3_entry, True
+            s3_entry = next(s3_blobs, None)
+            filename = next(db_filenames, None)
+
+
+def iter_chunks(iterable, size=RECONCILE_CHUNK_SIZE):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_local_blobs(upload_dir):
+    """(filename, size, mtime) for the files in a folder.
+
+    Subdirectories (thumbnails, the S3 cache) and dotfiles (in-flight
+    uploads and renders) are skipped.
+    """
+    if not os.path.isdir(upload_dir):
+        return
+    with os.scandir(upload_dir) as entries:
+        for entry in entries:
+            if entry.name.startswith('.') or not entry.is_file(follow_symlinks=False):
+                continue
+            stat = entry.stat()
+            yield entry.name, stat.st_size, stat.st_mtime
+
+
+def new_bucket():
+    return {'count': 0, 'bytes': 0, 'samples': []}
+
+
+def add_to_bucket(bucket, sample, size=0):
+    bucket['count'] += 1
+    bucket['bytes'] += size
+    if len(bucket['samples']) < REPORT_SAMPLE_LIMIT:
+        bucket['samples'].append(sample)
+
+
+def reconcile_storage(upload_dir, purge=False, purge_rows=False):
+    """Scan all storage and return a reconciliation report.
+
+    ``purge`` deletes orphaned blobs older than the grace period (S3 through
+    tombstones, local files directly). ``purge_rows`` deletes dangling rows.
+    """
+    started = time.monotonic()
+    cutoff = time.time() - RECONCILE_GRACE_SECONDS
+    s3_enabled = s3_manager.s3_client is not None
+    report = {
+        's3_enabled': s3_enabled,
+        'purged': purge,
+        's3': {'objects': 0, 'bytes': 0},
+        'local': {'files': 0, 'bytes': 0},
+        'orphaned_s3_blobs': new_bucket(),
+        'orphaned_local_blobs': new_bucket(),
+        'orphaned_s3_thumbnails': new_bucket(),
+        'orphaned_local_thumbnails': new_bucket(),
+        'dangling_rows': new_bucket(),
+        'referenced_blobs': 0,
+        'purged_rows': 0,
+    }
+
+    # Local files: orphan check against the database, one chunk at a time
+    for chunk in iter_chunks(iter_local_blobs(upload_dir)):
+        names = [name for name, _, _ in chunk]
+        referenced = {
+            row.filename for row in
+            db.session.query(Document.filename).filter(Document.filename.in_(names))
+        }
+        for name, size, mtime in chunk:
+            report['local']['files'] += 1
+            report['local']['bytes'] += size
+            if name in referenced:
+                continue
+            add_to_bucket(report['orphaned_local_blobs'], {'filename': name, 'size': size}, size)
+            if purge and mtime < cutoff:
+                os.remove(os.path.join(upload_dir, name))
+
+    # S3 against the database: sorted merge-join
+    s3_blobs = iter_s3_blobs() if s3_enabled else iter(())
+    dangling_filenames = []
+    pending_deletions = 0
+    for filename, s3_entry, in_db in merge_join(s3_blobs, iter_db_filenames()):
+        if s3_entry is not None:
+            report['s3']['objects'] += 1
+            report['s3']['bytes'] += s3_entry[1]
+        if in_db and (s3_entry is not None or os.path.exists(os.path.join(upload_dir, filename))):
+            report['referenced_blobs'] += 1
+        elif in_db:
+            dangling_filenames.append(filename)
+        else:
+            add_to_bucket(report['orphaned_s3_blobs'], {'key': S3_PREFIX + filename, 'size': s3_entry[1]}, s3_entry[1])
+            if purge and s3_entry[2] < cutoff:
+                record_deletion(S3_PREFIX + filename)
+                pending_deletions += 1
+                if pending_deletions % RECONCILE_CHUNK_SIZE == 0:
+                    db.session.commit()
+
+        if len(dangling_filenames) >= RECONCILE_CHUNK_SIZE:
+            report['purged_rows'] += handle_dangling(dangling_filenames, report, purge_rows)
+            dangling_filenames = []
+    report['purged_rows'] += handle_dangling(dangling_filenames, report, purge_rows)
+
+    # Thumbnails: the same two passes against Document.thumbnail_key
+    thumbnail_dir = os.path.join(upload_dir, THUMBNAIL_PREFIX)
+    for chunk in iter_chunks(iter_local_blobs(thumbnail_dir)):
+        keys = [THUMBNAIL_PREFIX + name for name, _, _ in chunk]
+        referenced = {
+            row.thumbnail_key for row in
+            db.session.query(Document.thumbnail_key).filter(Document.thumbnail_key.in_(keys))
+        }
+        for name, size, mtime in chunk:
+            report['local']['files'] += 1
+            report['local']['bytes'] += size
+            if THUMBNAIL_PREFIX + name in referenced:
+                continue
+            add_to_bucket(report['orphaned_local_thumbnails'], {'key': THUMBNAIL_PREFIX + name, 'size': size}, size)
+            if purge and mtime < cutoff:
+                os.remove(os.path.join(thumbnail_dir, name))
+
+    s3_thumbnails = iter_s3_blobs(THUMBNAIL_PREFIX) if s3_enabled else iter(())
+    db_thumbnails = iter_db_filenames(Document.thumbnail_key, THUMBNAIL_PREFIX)
+    for name, s3_entry, in_db in merge_join(s3_thumbnails, db_thumbnails):
+        if s3_entry is None:
+            continue
+        report['s3']['objects'] += 1
+        report['s3']['bytes'] += s3_entry[1]
+        if in_db:
+            continue
+        add_to_bucket(report['orphaned_s3_thumbnails'], {'key': THUMBNAIL_PREFIX + name, 'size': s3_entry[1]}, s3_entry[1])
+        if purge and s3_entry[2] < cutoff:
+            record_deletion(THUMBNAIL_PREFIX + name)
+            pending_deletions += 1
+            if pending_deletions % RECONCILE_CHUNK_SIZE == 0:
+                db.session.commit()
+
+    db.session.commit()
+    if pending_deletions:
+        report['s3_deletions'] = flush_all_tombstones()
+
+    report['elapsed_seconds'] = round(time.monotonic() - started, 2)
+    return report
+
+
+def handle_dangling(filenames, report, purge_rows):
+    """Report (and optionally delete) the documents pointing at missing blobs"""
+    if not filenames:
+        return 0
+    documents = (
+        db.session.query(Document.id, Document.title, Document.filename)
+        .filter(Document.filename.in_(filenames))
+        .all()
+    )
+    for document in documents:
+        add_to_bucket(report['dangling_rows'], {
+            'id': document.id,
+            'title': document.title,
+            'filename': document.filename
+        })
+    if not purge_rows:
+        return 0
+
+    document_ids = [document.id for document in documents]
+    for document_id in document_ids:
+        remove_document(document_id)
+    DocumentVisibility.query.filter(DocumentVisibility.document_id.in_(document_ids)).delete(synchronize_session=False)
+    Document.query.filter(Document.id.in_(document_ids)).delete(synchronize_session=False)
+    db.session.commit()
+    return len(document_ids)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Reconcile stored blobs against document rows')
+    parser.add_argument('--purge', action='store_true', help='delete orphaned blobs')
+    parser.add_argument('--purge-rows', action='store_true', help='delete documents whose blob is missing')
+    args = parser.parse_args()
+
+    from main import app
+    with app.app_context():
+        result = reconcile_storage(app.config['UPLOAD_FOLDER'], purge=args.purge, purge_rows=args.purge_rows)
+    print(json.dumps(result, indent=2))
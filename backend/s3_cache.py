@@ -0,0 +1,250 @@
+import fcntl
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from s3_config import s3_manager
+from metrics import S3_CACHE_EVENTS
+from green import is_green
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def lock_exclusive(lock_file):
+    """flock() that lets other requests of a green worker run while it waits"""
+    if not is_green():
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return
+    while True:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return
+        except BlockingIOError:
+            time.sleep(0.05)
+
+
+class S3DiskCache:
+    """Size-capped local read-through cache of S3 objects.
+
+    Objects are stored under ``cache_dir`` keyed by the SHA-256 of their S3 key.
+    Fills are written to a temp file and renamed into place, so readers never see
+    a partial object. Concurrent misses for the same key are coalesced: threads
+    in one worker wait on a shared lock, and other gunicorn workers wait on an
+    ``flock`` of the same key, so each object is fetched from S3 only once.
+    Eviction is least-recently-used, using the file mtime as the access stamp.
+    """
+
+    def __init__(self, s3, cache_dir, max_bytes):
+        self.s3 = s3
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._stats_guard = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'coalesced': 0,
+            'fills': 0,
+            'fill_errors': 0,
+            'evictions': 0,
+            'evicted_bytes': 0,
+        }
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0 and self.s3.s3_client is not None
+
+    def path_for(self, s3_key):
+        """Local path an S3 key is cached at (whether or not it is present)"""
+        digest = hashlib.sha256(s3_key.encode('utf-8')).hexdigest()
+        extension = os.path.splitext(s3_key)[1].lower()
+        return os.path.join(self.cache_dir, digest + extension)
+
+    def get(self, s3_key):
+        """Return a local path for ``s3_key``, fetching it from S3 on a miss.
+
+        Returns None if the object could not be fetched.
+        """
+        if not self.enabled:
+            return None
+
+        path = self.path_for(s3_key)
+        if self._touch(path):
+            self._count('hits')
+            return path
+
+        key_lock = self._acquire_key_lock(path)
+        try:
+            if self._touch(path):
+                self._count('hits')
+                return path
+            return self._fill(s3_key, path)
+        finally:
+            self._release_key_lock(path, key_lock)
+
+    def invalidate(self, s3_key):
+        """Drop a cached object, e.g. after it was deleted from S3"""
+        self._remove(self.path_for(s3_key))
+
+    def stats(self):
+        entries, total_bytes = 0, 0
+        if os.path.isdir(self.cache_dir):
+            for entry in os.scandir(self.cache_dir):
+                if entry.is_file() and not entry.name.startswith('.'):
+                    entries += 1
+                    total_bytes += entry.stat().st_size
+        with self._stats_guard:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['misses']
+        stats.update({
+            'enabled': self.enabled,
+            'cache_dir': self.cache_dir,
+            'max_bytes': self.max_bytes,
+            'entries': entries,
+            'size_bytes': total_bytes,
+            'hit_ratio': round(stats['hits'] / lookups, 4) if lookups else None,
+        })
+        return stats
+
+    def _lock_path(self, path):
+        return os.path.join(self.cache_dir, '.locks', os.path.basename(path) + '.lock')
+
+    def _open_lock(self, path):
+        """Open and flock the lock file of ``path``.
+
+        Eviction deletes lock files, so one may be unlinked while we wait on
+        it; retry until the file we hold is still the one at the lock path.
+        """
+        os.makedirs(os.path.join(self.cache_dir, '.locks'), exist_ok=True)
+        lock_path = self._lock_path(path)
+        while True:
+            lock_file = open(lock_path, 'a')
+            lock_exclusive(lock_file)
+            try:
+                if os.stat(lock_path).st_ino == os.fstat(lock_file.fileno()).st_ino:
+                    return lock_file
+            except FileNotFoundError:
+                pass
+            lock_file.close()
+
+    def _fill(self, s3_key, path):
+        # Serialise fills of this key across gunicorn workers
+        with self._open_lock(path) as lock_file:
+            try:
+                if self._touch(path):
+                    self._count('coalesced')
+                    self._count('hits')
+                    return path
+
+                self._count('misses')
+                fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, prefix='.fill-')
+                os.close(fd)
+                try:
+                    if not self.s3.download_file(s3_key, temp_path):
+                        self._count('fill_errors')
+                        # Nothing cached to evict it later; waiters notice it is gone and reopen
+                        self._remove_lock(path)
+                        return None
+                    os.replace(temp_path, path)
+                finally:
+                    if os.path.exists(temp_path):
+                        os.remove(temp_path)
+                self._count('fills')
+                print(f"📦 S3 cache filled: {s3_key}")
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+        self._evict(keep=path)
+        return path
+
+    def _evict(self, keep=None):
+        entries = []
+        total_bytes = 0
+        for entry in os.scandir(self.cache_dir):
+            if not entry.is_file() or entry.name.startswith('.'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total_bytes += stat.st_size
+
+        if total_bytes <= self.max_bytes:
+            return
+
+        entries.sort()
+        for _, size, path in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            self._remove(path)
+            total_bytes -= size
+            self._count('evictions')
+            self._count('evicted_bytes', size)
+
+    def _remove(self, path):
+        """Delete a cached object and its lock file"""
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # Already evicted by another worker
+            pass
+        self._remove_lock(path)
+
+    def _remove_lock(self, path):
+        try:
+            os.remove(self._lock_path(path))
+        except FileNotFoundError:
+            pass
+
+    def _touch(self, path):
+        """Mark ``path`` as recently used; returns False if it is not cached"""
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _acquire_key_lock(self, path):
+        """Take this worker's lock for ``path``.
+
+        Entries are refcounted and dropped by the last holder, so every
+        thread filling a key at the same time shares one lock.
+        """
+        with self._locks_guard:
+            entry = self._locks.get(path)
+            if entry is None:
+                entry = self._locks[path] = [threading.Lock(), 0]
+            entry[1] += 1
+        key_lock = entry[0]
+        if not key_lock.acquire(blocking=False):
+            # Another thread in this worker is already filling this key
+            self._count('coalesced')
+            key_lock.acquire()
+        return key_lock
+
+    def _release_key_lock(self, path, key_lock):
+        key_lock.release()
+        with self._locks_guard:
+            entry = self._locks[path]
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[path]
+
+    def _count(self, name, amount=1):
+        with self._stats_guard:
+            self._stats[name] += amount
+        if name != 'evicted_bytes':
+            S3_CACHE_EVENTS.labels(name).inc(amount)
+
+
+# Global S3 cache instance
+s3_cache = S3DiskCache(
+    s3_manager,
+    cache_dir=os.getenv('S3_CACHE_DIR', os.path.join(BASE_DIR, 'uploads', '.s3_cache')),
+    max_bytes=int(os.getenv('S3_CACHE_MAX_MB', '1024')) * 1024 * 1024
+)
@@ -1,42 +1,223 @@
 import boto3
 import os
-from botocore.exceptions import ClientError
+import threading
+import time
+from boto3.exceptions import Boto3Error
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
 from flask import current_app
+from metrics import observe_s3_call, set_breaker_state
+
+S3_CONNECT_TIMEOUT = float(os.getenv('S3_CONNECT_TIMEOUT', '2'))
+S3_READ_TIMEOUT = float(os.getenv('S3_READ_TIMEOUT', '10'))
+S3_MAX_ATTEMPTS = int(os.getenv('S3_MAX_ATTEMPTS', '3'))
+S3_MAX_POOL_CONNECTIONS = int(os.getenv('S3_MAX_POOL_CONNECTIONS', '10'))
+# Consecutive failures that open the breaker, and how long it stays open
+S3_BREAKER_FAILURE_THRESHOLD = int(os.getenv('S3_BREAKER_FAILURE_THRESHOLD', '5'))
+S3_BREAKER_RESET_SECONDS = float(os.getenv('S3_BREAKER_RESET_SECONDS', '30'))
+
+# Error codes that mean S3 itself is unhealthy rather than the request being wrong
+OUTAGE_ERROR_CODES = {'SlowDown', 'Throttling', 'ThrottlingException', 'RequestTimeout',
+                      'ServiceUnavailable', 'InternalError'}
+
+# What a failed S3 call can raise: boto3's transfer methods (upload_file,
+# download_file) wrap client errors in Boto3Error subclasses such as
+# S3UploadFailedError and RetriesExceededError
+S3_ERRORS = (ClientError, BotoCoreError, Boto3Error)
+
+
+class S3Unavailable(Exception):
+    """Raised instead of calling S3 while the circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """Per-process circuit breaker.
+
+    closed: calls go through. After ``failure_threshold`` consecutive outage
+    errors it opens and every call fails fast for ``reset_seconds``. Then it
+    goes half-open and lets a single trial call through; success closes it,
+    failure opens it again.
+    """
+
+    def __init__(self, failure_threshold, reset_seconds):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.times_opened = 0
+        self.short_circuited = 0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = 'half_open'
+                self.trial_in_flight = False
+                set_breaker_state(self.state)
+            if self.state == 'closed':
+                return True
+            if self.state == 'half_open' and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            self.short_circuited += 1
+            return False
+
+    def record_success(self):
+        with self.lock:
+            if self.state != 'closed':
+                print("✅ S3 circuit breaker closed")
+                set_breaker_state('closed')
+            self.state = 'closed'
+            self.consecutive_failures = 0
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.consecutive_failures += 1
+            self.trial_in_flight = False
+            if self.state == 'half_open' or (
+                    self.state == 'closed' and self.consecutive_failures >= self.failure_threshold):
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+                self.times_opened += 1
+                set_breaker_state(self.state)
+                print(f"🔌 S3 circuit breaker open for {self.reset_seconds:g}s "
+                      f"after {self.consecutive_failures} failure(s)")
+
+    def retry_after(self):
+        """Whole seconds until the breaker lets a trial call through"""
+        with self.lock:
+            if self.state != 'open':
+                return 1
+            remaining = self.reset_seconds - (time.monotonic() - self.opened_at)
+            return max(1, int(remaining + 0.999))
+
+    def stats(self):
+        with self.lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'times_opened': self.times_opened,
+                'short_circuited': self.short_circuited,
+                'failure_threshold': self.failure_threshold,
+                'reset_seconds': self.reset_seconds,
+            }
+
+
+def is_outage(error):
+    """True for timeouts, connection failures, throttling and 5xx responses"""
+    if isinstance(error, Boto3Error):
+        # Judge a transfer failure by the error it wraps
+        cause = getattr(error, 'last_exception', None) or error.__cause__ or error.__context__
+        return is_outage(cause) if cause is not None else True
+    if isinstance(error, BotoCoreError):
+        return True
+    if isinstance(error, ClientError):
+        response = error.response or {}
+        status = response.get('ResponseMetadata', {}).get('HTTPStatusCode') or 0
+        return status >= 500 or response.get('Error', {}).get('Code') in OUTAGE_ERROR_CODES
+    return False
+
 
 class S3Manager:
     def __init__(self):
+        self.bucket_name = os.getenv('AWS_S3_BUCKET_NAME')
+        if os.getenv('S3_STANDIN_DIR'):
+            self.bucket_name = self.bucket_name or 'standin'
+
+        self.breaker = CircuitBreaker(S3_BREAKER_FAILURE_THRESHOLD, S3_BREAKER_RESET_SECONDS)
+
+        # Built on first use, and again in each forked worker: a client's
+        # connection pool must not be shared between processes
+        self._client = None
+        self._client_pid = None
+        self._client_lock = threading.Lock()
+
+    @property
+    def s3_client(self):
+        """The boto3 client, or None when S3 is not configured"""
+        if self._client_pid != os.getpid():
+            with self._client_lock:
+                if self._client_pid != os.getpid():
+                    self._client = self._create_client()
+                    self._client_pid = os.getpid()
+        return self._client
+
+    def _create_client(self):
         # Check if AWS credentials are properly configured
         aws_access_key = os.getenv('AWS_ACCESS_KEY_ID')
         aws_secret_key = os.getenv('AWS_SECRET_ACCESS_KEY')
         aws_region = os.getenv('AWS_REGION', 'us-east-1')
-        self.bucket_name = os.getenv('AWS_S3_BUCKET_NAME')
-        
+
+        # Local directory standing in for the bucket, for offline load tests
+        standin_dir = os.getenv('S3_STANDIN_DIR')
+        if standin_dir:
+            from perf.local_s3 import LocalS3Client
+            print(f"🧪 Using local S3 stand-in at {standin_dir}")
+            return LocalS3Client(standin_dir, latency_ms=float(os.getenv('S3_STANDIN_LATENCY_MS', '0')))
+
         if not all([aws_access_key, aws_secret_key, self.bucket_name]):
             print("⚠️ AWS S3 credentials not properly configured, S3 features disabled")
-            self.s3_client = None
-            return
+            return None
             
         try:
-            self.s3_client = boto3.client(
+            client = boto3.client(
                 's3',
                 aws_access_key_id=aws_access_key,
                 aws_secret_access_key=aws_secret_key,
-                region_name=aws_region
+                region_name=aws_region,
+                # Bounded so a degraded S3 cannot hold a sync worker until the gunicorn timeout
+                config=Config(
+                    connect_timeout=S3_CONNECT_TIMEOUT,
+                    read_timeout=S3_READ_TIMEOUT,
+                    retries={'total_max_attempts': S3_MAX_ATTEMPTS, 'mode': 'adaptive'},
+                    max_pool_connections=S3_MAX_POOL_CONNECTIONS
+                )
             )
             print(f"✅ S3 client initialized for bucket: {self.bucket_name}")
+            return client
         except Exception as e:
             print(f"❌ Failed to initialize S3 client: {e}")
-            self.s3_client = None
+            return None
     
-    def upload_file(self, file_path, s3_key):
+    def call(self, operation, **kwargs):
+        """Run an S3 client operation through the circuit breaker"""
+        if not self.breaker.allow():
+            observe_s3_call(operation, 'short_circuited')
+            raise S3Unavailable("S3 circuit breaker is open")
+        started = time.perf_counter()
+        try:
+            result = getattr(self.s3_client, operation)(**kwargs)
+        except S3_ERRORS as e:
+            outage = is_outage(e)
+            observe_s3_call(operation, 'unavailable' if outage else 'error', time.perf_counter() - started)
+            if outage:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            raise
+        except BaseException:
+            # Anything else (a missing local file, a gevent timeout, a bug) must
+            # still settle a half-open trial, or the breaker never lets another through
+            observe_s3_call(operation, 'error', time.perf_counter() - started)
+            self.breaker.record_failure()
+            raise
+        observe_s3_call(operation, 'ok', time.perf_counter() - started)
+        self.breaker.record_success()
+        return result
+
+    def upload_file(self, file_path, s3_key, cache_control=None):
         """Upload a file to S3"""
         if not self.s3_client:
             print("❌ S3 client not available, skipping upload")
             return False
+        extra_args = {'CacheControl': cache_control} if cache_control else None
         try:
-            self.s3_client.upload_file(file_path, self.bucket_name, s3_key)
+            self.call('upload_file', Filename=file_path, Bucket=self.bucket_name, Key=s3_key, ExtraArgs=extra_args)
             return True
-        except ClientError as e:
+        except S3_ERRORS + (S3Unavailable,) as e:
             print(f"Error uploading file to S3: {e}")
             return False
     
@@ -46,9 +227,9 @@ class S3Manager:
             print("❌ S3 client not available, skipping download")
             return False
         try:
-            self.s3_client.download_file(self.bucket_name, s3_key, local_path)
+            self.call('download_file', Bucket=self.bucket_name, Key=s3_key, Filename=local_path)
             return True
-        except ClientError as e:
+        except S3_ERRORS + (S3Unavailable,) as e:
             print(f"Error downloading file from S3: {e}")
             return False
     
@@ -74,21 +255,55 @@ class S3Manager:
             print("❌ S3 client not available, skipping deletion")
             return False
         try:
-            self.s3_client.delete_object(Bucket=self.bucket_name, Key=s3_key)
+            self.call('delete_object', Bucket=self.bucket_name, Key=s3_key)
             return True
-        except ClientError as e:
+        except S3_ERRORS + (S3Unavailable,) as e:
             print(f"Error deleting file from S3: {e}")
             return False
     
+    def delete_objects(self, s3_keys):
+        """Delete many objects, up to 1,000 keys per request.
+
+        Returns (deleted_keys, errors) where errors maps each failed key to a
+        message. Keys that did not exist count as deleted.
+        """
+        s3_keys = list(s3_keys)
+        if not self.s3_client:
+            return [], {key: "S3 client not available" for key in s3_keys}
+
+        deleted, errors = [], {}
+        for start in range(0, len(s3_keys), 1000):
+            batch = s3_keys[start:start + 1000]
+            try:
+                response = self.call(
+                    'delete_objects',
+                    Bucket=self.bucket_name,
+                    Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True}
+                )
+            except S3_ERRORS + (S3Unavailable,) as e:
+                print(f"Error batch deleting files from S3: {e}")
+                errors.update({key: str(e) for key in batch})
+                continue
+            batch_errors = {err['Key']: f"{err.get('Code')}: {err.get('Message')}" for err in response.get('Errors', [])}
+            errors.update(batch_errors)
+            deleted.extend(key for key in batch if key not in batch_errors)
+        return deleted, errors
+
     def file_exists(self, s3_key):
-        """Check if a file exists in S3"""
+        """Check if a file exists in S3.
+
+        Raises S3Unavailable when S3 cannot answer (breaker open, timeouts,
+        5xx), so callers never mistake an outage for a missing file.
+        """
         if not self.s3_client:
             print("❌ S3 client not available, file check skipped")
             return False
         try:
-            self.s3_client.head_object(Bucket=self.bucket_name, Key=s3_key)
+            self.call('head_object', Bucket=self.bucket_name, Key=s3_key)
             return True
-        except ClientError:
+        except S3_ERRORS as e:
+            if is_outage(e):
+                raise S3Unavailable(f"S3 is unavailable: {e}") from e
             return False
 
 # Global S3 manager instance
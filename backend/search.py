@@ -0,0 +1,189 @@
+"""Full-text search over document titles, descriptions and PDF contents.
+
+The index lives in the application database: a ``tsvector`` column with a GIN
+index on PostgreSQL, or an FTS5 virtual table on SQLite. Documents are
+(re)indexed by the ``index_document`` background job.
+"""
+import html
+import os
+from models import db
+
+SEARCH_MAX_TEXT_CHARS = int(os.getenv('SEARCH_MAX_TEXT_CHARS', '200000'))
+
+# Snippets are highlighted with these control characters, then HTML-escaped,
+# and only then are the markers turned into <mark> tags. They are stripped from
+# indexed text so a document cannot contain them.
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_STOP = '\x03'
+
+# Same rules as get_documents_user: no rules means visible to everyone
+VISIBILITY_SQL = """
+    (NOT EXISTS (SELECT 1 FROM document_visibility v WHERE v.document_id = {doc_id})
+     OR EXISTS (
+        SELECT 1 FROM document_visibility v
+        WHERE v.document_id = {doc_id} AND (
+            v.visibility_type = 'all'
+            OR (v.visibility_type = 'user' AND v.target_id = :user_id)
+            OR (v.visibility_type = 'tag' AND v.target_id IN (
+                SELECT ut.tag_id FROM user_tags ut WHERE ut.user_id = :user_id))
+        )
+     ))
+"""
+
+
+def is_postgres():
+    return db.engine.dialect.name == 'postgresql'
+
+
+def ensure_search_index():
+    """Create the search table and index if they do not exist"""
+    if is_postgres():
+        db.session.execute(db.text("""
+            CREATE TABLE IF NOT EXISTS document_search (
+                document_id INTEGER PRIMARY KEY REFERENCES documents(id) ON DELETE CASCADE,
+                title TEXT,
+                description TEXT,
+                body TEXT,
+                search_vector TSVECTOR
+            )
+        """))
+        db.session.execute(db.text(
+            "CREATE INDEX IF NOT EXISTS ix_document_search_vector "
+            "ON document_search USING GIN (search_vector)"
+        ))
+    else:
+        db.session.execute(db.text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS document_fts "
+            "USING fts5(title, description, body, tokenize='porter unicode61')"
+        ))
+    db.session.commit()
+
+
+def extract_pdf_text(file_path):
+    """Extract plain text from a PDF, or '' if pypdf is not installed"""
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        print("⚠️ pypdf not installed, indexing title and description only")
+        return ''
+
+    reader = PdfReader(file_path)
+    parts = []
+    length = 0
+    for page in reader.pages:
+        text = page.extract_text() or ''
+        parts.append(text)
+        length += len(text)
+        if length >= SEARCH_MAX_TEXT_CHARS:
+            break
+    return '\n'.join(parts)[:SEARCH_MAX_TEXT_CHARS]
+
+
+def index_document(document, body=''):
+    """Add or replace a document in the search index"""
+    params = {
+        'document_id': document.id,
+        'title': _strip_markers(document.title or ''),
+        'description': _strip_markers(document.description or ''),
+        'body': _strip_markers(body or ''),
+    }
+    if is_postgres():
+        db.session.execute(db.text("""
+            INSERT INTO document_search (document_id, title, description, body, search_vector)
+            VALUES (:document_id, :title, :description, :body,
+                    setweight(to_tsvector('english', :title), 'A') ||
+                    setweight(to_tsvector('english', :description), 'B') ||
+                    setweight(to_tsvector('english', :body), 'C'))
+            ON CONFLICT (document_id) DO UPDATE SET
+                title = EXCLUDED.title,
+                description = EXCLUDED.description,
+                body = EXCLUDED.body,
+                search_vector = EXCLUDED.search_vector
+        """), params)
+    else:
+        db.session.execute(db.text("DELETE FROM document_fts WHERE rowid = :document_id"), params)
+        db.session.execute(db.text(
+            "INSERT INTO document_fts (rowid, title, description, body) "
+            "VALUES (:document_id, :title, :description, :body)"
+        ), params)
+    db.session.commit()
+
+
+def remove_document(document_id):
+    """Drop a document from the index (PostgreSQL also cascades on delete)"""
+    if is_postgres():
+        db.session.execute(db.text("DELETE FROM document_search WHERE document_id = :id"), {'id': document_id})
+    else:
+        db.session.execute(db.text("DELETE FROM document_fts WHERE rowid = :id"), {'id': document_id})
+
+
+def get_indexed_text(document_id, max_chars=1000):
+    """Leading extracted text of an indexed document, or None if not indexed yet"""
+    table, key = ('document_search', 'document_id') if is_postgres() else ('document_fts', 'rowid')
+    body = db.session.execute(
+        db.text(f"SELECT body FROM {table} WHERE {key} = :id"), {'id': document_id}
+    ).scalar()
+    return body[:max_chars] if body is not None else None
+
+
+def _strip_markers(text):
+    return text.replace(HIGHLIGHT_START, '').replace(HIGHLIGHT_STOP, '')
+
+
+def highlight_html(snippet):
+    """HTML for a snippet: the text escaped, the matched terms in <mark>"""
+    escaped = html.escape(snippet or '')
+    return escaped.replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_STOP, '</mark>')
+
+
+def _fts5_query(query):
+    # Quote every term so user input cannot inject FTS5 query syntax
+    terms = [term.replace('"', '""') for term in query.split()]
+    return ' '.join(f'"{term}"' for term in terms if term)
+
+
+def search_documents(query, user_id=None, limit=20):
+    """Ranked hits for ``query`` as (document_id, rank, snippet) tuples.
+
+    Snippets are HTML: the document text escaped, matched terms in <mark>.
+
+    With ``user_id`` only documents visible to that user are returned;
+    pass None for admins.
+    """
+    params = {'limit': limit, 'user_id': user_id}
+    if is_postgres():
+        visibility = VISIBILITY_SQL.format(doc_id='s.document_id') if user_id is not None else 'TRUE'
+        params['query'] = query
+        params['headline_options'] = f'MaxWords=35, MinWords=15, StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}'
+        sql = f"""
+            SELECT hits.document_id, hits.rank,
+                   ts_headline('english', coalesce(nullif(hits.body, ''), hits.description, hits.title),
+                               hits.q, :headline_options) AS snippet
+            FROM (
+                SELECT s.document_id, s.title, s.description, s.body, q,
+                       ts_rank_cd(s.search_vector, q) AS rank
+                FROM document_search s, websearch_to_tsquery('english', :query) q
+                WHERE s.search_vector @@ q AND {visibility}
+                ORDER BY rank DESC
+                LIMIT :limit
+            ) hits
+            ORDER BY hits.rank DESC
+        """
+    else:
+        match = _fts5_query(query)
+        if not match:
+            return []
+        visibility = VISIBILITY_SQL.format(doc_id='document_fts.rowid') if user_id is not None else '1'
+        params.update({'query': match, 'start': HIGHLIGHT_START, 'stop': HIGHLIGHT_STOP})
+        # bm25() is lower-is-better; negate it so higher rank means more relevant
+        sql = f"""
+            SELECT rowid AS document_id,
+                   -bm25(document_fts, 10.0, 5.0, 1.0) AS rank,
+                   snippet(document_fts, -1, :start, :stop, '…', 24) AS snippet
+            FROM document_fts
+            WHERE document_fts MATCH :query AND {visibility}
+            ORDER BY bm25(document_fts, 10.0, 5.0, 1.0)
+            LIMIT :limit
+        """
+    rows = db.session.execute(db.text(sql), params).all()
+    return [(row.document_id, float(row.rank), highlight_html(row.snippet)) for row in rows]
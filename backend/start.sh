@@ -4,17 +4,21 @@ echo "🚀 Starting SequoAlpha Backend..."
 echo "🔧 Environment: $FLASK_ENV"
 echo "🔧 Port: $PORT"
 
-# Initialize the database
-echo "🔧 Initializing database..."
-python init_db.py
+# Schema and seed data are bootstrapped by a separate step (python init_db.py,
+# see update.sh and docker-compose.yml). Hosts without one, like Render's free
+# plan, set BOOTSTRAP_ON_START=true; it is a quick no-op once current.
+if [ "$BOOTSTRAP_ON_START" = "true" ]; then
+    echo "🔧 Bootstrapping database..."
+    python init_db.py
 
-if [ $? -eq 0 ]; then
-    echo "✅ Database initialization successful!"
-else
-    echo "❌ Database initialization failed!"
-    exit 1
+    if [ $? -eq 0 ]; then
+        echo "✅ Database bootstrap successful!"
+    else
+        echo "❌ Database bootstrap failed!"
+        exit 1
+    fi
 fi
 
 # Start the application
 echo "🚀 Starting Gunicorn server..."
-gunicorn main:app --bind 0.0.0.0:$PORT --workers 2 --timeout 120 --log-level info
+gunicorn main:app --bind 0.0.0.0:$PORT --timeout 120 --log-level info
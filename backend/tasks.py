@@ -0,0 +1,110 @@
+"""Handlers for background jobs, run by worker.py"""
+import os
+from main import (app, store_blob, file_checksum, local_blob_path,
+                  reindex_document, render_document_thumbnail)
+from models import db, Document
+from jobs import job_handler, enqueue
+from s3_config import s3_manager
+from tombstones import flush_all_tombstones
+from reconcile import reconcile_storage
+
+
+@job_handler('store_blob')
+def store_blob_job(filename):
+    local_file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    if not os.path.exists(local_file_path):
+        print(f"ℹ️ {filename} is no longer stored locally, nothing to upload")
+        return
+    if not s3_manager.s3_client:
+        # Without S3 the local copy is the permanent one
+        return
+    if not store_blob(filename):
+        raise RuntimeError(f"S3 upload failed for {filename}")
+
+
+@job_handler('flush_tombstones')
+def flush_tombstones_job():
+    return flush_all_tombstones()
+
+
+@job_handler('repair_missing_file')
+def repair_missing_file_job(document_id):
+    """Re-check a file a download could not find, re-uploading a local-only copy"""
+    document = db.session.get(Document, document_id)
+    if not document or not document.filename:
+        return {'status': 'gone'}
+    local_file_path = os.path.join(app.config['UPLOAD_FOLDER'], document.filename)
+    # Raises S3Unavailable during an outage, so the job is retried instead of failing as missing
+    in_s3 = s3_manager.file_exists(f"documents/{document.filename}")
+    if os.path.exists(local_file_path):
+        if s3_manager.s3_client and not in_s3 and store_blob(document.filename):
+            return {'status': 'repaired'}
+        return {'status': 'present'}
+    if in_s3:
+        return {'status': 'present'}
+    # Fails the job so the missing file shows up in /admin/jobs
+    raise FileNotFoundError(f"File {document.filename} of document {document_id} is missing from storage")
+
+
+@job_handler('reconcile_storage')
+def reconcile_storage_job(purge=False, purge_rows=False):
+    return reconcile_storage(app.config['UPLOAD_FOLDER'], purge=purge, purge_rows=purge_rows)
+
+
+@job_handler('compute_checksum')
+def compute_checksum_job(document_id):
+    document = db.session.get(Document, document_id)
+    if not document or not document.filename or document.checksum:
+        return
+    file_path = local_blob_path(document.filename)
+    if not file_path:
+        raise FileNotFoundError(f"No stored file for document {document_id}")
+    document.checksum = file_checksum(file_path)
+    db.session.commit()
+
+
+@job_handler('index_document')
+def index_document_job(document_id):
+    reindex_document(document_id)
+
+
+@job_handler('render_thumbnail')
+def render_thumbnail_job(document_id):
+    render_document_thumbnail(document_id)
+
+
+def enqueue_checksum_backfill():
+    """Queue checksum jobs for documents uploaded before checksums were stored"""
+    document_ids = [
+        row.id for row in db.session.query(Document.id).filter(
+            Document.filename.isnot(None),
+            Document.checksum.is_(None)
+        )
+    ]
+    for document_id in document_ids:
+        enqueue('compute_checksum', {'document_id': document_id}, commit=False)
+    db.session.commit()
+    return len(document_ids)
+
+
+def enqueue_reindex():
+    """Queue search indexing jobs for every document"""
+    document_ids = [row.id for row in db.session.query(Document.id)]
+    for document_id in document_ids:
+        enqueue('index_document', {'document_id': document_id}, commit=False)
+    db.session.commit()
+    return len(document_ids)
+
+
+def enqueue_thumbnail_backfill():
+    """Queue thumbnail jobs for documents uploaded before thumbnails were rendered"""
+    document_ids = [
+        row.id for row in db.session.query(Document.id).filter(
+            Document.filename.isnot(None),
+            Document.thumbnail_key.is_(None)
+        )
+    ]
+    for document_id in document_ids:
+        enqueue('render_thumbnail', {'document_id': document_id}, commit=False)
+    db.session.commit()
+    return len(document_ids)
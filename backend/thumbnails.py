@@ -0,0 +1,41 @@
+"""First-page thumbnail rendering for PDF documents"""
+import os
+import tempfile
+
+THUMBNAIL_WIDTH = int(os.getenv('THUMBNAIL_WIDTH', '320'))
+
+
+def thumbnail_key(blob_filename):
+    """Storage key of a blob's thumbnail, next to the blob under thumbnails/"""
+    return f"thumbnails/{os.path.splitext(blob_filename)[0]}.png"
+
+
+def render_first_page(pdf_path, output_path):
+    """Render page one of a PDF to a PNG at THUMBNAIL_WIDTH pixels wide.
+
+    The image is written atomically. Returns the document's page count.
+    """
+    try:
+        import pypdfium2 as pdfium
+    except ImportError:
+        raise RuntimeError("pypdfium2 and Pillow are required to render thumbnails")
+
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        page_count = len(pdf)
+        page = pdf[0]
+        scale = THUMBNAIL_WIDTH / page.get_width()
+        image = page.render(scale=scale).to_pil()
+    finally:
+        pdf.close()
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(output_path), prefix='.render-', suffix='.png')
+    os.close(fd)
+    try:
+        image.save(temp_path, format='PNG', optimize=True)
+        os.replace(temp_path, output_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return page_count
@@ -0,0 +1,92 @@
+"""Batched, retried deletion of S3 objects.
+
+Deleting a document records tombstones for its S3 objects in the same
+transaction. flush_tombstones() then removes them through DeleteObjects,
+up to 1,000 keys per call. Failed keys stay pending with a backoff and are
+retried by the worker's periodic reconciler, so no storage garbage is left.
+"""
+import os
+from datetime import datetime, timedelta
+from models import db, Document, StorageTombstone
+from s3_config import s3_manager
+from s3_cache import s3_cache
+
+TOMBSTONE_BATCH_SIZE = 1000
+TOMBSTONE_RETRY_BASE_SECONDS = int(os.getenv('TOMBSTONE_RETRY_BASE_SECONDS', '30'))
+TOMBSTONE_RETRY_MAX_SECONDS = int(os.getenv('TOMBSTONE_RETRY_MAX_SECONDS', '21600'))
+
+
+def record_deletion(s3_key):
+    """Queue an S3 object for deletion; committed with the caller's transaction"""
+    db.session.add(StorageTombstone(s3_key=s3_key))
+
+
+def referenced_keys(s3_keys):
+    """Keys that documents reference again, e.g. after a duplicate re-upload"""
+    filenames = {key[len('documents/'):]: key for key in s3_keys if key.startswith('documents/')}
+    thumbnails = [key for key in s3_keys if key.startswith('thumbnails/')]
+    referenced = set()
+    if filenames:
+        rows = db.session.query(Document.filename).filter(Document.filename.in_(list(filenames)))
+        referenced.update(filenames[row.filename] for row in rows)
+    if thumbnails:
+        rows = db.session.query(Document.thumbnail_key).filter(Document.thumbnail_key.in_(thumbnails))
+        referenced.update(row.thumbnail_key for row in rows)
+    return referenced
+
+
+def flush_tombstones(batch_size=TOMBSTONE_BATCH_SIZE):
+    """Delete one batch of due tombstones from S3.
+
+    Returns counts of deleted, failed and skipped (still referenced) keys.
+    """
+    summary = {'deleted': 0, 'failed': 0, 'skipped': 0}
+    if not s3_manager.s3_client:
+        return summary
+
+    now = datetime.utcnow()
+    tombstones = (
+        StorageTombstone.query
+        .filter(StorageTombstone.next_attempt_at <= now)
+        .order_by(StorageTombstone.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    if not tombstones:
+        db.session.rollback()
+        return summary
+
+    keys = {tombstone.s3_key for tombstone in tombstones}
+    skipped = referenced_keys(keys)
+    deleted, errors = s3_manager.delete_objects(sorted(keys - skipped))
+    deleted = set(deleted)
+
+    for tombstone in tombstones:
+        key = tombstone.s3_key
+        if key in skipped or key in deleted:
+            db.session.delete(tombstone)
+            s3_cache.invalidate(key)
+            continue
+        tombstone.attempts += 1
+        tombstone.last_error = errors.get(key, 'Unknown error')
+        delay = min(TOMBSTONE_RETRY_MAX_SECONDS, TOMBSTONE_RETRY_BASE_SECONDS * 2 ** (tombstone.attempts - 1))
+        tombstone.next_attempt_at = now + timedelta(seconds=delay)
+    db.session.commit()
+
+    summary['deleted'] = len(deleted)
+    summary['failed'] = len(keys) - len(deleted) - len(skipped)
+    summary['skipped'] = len(skipped)
+    print(f"🗑️ Flushed S3 tombstones: {summary}")
+    return summary
+
+
+def flush_all_tombstones():
+    """Flush batches until no due tombstones remain or a batch fails entirely"""
+    totals = {'deleted': 0, 'failed': 0, 'skipped': 0}
+    while True:
+        summary = flush_tombstones()
+        for name in totals:
+            totals[name] += summary[name]
+        if not summary['deleted'] and not summary['skipped']:
+            return totals
@@ -0,0 +1,96 @@
+"""Background job worker.
+
+Usage:
+    python worker.py                      # run until stopped
+    python worker.py --once               # drain due jobs and exit
+    python worker.py --backfill-checksums # queue checksum jobs for old documents
+    python worker.py --backfill-thumbnails # queue thumbnail jobs for old documents
+    python worker.py --reindex            # queue search indexing jobs for all documents
+"""
+import argparse
+import os
+import signal
+import socket
+import time
+from main import app, check_startup
+from models import db
+from jobs import claim_next_job, run_job, requeue_stale_jobs
+from tombstones import flush_all_tombstones
+from catalog_events import prune_events
+import tasks
+
+# Periodic maintenance: (name, interval in seconds, function)
+PERIODIC_TASKS = [
+    ('requeue_stale_jobs', 60, requeue_stale_jobs),
+    # Retries S3 deletions that failed earlier
+    ('reconcile_tombstones', int(os.getenv('TOMBSTONE_RECONCILE_SECONDS', '300')), flush_all_tombstones),
+    # Keeps catalog_events (the /documents/events feed) to CATALOG_EVENTS_RETENTION_DAYS
+    ('prune_catalog_events', 3600, prune_events),
+]
+
+stopping = False
+
+
+def handle_stop(signum, frame):
+    global stopping
+    print("🛑 Stop requested, finishing current job...")
+    stopping = True
+
+
+def work(poll_interval, once=False):
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    print(f"👷 Worker {worker_id} started")
+    with app.app_context():
+        check_startup(app)
+    last_run = {name: 0 for name, _, _ in PERIODIC_TASKS}
+
+    while not stopping:
+        with app.app_context():
+            for name, interval, func in PERIODIC_TASKS:
+                if time.monotonic() - last_run[name] > interval:
+                    try:
+                        func()
+                    except Exception as e:
+                        db.session.rollback()
+                        print(f"❌ Periodic task {name} failed: {e}")
+                    last_run[name] = time.monotonic()
+
+            job = claim_next_job(worker_id)
+            if job:
+                print(f"🔧 Running job {job.id} ({job.kind}), attempt {job.attempts}")
+                run_job(job)
+                continue
+
+        if once:
+            break
+        time.sleep(poll_interval)
+
+    print(f"👋 Worker {worker_id} stopped")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='SequoAlpha background job worker')
+    parser.add_argument('--once', action='store_true', help='exit when no due jobs are left')
+    parser.add_argument('--poll-interval', type=float,
+                        default=float(os.getenv('JOB_POLL_INTERVAL_SECONDS', '2')))
+    parser.add_argument('--backfill-checksums', action='store_true',
+                        help='queue checksum jobs for documents without one, then exit')
+    parser.add_argument('--backfill-thumbnails', action='store_true',
+                        help='queue thumbnail jobs for documents without one, then exit')
+    parser.add_argument('--reindex', action='store_true',
+                        help='queue search indexing jobs for all documents, then exit')
+    args = parser.parse_args()
+
+    if args.backfill_checksums:
+        with app.app_context():
+            print(f"✅ Queued {tasks.enqueue_checksum_backfill()} checksum job(s)")
+    elif args.backfill_thumbnails:
+        with app.app_context():
+            print(f"✅ Queued {tasks.enqueue_thumbnail_backfill()} thumbnail job(s)")
+    elif args.reindex:
+        with app.app_context():
+            print(f"✅ Queued {tasks.enqueue_reindex()} indexing job(s)")
+    else:
+        signal.signal(signal.SIGTERM, handle_stop)
+        signal.signal(signal.SIGINT, handle_stop)
+        work(args.poll_interval, once=args.once)
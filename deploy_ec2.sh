@@ -112,6 +112,10 @@ echo "📁 Step 12: Setting up uploads directory..."
 mkdir -p "$BACKEND_DIR/uploads"
 chown ubuntu:ubuntu "$BACKEND_DIR/uploads"
 chmod 755 "$BACKEND_DIR/uploads"
+# Shared catalog cache (catalog-cache.db); not in git, and the units need it to exist
+mkdir -p "$BACKEND_DIR/instance"
+chown ubuntu:ubuntu "$BACKEND_DIR/instance"
+chmod 700 "$BACKEND_DIR/instance"
 
 # Initialize database
 echo "💾 Step 13: Initializing database..."
@@ -130,6 +134,15 @@ if [ -f "$APP_DIR/sequoalpha.service" ]; then
 else
     echo "⚠️  sequoalpha.service file not found, skipping systemd setup"
 fi
+if [ -f "$APP_DIR/sequoalpha-worker.service" ]; then
+    cp "$APP_DIR/sequoalpha-worker.service" /etc/systemd/system/
+    systemctl daemon-reload
+    systemctl enable sequoalpha-worker
+    systemctl start sequoalpha-worker
+    echo "✅ Background worker service configured and started"
+else
+    echo "⚠️  sequoalpha-worker.service file not found, skipping worker setup"
+fi
 
 # Setup Nginx
 echo "🌐 Step 15: Setting up Nginx..."
@@ -39,6 +39,56 @@ const DocumentCenter = ({ token, onBack }) => {
     fetchDocuments();
   }, [selectedCategory]);
 
+  // Refresh when the server reports a catalog change, instead of polling
+  const fetchDocumentsRef = React.useRef(null);
+  fetchDocumentsRef.current = () => fetchDocuments(true);
+  React.useEffect(() => {
+    if (!token || !window.EventSource) return;
+
+    let source = null;
+    let refreshTimer = null;
+    let reconnectTimer = null;
+    let stopped = false;
+    // One re-fetch for a burst of events, e.g. an upload followed by its visibility rules
+    const refresh = () => {
+      clearTimeout(refreshTimer);
+      refreshTimer = setTimeout(() => fetchDocumentsRef.current(), 300);
+    };
+    // EventSource cannot send an Authorization header, so it gets a short-lived feed token
+    // (URLs end up in access logs). It reconnects (with Last-Event-ID) by itself until that
+    // token expires; then it is replaced and the list re-fetched for anything missed.
+    const connect = async (reconnecting) => {
+      try {
+        const response = await fetch(`${window.API_BASE_URL}/documents/events/token`, {
+          method: 'POST',
+          headers: { 'Authorization': `Bearer ${token}` }
+        });
+        if (!response.ok || stopped) return;
+        const feed = await response.json();
+        if (stopped) return;
+        source = new EventSource(`${window.API_BASE_URL}/documents/events?token=${encodeURIComponent(feed.token)}`);
+        // reset: the feed could not resume where it left off
+        ['created', 'updated', 'deleted', 'visibility_changed', 'reset'].forEach(kind => source.addEventListener(kind, refresh));
+        source.onerror = () => {
+          if (source.readyState === EventSource.CLOSED && !stopped) {
+            reconnectTimer = setTimeout(() => connect(true), 1000);
+          }
+        };
+        if (reconnecting) refresh();
+      } catch (err) {
+        console.error('Error opening catalog feed:', err);
+      }
+    };
+    connect(false);
+
+    return () => {
+      stopped = true;
+      clearTimeout(refreshTimer);
+      clearTimeout(reconnectTimer);
+      if (source) source.close();
+    };
+  }, [token]);
+
   React.useEffect(() => {
     fetchTagsAndUsers();
     fetchCategories();
@@ -90,9 +140,9 @@ const DocumentCenter = ({ token, onBack }) => {
 
   const resetVisibility = () => ({ allUsers: true, selectedTags: [], selectedUsers: [] });
 
-  const fetchDocuments = async () => {
+  const fetchDocuments = async (quiet = false) => {
     try {
-      setLoading(true);
+      if (!quiet) setLoading(true);
       const response = await fetch(`${window.API_BASE_URL}/admin/documents?category=${selectedCategory}`, {
         headers: { 'Authorization': `Bearer ${token}` }
       });
@@ -9,8 +9,63 @@ const UserDashboard = ({ user, onLogout }) => {
     fetchDocuments();
   }, []);
 
-  const fetchDocuments = async () => {
-    setLoading(true);
+  // Apply catalog changes pushed by the server instead of re-fetching the list
+  React.useEffect(() => {
+    const token = localStorage.getItem('token');
+    if (!token || !window.EventSource) return;
+
+    let source = null;
+    let reconnectTimer = null;
+    let stopped = false;
+    const applyChange = (event) => {
+      const change = JSON.parse(event.data);
+      setDocuments(current => {
+        const others = current.filter(doc => doc.id !== change.document_id);
+        if (!change.visible) return others;
+        const index = current.findIndex(doc => doc.id === change.document_id);
+        if (index === -1) return [...current, change.document];
+        const updated = [...current];
+        updated[index] = change.document;
+        return updated;
+      });
+    };
+    // EventSource cannot send an Authorization header, so it gets a short-lived feed token
+    // (URLs end up in access logs). It reconnects (with Last-Event-ID) by itself until that
+    // token expires; then it is replaced and the list re-fetched for anything missed.
+    const connect = async (reconnecting) => {
+      try {
+        const response = await fetch(`${window.API_BASE_URL}/documents/events/token`, {
+          method: 'POST',
+          headers: { 'Authorization': `Bearer ${token}` }
+        });
+        if (!response.ok || stopped) return;
+        const feed = await response.json();
+        if (stopped) return;
+        source = new EventSource(`${window.API_BASE_URL}/documents/events?token=${encodeURIComponent(feed.token)}`);
+        ['created', 'updated', 'visibility_changed', 'deleted'].forEach(kind => source.addEventListener(kind, applyChange));
+        // The user's tags changed, or the feed could not resume: any document may have appeared or gone
+        ['access_changed', 'reset'].forEach(kind => source.addEventListener(kind, () => fetchDocuments(true)));
+        source.onerror = () => {
+          if (source.readyState === EventSource.CLOSED && !stopped) {
+            reconnectTimer = setTimeout(() => connect(true), 1000);
+          }
+        };
+        if (reconnecting) fetchDocuments(true);
+      } catch (err) {
+        console.error('Error opening catalog feed:', err);
+      }
+    };
+    connect(false);
+
+    return () => {
+      stopped = true;
+      clearTimeout(reconnectTimer);
+      if (source) source.close();
+    };
+  }, []);
+
+  const fetchDocuments = async (quiet = false) => {
+    if (!quiet) setLoading(true);
     setError('');
     
     try {
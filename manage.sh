@@ -4,22 +4,26 @@
 # Usage: ./manage.sh [start|stop|restart|status|logs]
 
 SERVICE_NAME="sequoalpha"
+WORKER_SERVICE_NAME="sequoalpha-worker"
 
 case "$1" in
     start)
         echo "🚀 Starting SequoAlpha..."
         sudo systemctl start $SERVICE_NAME
+        sudo systemctl start $WORKER_SERVICE_NAME
         sudo systemctl start nginx
         echo "✅ Services started"
         ;;
     stop)
         echo "🛑 Stopping SequoAlpha..."
         sudo systemctl stop $SERVICE_NAME
+        sudo systemctl stop $WORKER_SERVICE_NAME
         echo "✅ Service stopped"
         ;;
     restart)
         echo "🔄 Restarting SequoAlpha..."
         sudo systemctl restart $SERVICE_NAME
+        sudo systemctl restart $WORKER_SERVICE_NAME
         sudo systemctl restart nginx
         echo "✅ Services restarted"
         ;;
@@ -27,6 +31,9 @@ case "$1" in
         echo "📊 SequoAlpha Backend Status:"
         sudo systemctl status $SERVICE_NAME --no-pager -l
         echo ""
+        echo "📊 SequoAlpha Worker Status:"
+        sudo systemctl status $WORKER_SERVICE_NAME --no-pager -l
+        echo ""
         echo "📊 Nginx Status:"
         sudo systemctl status nginx --no-pager -l
         ;;
@@ -34,16 +34,26 @@ pip install -r requirements.txt
 echo "💾 Step 3: Running database migrations (if any)..."
 python init_db.py
 
-echo "🔄 Step 4: Restarting backend service..."
+echo "⚙️ Step 4: Installing systemd units..."
+# Writable by the units for the shared catalog cache; hosts deployed before it lack it
+mkdir -p -m 700 "$BACKEND_DIR/instance"
+# Copied on every update so unit changes, and units added since the first deploy, take effect
+sudo cp "$APP_DIR/sequoalpha.service" "$APP_DIR/sequoalpha-worker.service" /etc/systemd/system/
+sudo systemctl daemon-reload
+sudo systemctl enable sequoalpha sequoalpha-worker
+
+echo "🔄 Step 5: Restarting backend and worker services..."
 sudo systemctl restart sequoalpha
+sudo systemctl restart sequoalpha-worker
 
-echo "⏳ Waiting for service to start..."
+echo "⏳ Waiting for services to start..."
 sleep 3
 
-echo "📊 Step 5: Checking service status..."
+echo "📊 Step 6: Checking service status..."
 sudo systemctl status sequoalpha --no-pager -l
+sudo systemctl status sequoalpha-worker --no-pager -l
 
-echo "🌐 Step 6: Restarting Nginx..."
+echo "🌐 Step 7: Restarting Nginx..."
 sudo systemctl restart nginx
 
 echo ""
@@ -51,7 +61,9 @@ echo "✅ Update complete!"
 echo ""
 echo "📋 View logs:"
 echo "   sudo journalctl -u sequoalpha -f"
+echo "   sudo journalctl -u sequoalpha-worker -f"
 echo ""
 echo "🔍 Check status:"
 echo "   sudo systemctl status sequoalpha"
+echo "   sudo systemctl status sequoalpha-worker"
 echo ""